@@ -0,0 +1,54 @@
+"""
+Fetching many pages: one get_page_content call per page vs one get_pages call.
+
+Crawls the fixture site, then times an agent-style lookup of the top search
+hits' content, calling the MCP tool functions directly (so the comparison
+covers the sync_to_async hop and query of each call, not the MCP
+transport, which would add a round trip per call on top).
+
+    python benchmarks/bench_batch_content.py --pages 300 --hits 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from common import FixtureSite, django_test_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--hits', type=int, default=20, help='Pages fetched per lookup')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages) as site:
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage
+        from mcp_server.tools import find_pages, get_page_content, get_pages
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        asyncio.run(CrawlEngine(create_crawl_job(initial_page, rate_limit=0).id).run())
+        with contextlib.redirect_stdout(io.StringIO()): # The tools log every call
+            hits = asyncio.run(find_pages('paragraph', limit=args.hits))
+
+        async def one_by_one():
+            return [await get_page_content(hit['url'], format='markdown') for hit in hits]
+
+        async def batched():
+            return await get_pages(hits)
+
+        for name, lookup in [('get_page_content x N', one_by_one), ('get_pages', batched)]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    results = asyncio.run(lookup())
+                elapsed = (time.perf_counter() - started) / args.repeat
+            print(f"{name:<22} {elapsed * 1000:>8.2f} ms for {len(results)} pages")
+
+
+if __name__ == '__main__':
+    main()
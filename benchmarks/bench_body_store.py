@@ -0,0 +1,54 @@
+"""
+Page body store: database size and page query cost.
+
+Crawls the fixture site, then reports the raw HTML size of the crawled pages
+against what the body store holds (compressed, one row per distinct HTML),
+the size of the SQLite file after VACUUM, and how long loading every
+CrawledPage takes now that the HTML is not part of the row.
+
+    python benchmarks/bench_body_store.py --pages 500
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from common import FixtureSite, django_test_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages) as site:
+        from django.db import connection
+        from django.db.models import Count, Sum
+        from django.db.models.functions import Length
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage, PageBody
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        asyncio.run(CrawlEngine(create_crawl_job(initial_page, rate_limit=0).id).run())
+
+        pages_with_body = CrawledPage.objects.filter(body__isnull=False)
+        raw_bytes = pages_with_body.aggregate(total=Sum('body__size'))['total'] or 0
+        stored = PageBody.objects.aggregate(bodies=Count('hash'), data=Sum(Length('data')))
+        print(f"{pages_with_body.count()} pages: {raw_bytes / 1024:.0f} KB of HTML, stored as {stored['bodies']} bodies "
+              f"in {(stored['data'] or 0) / 1024:.0f} KB ({raw_bytes / max(stored['data'] or 1, 1):.1f}x smaller)")
+
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+        print(f"database file after VACUUM: {os.path.getsize(connection.settings_dict['NAME']) / 1024:.0f} KB")
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            pages = list(CrawledPage.objects.all())
+        elapsed = (time.perf_counter() - started) / args.repeat
+        print(f"loading all {len(pages)} CrawledPage rows: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Crawl throughput: the old sequential loop vs. the concurrent CrawlEngine.
+
+The "sequential loop" row runs the engine with one worker limited to two
+requests per second, which approximates the previous crawl_site (one fetch,
+then a fixed 0.5s sleep). The "engine" row uses the requested concurrency and
+per-host rate (0 means unlimited).
+
+    python benchmarks/bench_crawl_engine.py --pages 100 --latency 0.05 --concurrency 16 --rate 0
+"""
+import argparse
+import asyncio
+import time
+
+from common import FixtureSite, django_test_db
+
+
+def run_crawl(site, concurrency, rate_limit, max_pages):
+    from crawler.engine import CrawlEngine
+    from crawler.jobs import create_crawl_job
+    from crawler.models import CrawledPage
+
+    CrawledPage.objects.all().delete()
+    initial_page = CrawledPage.objects.create(url=site.start_url)
+
+    job = create_crawl_job(initial_page, max_pages=max_pages, concurrency=concurrency, rate_limit=rate_limit)
+    engine = CrawlEngine(job.id)
+    started = time.perf_counter()
+    asyncio.run(engine.run())
+    elapsed = time.perf_counter() - started
+
+    completed = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED).count()
+    return completed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=100, help='Pages in the fixture site')
+    parser.add_argument('--latency', type=float, default=0.05, help='Server latency per response (seconds)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=0.0, help='Per-host requests/sec for the engine run (0 = unlimited)')
+    parser.add_argument('--max-pages', type=int, default=None)
+    parser.add_argument('--parse-workers', type=int, default=0, help='Parse in a process pool of this size (CRAWLER_PARSE_WORKERS)')
+    parser.add_argument('--skip-sequential', action='store_true', help='Only run the engine')
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency) as site:
+        from django.conf import settings
+        settings.CRAWLER_PARSE_WORKERS = args.parse_workers
+
+        runs = []
+        if not args.skip_sequential:
+            runs.append(('sequential loop (1 worker, 2 req/s)', 1, 2.0))
+        parse_label = f', {args.parse_workers} parse procs' if args.parse_workers else ''
+        runs.append((f'engine ({args.concurrency} workers, rate {args.rate or "unlimited"}{parse_label})', args.concurrency, args.rate))
+
+        print(f"Fixture site: {args.pages} pages, {args.latency * 1000:.0f} ms latency")
+        for label, concurrency, rate in runs:
+            completed, elapsed = run_crawl(site, concurrency, rate, args.max_pages)
+            print(f"{label:45s} {completed:6d} pages in {elapsed:7.2f}s  -> {completed / elapsed:8.1f} pages/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Database round trips per crawled page.
+
+Crawls the fixture site (every page links to ~25 others, like a docs nav bar)
+and counts every SQL statement the crawl executes, on any thread, then
+reports queries per crawled page. Use --batch-size to compare write batching
+settings (CRAWLER_DB_BATCH_SIZE).
+
+    python benchmarks/bench_db_writes.py --pages 200 --batch-size 1
+    python benchmarks/bench_db_writes.py --pages 200 --batch-size 50
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from common import FixtureSite, django_test_db
+
+
+class QueryCounter:
+    """Counts statements on every DB connection opened after install(), whatever thread opens it."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db.backends.signals import connection_created
+        connection_created.connect(self._on_connection_created, weak=False)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=None, help='CRAWLER_DB_BATCH_SIZE (default: settings value)')
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency) as site:
+        from django.conf import settings
+        from django.db.models import Count
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage
+
+        if args.batch_size is not None:
+            settings.CRAWLER_DB_BATCH_SIZE = args.batch_size
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        job = create_crawl_job(initial_page, concurrency=args.concurrency, rate_limit=0)
+        counter = QueryCounter()
+        counter.install()
+
+        engine = CrawlEngine(job.id)
+        started = time.perf_counter()
+        asyncio.run(engine.run())
+        elapsed = time.perf_counter() - started
+
+        batch_size = getattr(settings, 'CRAWLER_DB_BATCH_SIZE', None)
+        print(
+            f"batch size {batch_size}: {engine.pages_crawled} pages, {counter.count} queries "
+            f"-> {counter.count / max(engine.pages_crawled, 1):.1f} queries/page, {elapsed:.2f}s"
+        )
+        # Every buffered update must have reached the database
+        statuses = dict(CrawledPage.objects.values_list('status').annotate(Count('id')))
+        print(f"page statuses after the crawl: {statuses}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Charset detection: response.apparent_encoding (statistical detection over the
+whole body, the old behaviour) vs. crawler.encoding.resolve_encoding.
+
+Reports accuracy (decoded text identical to decoding with the true encoding)
+and mean time per page. By default a synthetic multilingual corpus is built in
+memory, with each sample declared via the Content-Type header, via <meta>, or
+not at all. Point --corpus at a directory of saved real pages to use those
+instead; the true encoding is taken from the file name, e.g.
+``lenta-ru.windows-1251.html`` (add ``--header`` to also pass it as the
+Content-Type charset, as a server would).
+
+    python benchmarks/bench_encoding.py
+    python benchmarks/bench_encoding.py --corpus ~/saved-pages --header
+"""
+import argparse
+import codecs
+import time
+from pathlib import Path
+
+import common # noqa: F401 - puts the project root on sys.path
+
+from requests.compat import chardet
+
+from crawler.encoding import resolve_encoding
+
+SAMPLES = {
+    'en': "The quick brown fox — “jumps” over the lazy dog’s café; it costs €5.",
+    'fr': "Le cœur déçu mais l'âme plutôt naïve, Louÿs rêva de crapaüter en canoë au delà des îles.",
+    'de': "Falsches Üben von Xylophonmusik quält jeden größeren Zwerg, sagt Jürgen.",
+    'ru': "Съешь же ещё этих мягких французских булок, да выпей чаю. Широкая электрификация.",
+    'el': "Ξεσκεπάζω την ψυχοφθόρα βδελυγμία. Το ελληνικό κείμενο χρησιμεύει για δοκιμή κωδικοποίησης.",
+    'ja': "いろはにほへと ちりぬるを わかよたれそ つねならむ。日本語のドキュメントです。",
+    'zh': "我能吞下玻璃而不伤身体。这是中文文档的示例段落，用于测试字符集检测。",
+    'ko': "다람쥐 헌 쳇바퀴에 타고파. 키스의 고유조건은 입술끼리 만나야 하고 특별한 기술은 필요치 않다.",
+}
+
+ENCODINGS = {
+    'en': ['utf-8', 'windows-1252'],
+    'fr': ['utf-8', 'windows-1252'],
+    'de': ['utf-8', 'windows-1252'],
+    'ru': ['utf-8', 'windows-1251', 'koi8-r'],
+    'el': ['utf-8', 'iso-8859-7'],
+    'ja': ['utf-8', 'shift_jis', 'euc-jp'],
+    'zh': ['utf-8', 'gbk'],
+    'ko': ['utf-8', 'euc-kr'],
+}
+
+
+def build_page(text, encoding, declare_meta, paragraphs=150):
+    """A ~20 KB page: an ASCII-heavy head and nav, then body text in the target language."""
+    meta = f'<meta charset="{encoding}">' if declare_meta else ''
+    head = (
+        f'<!DOCTYPE html><html><head>{meta}<title>{text[:20]}</title>'
+        '<script>' + 'var config = {"theme": "dark", "search": true};' * 40 + '</script></head><body>'
+    )
+    nav = '<nav>' + ''.join(f'<a href="/docs/{i}">Section {i}</a>' for i in range(60)) + '</nav>'
+    body = ''.join(f'<p>{text} ({i})</p>' for i in range(paragraphs))
+    return (head + nav + f'<main>{body}</main></body></html>').encode(encoding, errors='strict')
+
+
+def synthetic_corpus():
+    """Yields (name, body bytes, content_type header, true encoding)."""
+    for lang, text in SAMPLES.items():
+        for encoding in ENCODINGS[lang]:
+            body_plain = build_page(text, encoding, declare_meta=False)
+            body_meta = build_page(text, encoding, declare_meta=True)
+            yield f'{lang}/{encoding}/header', body_plain, f'text/html; charset={encoding}', encoding
+            yield f'{lang}/{encoding}/meta', body_meta, 'text/html', encoding
+            yield f'{lang}/{encoding}/undeclared', body_plain, 'text/html', encoding
+
+
+def directory_corpus(path, with_header):
+    for file in sorted(Path(path).expanduser().glob('*.html')):
+        encoding = file.suffixes[-2].lstrip('.') if len(file.suffixes) >= 2 else 'utf-8'
+        content_type = f'text/html; charset={encoding}' if with_header else 'text/html'
+        yield file.name, file.read_bytes(), content_type, encoding
+
+
+def apparent_encoding(body, content_type):
+    # What requests' Response.apparent_encoding does: detection over the full body
+    return chardet.detect(body)['encoding'] or 'utf-8'
+
+
+def same_text(body, guessed, true_encoding):
+    try:
+        return body.decode(guessed, errors='replace') == body.decode(true_encoding, errors='replace')
+    except LookupError:
+        return False
+
+
+def measure(resolver, corpus, repeat):
+    correct = 0
+    failures = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for name, body, content_type, encoding in corpus:
+            resolver(body, content_type)
+    elapsed = time.perf_counter() - started
+    for name, body, content_type, encoding in corpus:
+        guessed = resolver(body, content_type)
+        if same_text(body, guessed, encoding):
+            correct += 1
+        else:
+            failures.append(f'{name}: guessed {guessed}, expected {codecs.lookup(encoding).name}')
+    return correct, elapsed / (repeat * len(corpus)), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='Directory of saved pages named <name>.<encoding>.html')
+    parser.add_argument('--header', action='store_true', help='Pass the true charset in the Content-Type header')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--show-failures', action='store_true')
+    args = parser.parse_args()
+
+    corpus = list(directory_corpus(args.corpus, args.header) if args.corpus else synthetic_corpus())
+    average_kb = sum(len(body) for _, body, _, _ in corpus) / len(corpus) / 1024
+    print(f"Corpus: {len(corpus)} pages, {average_kb:.1f} KB average")
+
+    for label, resolver in (('apparent_encoding (old)', apparent_encoding), ('resolve_encoding', resolve_encoding)):
+        correct, per_page, failures = measure(resolver, corpus, args.repeat)
+        print(f"{label:25s} accuracy {correct}/{len(corpus)} ({100 * correct / len(corpus):5.1f}%)  {per_page * 1000:8.3f} ms/page")
+        if args.show_failures:
+            for failure in failures:
+                print(f"    {failure}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+HTML extraction backends: speed and equivalence.
+
+Runs every registered extractor over a corpus, reports mean time per page,
+and checks that each backend returns exactly the same (title, description,
+links, content) as the BeautifulSoup reference. Exits with status 1 if any
+page differs, so it doubles as an equivalence test. Also reports how large
+the extracted Markdown content is compared with the HTML.
+
+Without --corpus a synthetic corpus is used: fixture-site pages with large
+navigation blocks plus a set of awkward documents (missing/empty titles, SVG
+titles, entities, upper-case tags, XML declarations, broken markup). Point
+--corpus at a directory of saved real pages (*.html, any encoding) to use
+those instead.
+
+    python benchmarks/bench_extractors.py
+    python benchmarks/bench_extractors.py --corpus ~/saved-pages
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import common # noqa: F401 - puts the project root on sys.path
+from common import render_page
+
+from crawler.encoding import resolve_encoding
+from crawler.extractors import EXTRACTORS, SoupExtractor
+
+EDGE_CASES = [
+    '<html><head></head><body><a href="/a">A</a></body></html>',
+    '<html><head><title></title></head><body><a href=" /b ">B</a><a href="">empty</a><a>none</a></body></html>',
+    '<html><head><title>One <!-- c --> Two</title></head><body></body></html>',
+    '<html><body><svg><title>Icon</title></svg><title>Late</title><a href="/c">C</a></body></html>',
+    '<HTML><HEAD><TITLE> Upper &amp; Case </TITLE><META NAME="description" CONTENT=" Shouting "></HEAD>'
+    '<BODY><A HREF="/D?x=1&amp;y=2">D</A></BODY></HTML>',
+    '<?xml version="1.0" encoding="utf-8"?><!DOCTYPE html><html xmlns="http://www.w3.org/1999/xhtml">'
+    '<head><title>XHTML</title><meta name="description" content="xml decl"/></head><body><a href="/e">E</a></body></html>',
+    '<html><head><meta name="description"><meta name="description" content="second"></head><body></body></html>',
+    '<html><head><title>Café &mdash; 日本語</title></head><body><a href="/f#frag">F</a><p><a href="/g">G<div></body>',
+    '<title>No html element</title><meta name="Description" content="wrong case"><a href="/h">H</a><a href="/h">dup</a>',
+    '',
+]
+
+
+def synthetic_corpus(pages=60):
+    corpus = [(f'edge-{i}', html) for i, html in enumerate(EDGE_CASES)]
+    for index in range(pages):
+        html = render_page(index, 400, nav_links=300, body_paragraphs=200)
+        corpus.append((f'fixture-{index}', html))
+    return corpus
+
+
+def directory_corpus(path):
+    corpus = []
+    for file in sorted(Path(path).expanduser().rglob('*.htm*')):
+        body = file.read_bytes()
+        corpus.append((str(file), body.decode(resolve_encoding(body), errors='replace')))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='Directory of saved HTML pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = directory_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    average_kb = sum(len(html) for _, html in corpus) / len(corpus) / 1024
+    print(f"Corpus: {len(corpus)} pages, {average_kb:.1f} KB average")
+
+    reference = SoupExtractor()
+    expected = {name: reference.extract(html, name) for name, html in corpus}
+    html_bytes = sum(len(html.encode('utf-8')) for _, html in corpus)
+    content_bytes = sum(len(expected[name][3].encode('utf-8')) for name, _ in corpus)
+    print(f"Main content: {content_bytes / max(html_bytes, 1):.1%} of the HTML bytes")
+
+    mismatches = 0
+    for backend_name, extractor_class in EXTRACTORS.items():
+        extractor = extractor_class()
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            for name, html in corpus:
+                extractor.extract(html, name)
+        per_page = (time.perf_counter() - started) / (args.repeat * len(corpus))
+
+        differing = [name for name, html in corpus if extractor.extract(html, name) != expected[name]]
+        mismatches += len(differing)
+        print(f"{backend_name:8s} {per_page * 1000:8.3f} ms/page   {len(corpus) - len(differing)}/{len(corpus)} identical to soup")
+        for name in differing:
+            print(f"    {name}: {extractor.extract(dict(corpus)[name], name)!r} != {expected[name]!r}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Fetch failures: pages saved from a rate-limiting, flaky host, and requests
+spent on a dead one.
+
+1. The fixture site answers at most `--capacity` requests per second (429
+   with Retry-After: 1 beyond that) and fails `--error-rate` of the rest with
+   a 503. It is crawled once with retries and circuit breakers off (every
+   failure is final, as before) and once with the defaults.
+2. A site whose pages all fail with 503 after the start page: crawled with
+   retries but no circuit breaker, then with one (short cooldown), counting
+   the requests each sends before giving up.
+
+Prints pages saved and failed, requests and 429s served, and the failed
+pages' error categories.
+
+    python benchmarks/bench_fetch_errors.py --pages 300 --capacity 50 --error-rate 0.1
+"""
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from common import FixtureSite, django_test_db
+
+
+class FlakySite(FixtureSite):
+    """A FixtureSite that rate-limits with 429 + Retry-After, and fails some (or, when `down`, all) pages with 503."""
+
+    def __init__(self, capacity=None, error_rate=0.0, down=False, **kwargs):
+        super().__init__(**kwargs)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.down = down
+        self.rate_limited_served = 0
+        self._random = random.Random(42)
+        self._window = (0, 0) # (second, requests answered in it)
+        self._flaky_lock = threading.Lock()
+        # The crawler drops error responses without reading their body; don't print the resets
+        self._server.handle_error = lambda request, client_address: None
+
+    def respond(self, path, request_headers=None):
+        if path == '/robots.txt':
+            return super().respond(path, request_headers)
+        with self._flaky_lock:
+            if self.capacity:
+                second = int(time.monotonic())
+                window_second, answered = self._window
+                answered = answered + 1 if second == window_second else 1
+                self._window = (second, answered)
+                if answered > self.capacity:
+                    self.rate_limited_served += 1
+                    return 429, {'Content-Type': 'text/plain', 'Retry-After': '1'}, b'slow down'
+            failing = (self.down and not path.startswith('/docs/page-0.html')) or self._random.random() < self.error_rate
+        if failing:
+            return 503, {'Content-Type': 'text/plain'}, b'unavailable'
+        return super().respond(path, request_headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--capacity', type=int, default=50, help='Requests per second the flaky site answers')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='Fraction of the flaky site\'s responses that are 503s')
+    parser.add_argument('--latency', type=float, default=0.005, help='Fixture server latency per response (seconds)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    with django_test_db():
+        logging.getLogger().setLevel(logging.CRITICAL) # Every failed fetch logs an error
+        from django.conf import settings
+        from crawler.canonical import DEFAULT_STRIP_PARAMS
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage, CrawlJob
+
+        # The fixture's "related" links carry ?ref=related; count each page once
+        settings.CRAWLER_URL_STRIP_PARAMS = DEFAULT_STRIP_PARAMS + ('ref',)
+        settings.CRAWLER_RETRY_BACKOFF = 0.25
+        settings.CRAWLER_BREAKER_COOLDOWN = 0.25
+        defaults = {'CRAWLER_FETCH_RETRIES': settings.CRAWLER_FETCH_RETRIES, 'CRAWLER_BREAKER_THRESHOLD': settings.CRAWLER_BREAKER_THRESHOLD}
+
+        def crawl(label, site, **overrides):
+            for name, value in {**defaults, **overrides}.items():
+                setattr(settings, name, value)
+            CrawledPage.objects.all().delete()
+            site.requests_served = site.rate_limited_served = 0
+            initial_page = CrawledPage.objects.create(url=site.start_url)
+            job = create_crawl_job(initial_page, concurrency=args.concurrency, rate_limit=0, use_sitemaps=False)
+            started = time.perf_counter()
+            asyncio.run(CrawlEngine(job.id).run())
+            elapsed = time.perf_counter() - started
+            job = CrawlJob.objects.get(pk=job.id)
+            categories = Counter(CrawledPage.objects.filter(status=CrawledPage.StatusChoices.FAILED).values_list('error_category', flat=True))
+            print(f"{label:<34} {job.pages_crawled:>6} {job.pages_failed:>6} {site.requests_served:>6} "
+                  f"{site.rate_limited_served:>6} {elapsed:>7.2f}  {dict(categories.most_common())}")
+
+        print(f"{args.pages} pages, {args.concurrency} concurrent fetches")
+        print(f"{'':<34} {'saved':>6} {'failed':>6} {'reqs':>6} {'429':>6} {'seconds':>7}  failed by category")
+        flaky = FlakySite(capacity=args.capacity, error_rate=args.error_rate, pages=args.pages, latency=args.latency)
+        with flaky:
+            print(f"flaky host ({args.capacity} req/s, {args.error_rate:.0%} 503s):")
+            crawl('  no retries, no breaker', flaky, CRAWLER_FETCH_RETRIES=0, CRAWLER_BREAKER_THRESHOLD=10 ** 9)
+            crawl('  retries + adaptive concurrency', flaky)
+
+        dead = FlakySite(down=True, pages=args.pages, latency=args.latency)
+        with dead:
+            print("dead host (503 after the start page):")
+            crawl('  retries, no breaker', dead, CRAWLER_BREAKER_THRESHOLD=10 ** 9)
+            crawl('  retries + circuit breaker', dead)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Link filtering cost and per-rule drop counts.
+
+1. Filters the links of `--pages` synthetic pages (each with `--nav-links`
+   navigation links, the same on every page) through tasks.LinkFilter with
+   `--rules` exclude rules: once with a fresh filter per page (no memo, as
+   before), once with one filter for the whole crawl (memoized).
+2. Crawls the fixture site with an exclude rule dropping odd-numbered pages
+   and prints the job's links_dropped counts.
+
+    python benchmarks/bench_link_rules.py --pages 500 --nav-links 100 --rules 20
+"""
+import argparse
+import asyncio
+import time
+
+from common import FixtureSite, django_test_db, render_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--nav-links', type=int, default=100)
+    parser.add_argument('--rules', type=int, default=20, help='Exclude rules, about half globs and half regexes')
+    args = parser.parse_args()
+
+    with django_test_db():
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage, CrawlJob
+        from crawler.tasks import LinkFilter, parse_and_extract
+
+        exclude = [
+            f'/archive/{i}/*' if i % 2 else f're:^/changelog/v{i}\\.' for i in range(args.rules)
+        ]
+        base_url = 'http://docs.example.com'
+        pages = []
+        for index in range(args.pages):
+            url = f'{base_url}/docs/page-{index}.html'
+            _, _, links, _ = parse_and_extract(render_page(index, args.pages, nav_links=args.nav_links), url)
+            pages.append((url, links))
+        total_links = sum(len(links) for _, links in pages)
+
+        results = {}
+        for label, per_page in [('fresh filter per page', True), ('one memoized filter', False)]:
+            link_filter = LinkFilter('docs.example.com', exclude=exclude)
+            started = time.perf_counter()
+            for url, links in pages:
+                if per_page:
+                    link_filter = LinkFilter('docs.example.com', exclude=exclude)
+                results[label] = link_filter.filter(links, url)
+            elapsed = time.perf_counter() - started
+            print(f"{label:<24} {total_links} links in {elapsed * 1000:7.1f} ms  ->  {elapsed / total_links * 1e6:.2f} us/link")
+        assert len({tuple(sorted(valid)) for valid, _ in results.values()}) == 1
+
+        with FixtureSite(pages=200, latency=0) as site:
+            for label, rules in [('no rules', ''), ('exclude odd pages', 're:page-\\d*[13579]\\.html')]:
+                CrawledPage.objects.all().delete()
+                site.requests_served = 0
+                initial_page = CrawledPage.objects.create(url=site.start_url)
+                job = create_crawl_job(initial_page, concurrency=16, rate_limit=0, exclude_rules=rules)
+                asyncio.run(CrawlEngine(job.id).run())
+                job = CrawlJob.objects.get(pk=job.id)
+                print(f"{label:<18} {site.requests_served:>4} requests, dropped: {job.links_dropped}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+MCP tool latency under concurrent clients while a crawl is writing.
+
+Crawls the fixture site once so there is something to read, then keeps
+re-crawling it in a background thread while `--clients` concurrent clients
+call the MCP tool functions (find_pages, get_page_content, get_page_outline,
+get_pages) in a loop for `--duration` seconds. Reports p50 / p99 latency per
+tool and the crawl's write rate meanwhile.
+
+By default the tools read on the thread pool (mcp_server.tools.read_only);
+`--shared-thread` runs them the old way, all on sync_to_async's one shared
+thread, for comparison. `--replica` sends their reads to a second, read-only
+connection alias through crawler.routers.
+
+    python benchmarks/bench_mcp_load.py --clients 32 --duration 10
+    python benchmarks/bench_mcp_load.py --clients 32 --duration 10 --shared-thread
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import threading
+import time
+
+from common import FixtureSite, django_test_db
+
+KEYWORDS = ['lorem', 'paragraph 3', 'page 17', 'tempor incididunt', 'revision', 'dolore magna', 'missingword']
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1000
+
+
+def add_replica_alias():
+    """A read-only connection to the benchmark database, as CRAWLER_READ_DATABASE."""
+    from django.conf import settings
+    from django.db import connections
+
+    replica = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{connections['default'].settings_dict['NAME']}?mode=ro",
+    }
+    settings.DATABASES['replica'] = replica
+    connections.settings['replica'] = connections.configure_settings(
+        {'default': connections.settings['default'], 'replica': replica}
+    )['replica']
+    settings.CRAWLER_READ_DATABASE = 'replica'
+
+
+def keep_crawling(site, stop, crawled):
+    from django.db import connections
+    from crawler.engine import CrawlEngine
+    from crawler.jobs import create_crawl_job
+    from crawler.models import CrawledPage
+
+    while not stop.is_set():
+        initial_page = CrawledPage.objects.get(url=site.start_url)
+        job = create_crawl_job(initial_page, concurrency=16, rate_limit=0)
+        asyncio.run(CrawlEngine(job.id).run())
+        job.refresh_from_db()
+        crawled.append(job.pages_crawled)
+    connections.close_all()
+
+
+async def client(tools, urls, deadline, latencies, rng):
+    find_pages, get_page_content, get_page_outline, get_pages = tools
+    calls = [
+        ('find_pages', lambda: find_pages(rng.choice(KEYWORDS), limit=20)),
+        ('get_page_content', lambda: get_page_content(rng.choice(urls), format='markdown')),
+        ('get_page_outline', lambda: get_page_outline(rng.choice(urls))),
+        ('get_pages', lambda: get_pages(rng.sample(urls, 10), max_chars=2000)),
+    ]
+    while time.perf_counter() < deadline:
+        name, call = rng.choice(calls)
+        started = time.perf_counter()
+        await call()
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.005, help='Fixture server latency per response (seconds)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--shared-thread', action='store_true', help='Run tool reads on the one shared sync thread')
+    parser.add_argument('--replica', action='store_true', help='Read through a second, read-only connection alias')
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency) as site:
+        from asgiref.sync import sync_to_async
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage
+        from mcp_server import tools
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        asyncio.run(CrawlEngine(create_crawl_job(initial_page, concurrency=16, rate_limit=0).id).run())
+        urls = list(CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED).values_list('url', flat=True))
+        if args.replica:
+            add_replica_alias()
+        if args.shared_thread:
+            tools.read_only = sync_to_async # The tools look it up on every call
+
+        stop, crawled = threading.Event(), []
+        crawler = threading.Thread(target=keep_crawling, args=(site, stop, crawled))
+        crawler.start()
+        time.sleep(0.5) # Let the crawl get going
+
+        latencies = {}
+        rng = random.Random(42)
+        deadline = time.perf_counter() + args.duration
+        tool_functions = (tools.find_pages, tools.get_page_content, tools.get_page_outline, tools.get_pages)
+
+        async def run_clients():
+            await asyncio.gather(*(
+                client(tool_functions, urls, deadline, latencies, random.Random(rng.random()))
+                for _ in range(args.clients)
+            ))
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # The tools log every call
+            asyncio.run(run_clients())
+        elapsed = time.perf_counter() - started
+        stop.set()
+        crawler.join()
+
+        mode = 'shared thread' if args.shared_thread else 'thread pool'
+        print(f"{args.clients} clients for {elapsed:.1f}s ({mode}{', read replica' if args.replica else ''}), "
+              f"{sum(crawled)} pages crawled in {len(crawled)} crawls meanwhile")
+        print(f"{'tool':<18} {'calls':>7} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+        everything = []
+        for name, values in sorted(latencies.items()):
+            everything += values
+            print(f"{name:<18} {len(values):>7} {percentile(values, 0.5):>8.1f} {percentile(values, 0.99):>8.1f} "
+                  f"{statistics.mean(values) * 1000:>8.1f}")
+        print(f"{'all':<18} {len(everything):>7} {percentile(everything, 0.5):>8.1f} {percentile(everything, 0.99):>8.1f} "
+              f"{statistics.mean(everything) * 1000:>8.1f}  ({len(everything) / elapsed:.0f} calls/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Sectioned retrieval of a large page.
+
+Stores one synthetic reference page of a few MB of Markdown (many headed
+sections, as extracted at crawl time) and reports the latency and response
+size of get_page_content's whole-page Markdown against the outline and a
+single section, as served by crawler.content.
+
+    python benchmarks/bench_page_sections.py --sections 2000
+"""
+import argparse
+import json
+import random
+import time
+
+from common import django_test_db
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def make_markdown(rng, sections, paragraphs):
+    parts = []
+    for i in range(sections):
+        parts.append(f"{'#' * (1 + i % 3)} Section {i}")
+        for _ in range(paragraphs):
+            parts.append(' '.join(f"word{rng.randrange(5000)}" for _ in range(60)))
+        parts.append(f"```\n# comment in the code of section {i}\nprint({i})\n```")
+    return '\n\n'.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=1000)
+    parser.add_argument('--paragraphs', type=int, default=4, help='Paragraphs per section')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with django_test_db():
+        from crawler.content import load_page_content, load_page_outline, markdown_outline
+        from crawler.models import CrawledPage
+
+        markdown = make_markdown(random.Random(42), args.sections, args.paragraphs)
+        started = time.perf_counter()
+        outline = markdown_outline(markdown)
+        print(f"{len(markdown) / 1e6:.1f} MB of Markdown, {len(outline)} sections "
+              f"(outline computed in {(time.perf_counter() - started) * 1000:.1f} ms)")
+        url = 'https://docs.example.com/reference.html'
+        CrawledPage.objects.create(
+            url=url, status=CrawledPage.StatusChoices.COMPLETED,
+            content_markdown=markdown, content_outline=outline,
+        )
+        pages = CrawledPage.objects.all()
+
+        middle = len(outline) // 2
+        print(f"{'request':<24} {'ms':>8} {'response KB':>12}")
+        for name, request in [
+            ('whole page', lambda: load_page_content(pages, url, 'markdown')),
+            ('outline', lambda: load_page_outline(pages, url)),
+            (f'section {middle}', lambda: load_page_content(pages, url, 'markdown', section=middle)),
+            ('4000 characters', lambda: load_page_content(pages, url, 'markdown', offset=len(markdown) // 2, length=4000)),
+        ]:
+            elapsed, result = timed(lambda: json.dumps(request()), args.repeat)
+            print(f"{name:<24} {elapsed:>8.2f} {len(result) / 1024:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Crawl order under max_pages, and the cost of the priority frontier.
+
+1. Crawls a blog-like fixture site whose home page links to tag and archive
+   listings (each paginated, `--listing-pages` pages deep) and to a reference
+   index that links to `--key-pages` reference pages. With `--max-pages`,
+   counts how many reference pages each crawl reaches: once with every
+   priority weight and pattern zeroed (first queued, first crawled: the old
+   breadth-first order) and once with the default scoring. Also checks that
+   each crawl stops at exactly max_pages crawled pages.
+2. Pushes `--frontier-size` URLs with random priorities into a HostScheduler,
+   reprioritizes a tenth of them and pops them all, timing each operation,
+   and times UrlScorer.score().
+
+    python benchmarks/bench_priority.py --key-pages 100 --max-pages 200 --frontier-size 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import FixtureSite, django_test_db
+
+
+class BlogSite(FixtureSite):
+    """Home page -> tag and archive listings (paginated) and a reference index -> reference pages."""
+
+    def __init__(self, key_pages, tags, archives, listing_pages, **kwargs):
+        super().__init__(**kwargs)
+        self.key_pages = key_pages
+        self.listings = [f'/archive/{2000 + i}/' for i in range(archives)] + [f'/tag/topic-{i}/' for i in range(tags)]
+        self.listing_pages = listing_pages
+
+    @property
+    def start_url(self):
+        return f'{self.base_url}/'
+
+    def respond(self, path, request_headers=None):
+        path = path.split('?', 1)[0]
+        if path == '/':
+            links = self.listings + ['/reference/']
+        elif path == '/reference/':
+            links = [f'/reference/item-{i}.html' for i in range(self.key_pages)]
+        elif path.startswith('/reference/item-'):
+            links = ['/', '/reference/']
+        elif any(path.startswith(listing) for listing in self.listings):
+            listing = path.split('/page/')[0]
+            if not listing.endswith('/'):
+                listing += '/'
+            # Every listing page links to all of its listing's pages, as numbered pagination does
+            links = [f'{listing}page/{n}/' for n in range(2, self.listing_pages + 1)]
+        else:
+            return 404, {'Content-Type': 'text/plain'}, b'not found'
+        anchors = ''.join(f'<li><a href="{link}">{link}</a></li>' for link in links)
+        body = f'<!DOCTYPE html><html><head><title>{path}</title></head><body><main><h1>{path}</h1><ul>{anchors}</ul></main></body></html>'
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf-8')
+
+
+def crawl_order(args):
+    from django.conf import settings
+    from crawler.engine import CrawlEngine
+    from crawler.jobs import create_crawl_job
+    from crawler.models import CrawledPage, CrawlJob
+
+    defaults = {name: getattr(settings, name) for name in (
+        'CRAWLER_PRIORITY_DEPTH_WEIGHT', 'CRAWLER_PRIORITY_INLINK_WEIGHT',
+        'CRAWLER_PRIORITY_SITEMAP_WEIGHT', 'CRAWLER_PRIORITY_PATTERNS',
+    )}
+    unweighted = {name: () if name.endswith('PATTERNS') else 0 for name in defaults}
+
+    site = BlogSite(args.key_pages, args.tags, args.archives, args.listing_pages, latency=args.latency)
+    with site:
+        print(f"{len(site.listings)} listings x {args.listing_pages} pages, {args.key_pages} reference pages, "
+              f"max_pages={args.max_pages}")
+        print(f"{'':<26} {'crawled':>7} {'reference':>9} {'requests':>8} {'seconds':>7}")
+        for label, weights in [('first queued, first out', unweighted), ('priority (defaults)', defaults)]:
+            for name, value in weights.items():
+                setattr(settings, name, value)
+            CrawledPage.objects.all().delete()
+            site.requests_served = 0
+            initial_page = CrawledPage.objects.create(url=site.start_url)
+            job = create_crawl_job(initial_page, max_pages=args.max_pages, concurrency=args.concurrency, rate_limit=0,
+                                   use_sitemaps=False)
+            started = time.perf_counter()
+            asyncio.run(CrawlEngine(job.id).run())
+            elapsed = time.perf_counter() - started
+            job = CrawlJob.objects.get(pk=job.id)
+            reference = CrawledPage.objects.filter(
+                url__contains='/reference/item-', status=CrawledPage.StatusChoices.COMPLETED,
+            ).count()
+            print(f"{label:<26} {job.pages_crawled:>7} {reference:>9} {site.requests_served:>8} {elapsed:>7.2f}")
+            assert job.pages_crawled == args.max_pages, f"crawled {job.pages_crawled} pages with max_pages={args.max_pages}"
+        for name, value in defaults.items():
+            setattr(settings, name, value)
+
+
+async def frontier_ops(size):
+    from crawler.politeness import HostScheduler
+
+    rng = random.Random(42)
+    urls = [f'http://example.com/docs/{i}.html' for i in range(size)]
+    priorities = [rng.randint(-100, 100) for _ in range(size)]
+    frontier = HostScheduler(rate=0, respect_robots=False)
+
+    started = time.perf_counter()
+    for url, priority in zip(urls, priorities):
+        frontier.push(url, 1, priority)
+    pushed = time.perf_counter()
+    bumped = rng.sample(urls, size // 10)
+    for url in bumped:
+        frontier.reprioritize(url, frontier.priority(url) + 5)
+    reprioritized = time.perf_counter()
+    served = []
+    for _ in range(size):
+        url, _ = await frontier.get()
+        served.append(url)
+        frontier.task_done(url)
+    popped = time.perf_counter()
+    assert len(frontier) == 0
+
+    final = dict(zip(urls, priorities))
+    for url in bumped:
+        final[url] += 5
+    order = [final[url] for url in served]
+    assert order == sorted(order, reverse=True), 'URLs were not served highest priority first'
+
+    print(f"frontier of {size} URLs: push {(pushed - started) / size * 1e6:.2f} us, "
+          f"reprioritize {(reprioritized - pushed) / len(bumped) * 1e6:.2f} us, "
+          f"get {(popped - reprioritized) / size * 1e6:.2f} us per URL")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--key-pages', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=30)
+    parser.add_argument('--archives', type=int, default=10)
+    parser.add_argument('--listing-pages', type=int, default=20, help='Pages per tag / archive listing')
+    parser.add_argument('--max-pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.002, help='Fixture server latency per response (seconds)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--frontier-size', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with django_test_db():
+        crawl_order(args)
+        asyncio.run(frontier_ops(args.frontier_size))
+
+        from crawler.priority import get_url_scorer
+        scorer = get_url_scorer()
+        urls = [f'http://example.com/tag/topic-{i % 50}/page/{i}/' for i in range(100000)]
+        started = time.perf_counter()
+        for url in urls:
+            scorer.score(url, 2)
+        print(f"UrlScorer.score: {(time.perf_counter() - started) / len(urls) * 1e6:.2f} us per URL")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Incremental re-crawl: a full crawl of the fixture site, then a refresh crawl
+after a fraction of the pages changed. Reports time, requests and how many
+pages came back 304 Not Modified.
+
+    python benchmarks/bench_refresh.py --pages 200 --changed 0.05
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import FixtureSite, django_test_db
+
+
+def crawl(site, initial_page, refresh, concurrency):
+    from crawler.engine import CrawlEngine
+    from crawler.jobs import create_crawl_job
+
+    job = create_crawl_job(initial_page, concurrency=concurrency, rate_limit=0, refresh=refresh)
+    engine = CrawlEngine(job.id)
+    requests_before = site.requests_served
+    started = time.perf_counter()
+    asyncio.run(engine.run())
+    return time.perf_counter() - started, site.requests_served - requests_before, engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--changed', type=float, default=0.05, help='Fraction of pages modified before the refresh')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency) as site:
+        from crawler.models import CrawledPage
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        elapsed, requests_made, engine = crawl(site, initial_page, False, args.concurrency)
+        print(f"full crawl:    {engine.pages_crawled:5d} pages, {requests_made:5d} requests in {elapsed:6.2f}s")
+
+        site.touch(random.Random(0).sample(range(args.pages), int(args.pages * args.changed)))
+        not_modified_before = site.not_modified_served
+        elapsed, requests_made, engine = crawl(site, initial_page, True, args.concurrency)
+        print(
+            f"refresh crawl: {engine.pages_crawled:5d} pages, {requests_made:5d} requests in {elapsed:6.2f}s, "
+            f"{site.not_modified_served - not_modified_before} answered 304, {engine.pages_unchanged} kept unchanged"
+        )
+
+
+if __name__ == '__main__':
+    main()
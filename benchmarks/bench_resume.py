@@ -0,0 +1,71 @@
+"""
+Resuming an interrupted crawl job from its persisted frontier.
+
+Starts a crawl of the fixture site, kills it part way through (the event loop
+is torn down mid-crawl, like a process restart: buffered writes are lost and
+pages are left PROCESSING), reclaims the stale job and resumes it. Reports how
+many requests the resumed run needed compared with crawling from scratch.
+
+    python benchmarks/bench_resume.py --pages 200 --interrupt-after 1.0
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from common import FixtureSite, django_test_db
+
+
+async def run_for(engine, seconds):
+    try:
+        await asyncio.wait_for(engine.run(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--interrupt-after', type=float, default=1.0, help='Seconds before the first run is killed')
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency) as site:
+        from django.utils import timezone
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job, reclaim_stale_jobs
+        from crawler.models import CrawledPage, CrawlJob
+
+        initial_page = CrawledPage.objects.create(url=site.start_url)
+        job = create_crawl_job(initial_page, concurrency=args.concurrency, rate_limit=0)
+
+        asyncio.run(run_for(CrawlEngine(job.id), args.interrupt_after))
+        interrupted_requests = site.requests_served
+        job.refresh_from_db()
+        processing = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.PROCESSING).count()
+        print(
+            f"interrupted: {interrupted_requests} requests, job {job.status} with {job.pages_crawled} pages recorded, "
+            f"{processing} pages left PROCESSING"
+        )
+
+        # The killed process no longer renews its lease; pretend it has run out
+        CrawlJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        print(f"reclaimed jobs: {reclaim_stale_jobs()}")
+
+        engine = CrawlEngine(job.id)
+        started = time.perf_counter()
+        asyncio.run(engine.run())
+        elapsed = time.perf_counter() - started
+        job.refresh_from_db()
+        resumed_requests = site.requests_served - interrupted_requests
+        statuses = dict((status, CrawledPage.objects.filter(status=status).count()) for status in CrawledPage.StatusChoices.values)
+        print(
+            f"resumed:     {resumed_requests} requests in {elapsed:.2f}s, job {job.status} with {job.pages_crawled} pages; "
+            f"{interrupted_requests + resumed_requests} requests in total for {CrawledPage.objects.count()} pages"
+        )
+        print(f"page statuses: {statuses}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Page search: full-text index vs substring matching.
+
+Fills a throwaway database with synthetic completed pages (Zipf-distributed
+words, so there are common and rare terms), indexes them, and reports the
+mean latency of the top-50 query used by find_pages for a set of keywords:
+once with the old title/summary LIKE scan and once through
+crawler.search.full_text_search. Also counts the matches that only the
+full-text index can find (words that appear in the page text alone), and
+compares reading a deep page of results with OFFSET against a keyset cursor
+and a search answered by the search cache against the search itself.
+
+    python benchmarks/bench_search.py --pages 50000
+"""
+import argparse
+import random
+import time
+
+from common import django_test_db
+
+VOCABULARY = [f"term{i}" for i in range(5000)]
+
+
+def make_text(rng, words):
+    # Zipf-like: low-numbered terms are far more common than high-numbered ones
+    return ' '.join(VOCABULARY[min(int(rng.paretovariate(1.0)) - 1, len(VOCABULARY) - 1)] for _ in range(words))
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=300, help='Words of text per page')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with django_test_db():
+        from django.db import transaction
+        from django.db.models import Q
+        from crawler.models import CrawledPage, PageBody
+        from crawler.search import full_text_search, index_pages, search_backend, search_results
+        from crawler.search_cache import SearchCache, bump_generations
+
+        rng = random.Random(42)
+        started = time.perf_counter()
+        for start in range(0, args.pages, 1000):
+            pages, texts, bodies = [], {}, {}
+            for i in range(start, min(start + 1000, args.pages)):
+                text = make_text(rng, args.words)
+                body = PageBody.from_html(f"<html><body><p>{text}</p></body></html>")
+                bodies[body.hash] = body
+                pages.append(CrawledPage(
+                    url=f"https://docs.example.com/page-{i}.html", domain='docs.example.com',
+                    title=make_text(rng, 6), summary=make_text(rng, 20),
+                    body=body,
+                    status=CrawledPage.StatusChoices.COMPLETED,
+                ))
+                texts[pages[-1].url] = text
+            with transaction.atomic():
+                PageBody.objects.bulk_create(bodies.values(), ignore_conflicts=True)
+                CrawledPage.objects.bulk_create(pages)
+                index_pages(
+                    (page.pk, page.title, page.summary, texts[page.url])
+                    for page in CrawledPage.objects.filter(url__in=list(texts)).only('id', 'url', 'title', 'summary')
+                )
+        print(f"{args.pages} pages created and indexed in {time.perf_counter() - started:.1f}s "
+              f"(index backend: {search_backend() or 'none'})")
+
+        completed = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED).only(
+            'url', 'title', 'summary', 'domain', 'updated_at'
+        )
+        print(f"{'keyword':<20} {'LIKE ms':>9} {'hits':>5} {'FTS ms':>9} {'hits':>5}")
+        for keyword in ['term1', 'term7', 'term120', 'term4000', 'term3 term9', 'missingword']:
+            like_ms, like_hits = timed(lambda: list(completed.filter(
+                Q(title__icontains=keyword) | Q(summary__icontains=keyword)
+            ).order_by('-updated_at')[:50]), args.repeat)
+            fts_ms, fts_hits = timed(lambda: list(full_text_search(completed, keyword)[:50]), args.repeat)
+            print(f"{keyword:<20} {like_ms:>9.2f} {len(like_hits):>5} {fts_ms:>9.2f} {len(fts_hits):>5}")
+
+        # Matches in the page text, which the LIKE search never looked at
+        keyword = 'term250'
+        like_total = completed.filter(Q(title__icontains=keyword) | Q(summary__icontains=keyword)).count()
+        fts_total = full_text_search(completed, keyword).count()
+        print(f"'{keyword}': {like_total} pages by title/summary substring, {fts_total} by full text")
+
+        # A page of 50 results deep into a common term's matches: OFFSET vs the cursor of the result before it
+        keyword = 'term2'
+        total = full_text_search(completed, keyword).count()
+        fields = ('url', 'title', 'summary', 'domain', 'updated_at')
+        print(f"'{keyword}' ({total} matches), 50 results from position:")
+        print(f"{'position':>10} {'OFFSET ms':>10} {'cursor ms':>10}")
+        for position in [0, total // 4, total // 2, max(total - 50, 0)]:
+            offset_ms, by_offset = timed(lambda: list(
+                full_text_search(completed, keyword).values(*fields)[position:position + 50]
+            ), args.repeat)
+            cursor = search_results(completed, keyword, fields, position)[0][-1]['cursor'] if position else None
+            cursor_ms, (by_cursor, _) = timed(lambda: search_results(completed, keyword, fields, 50, cursor), args.repeat)
+            assert [row['url'] for row in by_offset] == [row['url'] for row in by_cursor]
+            print(f"{position:>10} {offset_ms:>10.2f} {cursor_ms:>10.2f}")
+
+        # Repeated searches: the cache only checks the search generation (one primary-key lookup)
+        cache = SearchCache(max_entries=1024, ttl=300)
+        search = lambda: search_results(completed, 'term7', fields)
+        search_ms, _ = timed(search, args.repeat)
+        cache.get_or_compute('term7', None, search)
+        cached_ms, _ = timed(lambda: cache.get_or_compute('term7', None, search), args.repeat)
+        bump_generations(['docs.example.com'])
+        invalidated_ms, _ = timed(lambda: cache.get_or_compute('term7', None, search), 1)
+        print(f"'term7' top 50: {search_ms:.2f} ms searched, {cached_ms:.3f} ms cached, "
+              f"{invalidated_ms:.2f} ms after the domain changed; {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Sitemap seeding: fetches and time to discover a site, and to re-crawl it.
+
+The fixture site links each page only to the first 20 pages and to its next
+five, so following links reaches deep pages a few at a time. With
+`sitemap=True` it also serves a sitemap index of gzipped sitemaps with a
+lastmod per page. Runs, each against the same database:
+
+1. link discovery only (use_sitemaps=False), from an empty database;
+2. sitemap seeding, from an empty database;
+3. after `--changed` of the pages change: a re-crawl seeded from the
+   sitemaps, which skips pages whose lastmod is older than the stored copy;
+4. for comparison, a refresh crawl without sitemaps (conditional requests).
+
+    python benchmarks/bench_sitemaps.py --pages 1000 --changed 0.05
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import FixtureSite, django_test_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--changed', type=float, default=0.05, help='Fraction of pages changed before the re-crawls')
+    parser.add_argument('--latency', type=float, default=0.005, help='Fixture server latency per response (seconds)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    with django_test_db(), FixtureSite(pages=args.pages, latency=args.latency, sitemap=True) as site:
+        from django.conf import settings
+        from crawler.canonical import DEFAULT_STRIP_PARAMS
+        from crawler.engine import CrawlEngine
+        from crawler.jobs import create_crawl_job
+        from crawler.models import CrawledPage, CrawlJob
+
+        # The fixture's "related" links carry ?ref=related; count each page once
+        settings.CRAWLER_URL_STRIP_PARAMS = DEFAULT_STRIP_PARAMS + ('ref',)
+
+        def crawl(label, **options):
+            site.requests_served = site.not_modified_served = site.sitemap_requests = 0
+            initial_page = CrawledPage.objects.filter(url=site.start_url).first() or CrawledPage.objects.create(url=site.start_url)
+            job = create_crawl_job(initial_page, concurrency=args.concurrency, rate_limit=0, **options)
+            started = time.perf_counter()
+            asyncio.run(CrawlEngine(job.id).run())
+            elapsed = time.perf_counter() - started
+            job = CrawlJob.objects.get(pk=job.id)
+            completed = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED).count()
+            print(f"{label:<34} {site.requests_served:>6} {site.sitemap_requests:>8} {site.not_modified_served:>6} "
+                  f"{job.sitemap_pages:>7} {job.sitemap_unchanged:>9} {completed:>7} {elapsed:>7.2f}")
+
+        print(f"{args.pages} pages, {args.latency * 1000:.0f} ms latency, {args.concurrency} concurrent fetches")
+        print(f"{'':<34} {'reqs':>6} {'sitemap':>8} {'304':>6} {'seeded':>7} {'unchanged':>9} {'stored':>7} {'seconds':>7}")
+        crawl('links only', use_sitemaps=False)
+        CrawledPage.objects.all().delete()
+        crawl('sitemap seeding', use_sitemaps=True)
+
+        changed = random.Random(42).sample(range(1, args.pages), int(args.pages * args.changed))
+        site.touch(changed)
+        print(f"{len(changed)} pages changed:")
+        crawl('re-crawl, sitemap lastmod', use_sitemaps=True)
+        crawl('re-crawl, refresh (conditional)', use_sitemaps=False, refresh=True)
+
+
+if __name__ == '__main__':
+    main()
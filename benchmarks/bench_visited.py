@@ -0,0 +1,73 @@
+"""
+URL canonicalization and the crawl's visited set.
+
+1. Memory and time per operation of crawler.canonical.VisitedSet against a
+   plain set of URL strings, for `--urls` synthetic documentation URLs.
+2. Crawl volume on the fixture site, whose pages also link to each other as
+   "page-N.html?ref=related#top": with the default canonicalization, and with
+   'ref' added to CRAWLER_URL_STRIP_PARAMS.
+
+    python benchmarks/bench_visited.py --urls 1000000 --pages 200
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from common import FixtureSite, django_test_db
+
+
+def make_urls(count, step=1):
+    for i in range(0, count, step):
+        yield f"https://docs.example.com/en/stable/reference/module-{i // 100}/function-{i}.html"
+
+
+def measure(build, count):
+    """Memory (including the URL strings a set keeps alive), seconds per add and per lookup."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    visited = build(make_urls(count))
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    sample = list(make_urls(count, step=10))
+    started = time.perf_counter()
+    assert all(url in visited for url in sample)
+    lookup = (time.perf_counter() - started) / len(sample)
+    return size, elapsed / count, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--pages', type=int, default=200, help='Pages in the fixture site')
+    args = parser.parse_args()
+
+    with django_test_db():
+        from django.conf import settings
+        from crawler.canonical import DEFAULT_STRIP_PARAMS, VisitedSet
+
+        print(f"{args.urls} URLs like {next(make_urls(1))}:")
+        print(f"{'':<12} {'MB':>8} {'add us':>8} {'lookup us':>10}")
+        for name, build in [('set of str', set), ('VisitedSet', VisitedSet)]:
+            size, add, lookup = measure(build, args.urls)
+            print(f"{name:<12} {size / 1e6:>8.1f} {add * 1e6:>8.2f} {lookup * 1e6:>10.2f}")
+
+        with FixtureSite(pages=args.pages, latency=0) as site:
+            from crawler.engine import CrawlEngine
+            from crawler.jobs import create_crawl_job
+            from crawler.models import CrawledPage
+
+            for label, strip in [('default canonicalization', DEFAULT_STRIP_PARAMS), ("also stripping 'ref'", DEFAULT_STRIP_PARAMS + ('ref',))]:
+                settings.CRAWLER_URL_STRIP_PARAMS = strip
+                CrawledPage.objects.all().delete()
+                site.requests_served = 0
+                initial_page = CrawledPage.objects.create(url=site.start_url)
+                started = time.perf_counter()
+                asyncio.run(CrawlEngine(create_crawl_job(initial_page, concurrency=16, rate_limit=0).id).run())
+                print(f"{label:<26} {CrawledPage.objects.count():>5} pages, {site.requests_served:>5} requests, "
+                      f"{time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Shared helpers for the crawler benchmarks.
+
+Each benchmark is a standalone script run from the project root, e.g.::
+
+    python benchmarks/bench_crawl_engine.py --pages 200
+
+The helpers here boot Django against a throwaway SQLite file (the real
+db.sqlite3 is never touched) and serve a synthetic documentation site from a
+local threaded HTTP server so results don't depend on the network.
+"""
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+@contextmanager
+def django_test_db():
+    """Sets up Django with a fresh, migrated SQLite database in a temp directory."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+
+    django.setup()
+    import logging
+    logging.getLogger().setLevel(logging.WARNING) # The crawler logs every page at INFO
+
+    from django.db import connection
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def render_page(index, total_pages, nav_links=20, body_paragraphs=20, revision=0):
+    """Returns the HTML for synthetic page `index` of a `total_pages` docs site."""
+    nav = ''.join(
+        f'<li><a href="/docs/page-{i}.html">Page {i}</a></li>'
+        for i in range(min(nav_links, total_pages))
+    )
+    related = ''.join(
+        f'<a href="/docs/page-{i}.html?ref=related#top">Related {i}</a> '
+        for i in range(index + 1, min(index + 6, total_pages))
+    )
+    body = ''.join(
+        f'<p>Paragraph {p} of page {index} (revision {revision}). Lorem ipsum dolor sit amet, consectetur '
+        f'adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore.</p>'
+        for p in range(body_paragraphs)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>Page {index}</title>'
+        f'<meta name="description" content="Synthetic page {index}">'
+        '<link rel="stylesheet" href="/static/site.css"></head><body>'
+        f'<nav><ul>{nav}</ul></nav><main><h1>Page {index}</h1>{body}'
+        f'<div class="related">{related}</div></main>'
+        '<footer><a href="/static/manual.pdf">PDF</a> <a href="mailto:docs@example.com">Mail</a></footer>'
+        '</body></html>'
+    )
+
+
+class FixtureSite:
+    """
+    A synthetic docs site served on 127.0.0.1 with an optional per-response
+    latency. Use as a context manager; `start_url` points at page 0.
+    With `compress=True` pages are gzip-encoded for clients that accept it.
+    Pages carry an ETag and Last-Modified and answer conditional requests with
+    304; `touch()` changes some pages so they no longer match. With
+    `sitemap=True` /sitemap.xml is a sitemap index of gzipped sitemaps listing
+    every page with the time it last changed.
+    """
+
+    # Pages per gzipped child sitemap
+    SITEMAP_SIZE = 500
+
+    def __init__(self, pages=200, latency=0.02, robots_txt=None, compress=False, sitemap=False):
+        self.pages = pages
+        self.sitemap = sitemap
+        self.created_at = time.time()
+        self.modified_at = {} # page index -> time.time() of its last touch()
+        self.sitemap_requests = 0
+        self.latency = latency
+        self.robots_txt = robots_txt
+        self.compress = compress
+        self.connections_opened = 0
+        self.not_modified_served = 0
+        self.revisions = {}
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def start_url(self):
+        return f'{self.base_url}/docs/page-0.html'
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with site._lock:
+                    site.connections_opened += 1
+
+            def log_message(self, format, *args):
+                pass # Keep benchmark output clean
+
+            def do_GET(self):
+                with site._lock:
+                    site.requests_served += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                status, headers, body = site.respond(self.path, self.headers)
+                if site.compress and 'gzip' in self.headers.get('Accept-Encoding', '') and headers.get('Content-Type', '').startswith('text/'):
+                    body = gzip.compress(body)
+                    headers = {**headers, 'Content-Encoding': 'gzip'}
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def respond(self, path, request_headers=None):
+        """Returns (status, headers, body bytes) for a request path."""
+        path = path.split('?', 1)[0]
+        if path == '/robots.txt' and self.robots_txt is not None:
+            return 200, {'Content-Type': 'text/plain'}, self.robots_txt.encode('utf-8')
+        if self.sitemap and (path == '/sitemap.xml' or path.startswith('/sitemaps/')):
+            return self._sitemap(path)
+        if path.startswith('/docs/page-') and path.endswith('.html'):
+            try:
+                index = int(path[len('/docs/page-'):-len('.html')])
+            except ValueError:
+                index = -1
+            if 0 <= index < self.pages:
+                revision = self.revisions.get(index, 0)
+                body = render_page(index, self.pages, revision=revision).encode('utf-8')
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                headers = {
+                    'Content-Type': 'text/html; charset=utf-8',
+                    'ETag': etag,
+                    'Last-Modified': f'Mon, {1 + revision % 28:02d} Jan 2024 00:00:00 GMT',
+                }
+                if request_headers is not None and request_headers.get('If-None-Match') == etag:
+                    with self._lock:
+                        self.not_modified_served += 1
+                    return 304, {'ETag': etag}, b''
+                return 200, headers, body
+        return 404, {'Content-Type': 'text/plain'}, b'not found'
+
+    def _sitemap(self, path):
+        with self._lock:
+            self.sitemap_requests += 1
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
+        namespace = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+        if path == '/sitemap.xml':
+            entries = ''.join(
+                f'<sitemap><loc>{self.base_url}/sitemaps/pages-{start}.xml.gz</loc></sitemap>'
+                for start in range(0, self.pages, self.SITEMAP_SIZE)
+            )
+            return 200, {'Content-Type': 'application/xml'}, f'{xml}<sitemapindex {namespace}>{entries}</sitemapindex>'.encode()
+        try:
+            start = int(path[len('/sitemaps/pages-'):-len('.xml.gz')])
+        except ValueError:
+            return 404, {'Content-Type': 'text/plain'}, b'not found'
+        entries = ''.join(
+            f'<url><loc>{self.base_url}/docs/page-{index}.html</loc>'
+            f'<lastmod>{self._lastmod(index)}</lastmod></url>'
+            for index in range(start, min(start + self.SITEMAP_SIZE, self.pages))
+        )
+        body = gzip.compress(f'{xml}<urlset {namespace}>{entries}</urlset>'.encode())
+        return 200, {'Content-Type': 'application/gzip'}, body
+
+    def _lastmod(self, index):
+        modified = self.modified_at.get(index, self.created_at)
+        return time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(modified))
+
+    def touch(self, indices):
+        """Bumps the revision of the given pages so their content and ETag change."""
+        for index in indices:
+            self.revisions[index] = self.revisions.get(index, 0) + 1
+            self.modified_at[index] = time.time() + 1 # lastmod has whole seconds
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -81,6 +81,9 @@ DATABASES = {
     }
 }
 
+# Sends MCP tool reads to CRAWLER_READ_DATABASE, if configured (see below)
+DATABASE_ROUTERS = ['crawler.routers.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,3 +125,131 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Crawler
+
+# Maximum number of in-flight fetches per crawl (can be overridden per crawl)
+CRAWLER_CONCURRENCY = 8
+
+# Default per-host politeness: requests per second and burst size (token bucket).
+# A robots.txt Crawl-delay takes precedence unless the crawl sets its own rate.
+CRAWLER_HOST_RATE = 4.0
+CRAWLER_HOST_BURST = 2
+
+# Pages whose (decompressed) body exceeds this many bytes are abandoned mid-download
+CRAWLER_MAX_PAGE_BYTES = 5 * 1024 * 1024
+
+# HTML extraction backend: 'lxml' (streaming, no tree), 'soup' (BeautifulSoup),
+# or the dotted path of a crawler.extractors.BaseExtractor subclass
+CRAWLER_EXTRACTOR = 'lxml'
+
+# Worker processes for HTML parsing / link normalization, shared by all crawls in
+# a process. 0 parses in each crawl's thread pool (GIL-bound) instead.
+CRAWLER_PARSE_WORKERS = 0
+# Max pages per crawl waiting on (or in) the parse pool; fetching pauses beyond this
+CRAWLER_PARSE_QUEUE_SIZE = 16
+# Bodies at least this large go to parse workers through shared memory, not pickling
+CRAWLER_PARSE_SHM_THRESHOLD = 256 * 1024
+
+# Honour robots.txt Disallow rules; robots.txt is cached per host for this many seconds
+CRAWLER_RESPECT_ROBOTS = True
+CRAWLER_ROBOTS_CACHE_TTL = 3600
+
+# Page status updates are buffered and written in bulk every this many pages, or
+# at least every CRAWLER_DB_FLUSH_INTERVAL seconds
+CRAWLER_DB_BATCH_SIZE = 25
+CRAWLER_DB_FLUSH_INTERVAL = 1.0
+
+# A crawl job is leased to one worker, which renews the lease at least every
+# CRAWLER_JOB_HEARTBEAT_INTERVAL seconds; once it lapses (CRAWLER_JOB_LEASE_TIMEOUT
+# seconds after the last renewal) another worker may take the job over.
+CRAWLER_JOB_HEARTBEAT_INTERVAL = 30
+CRAWLER_JOB_LEASE_TIMEOUT = 120
+
+# `manage.py crawl_worker`: jobs run at the same time per worker, and how often
+# (seconds) an idle worker checks for queued jobs
+CRAWLER_WORKER_JOBS = 2
+CRAWLER_WORKER_POLL_INTERVAL = 2.0
+
+# Seconds between reads of a watched crawl job's counters for its progress stream
+# (one read per job, shared by everyone watching it)
+CRAWLER_PROGRESS_INTERVAL = 1.0
+
+# Compression of stored page HTML: 'zlib', or 'zstd' (needs the zstandard package).
+# Bodies already stored keep their codec, so this can be changed at any time.
+CRAWLER_BODY_COMPRESSION = 'zlib'
+
+# find_pages results cached per process (least recently used dropped beyond
+# CRAWLER_SEARCH_CACHE_SIZE; 0 disables the cache). Crawls invalidate the
+# cached searches over the domains they change; CRAWLER_SEARCH_CACHE_TTL
+# seconds bounds how long any other change can go unnoticed.
+CRAWLER_SEARCH_CACHE_SIZE = 1024
+CRAWLER_SEARCH_CACHE_TTL = 300
+
+# SQLite only: write-ahead logging, so page reads don't wait for crawl commits
+CRAWLER_SQLITE_WAL = True
+
+# Database alias the MCP tools read from (e.g. a read replica); the primary
+# ('default') when None or not in DATABASES. Writes always go to 'default'.
+# With SQLite, a second, read-only connection to the same file also works
+# (then set CRAWLER_READ_DATABASE = 'replica'):
+#   DATABASES['replica'] = {
+#       'ENGINE': 'django.db.backends.sqlite3',
+#       'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+#       'OPTIONS': {'uri': True},
+#       'TEST': {'MIRROR': 'default'},
+#   }
+CRAWLER_READ_DATABASE = None
+
+# Canonical form of discovered links (see crawler.canonical), so URL variants
+# of a page are crawled once. Query parameters matching CRAWLER_URL_STRIP_PARAMS
+# (fnmatch patterns) are dropped; if CRAWLER_URL_KEEP_PARAMS is a list, only
+# parameters matching it are kept instead.
+CRAWLER_URL_STRIP_PARAMS = (
+    'utm_*', 'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+)
+CRAWLER_URL_KEEP_PARAMS = None
+CRAWLER_URL_SORT_PARAMS = True
+CRAWLER_URL_STRIP_TRAILING_SLASH = False
+
+# Sitemap seeding (for jobs with use_sitemaps): at most this many page URLs and
+# sitemap files (indexes included) are read per crawl
+CRAWLER_SITEMAP_MAX_URLS = 100000
+CRAWLER_SITEMAP_MAX_FILES = 100
+
+# Crawl order (see crawler.priority): the frontier crawls the highest-scoring URL
+# first. A URL loses CRAWLER_PRIORITY_DEPTH_WEIGHT points per link hop from the
+# start page, gains CRAWLER_PRIORITY_INLINK_WEIGHT each time the links seen to it
+# double, up to +/- CRAWLER_PRIORITY_SITEMAP_WEIGHT for its sitemap <priority>,
+# and the points of the first CRAWLER_PRIORITY_PATTERNS rule (glob or 're:' regex,
+# as in crawl URL rules) matching its path and query string.
+CRAWLER_PRIORITY_DEPTH_WEIGHT = 10
+CRAWLER_PRIORITY_INLINK_WEIGHT = 5
+CRAWLER_PRIORITY_SITEMAP_WEIGHT = 20
+CRAWLER_PRIORITY_PATTERNS = (
+    ('*/tag/*', -30),
+    ('*/tags/*', -30),
+    ('*/category/*', -30),
+    ('*/archive/*', -30),
+    ('*/archives/*', -30),
+    (r're:/page/\d+/?$', -30),
+    (r're:[?&]page=\d', -30),
+)
+
+# Fetch failures: timeouts, connection errors, 429s and 5xx are retried up to
+# CRAWLER_FETCH_RETRIES times per page, after a random delay of up to
+# CRAWLER_RETRY_BACKOFF * 2**attempt seconds (at most CRAWLER_RETRY_BACKOFF_MAX),
+# and no sooner than a Retry-After header asks (honored up to
+# CRAWLER_RETRY_AFTER_MAX seconds, for the whole host). Each host's concurrency
+# adapts (halved on timeouts, 429s and 5xx, grown back on success), and
+# CRAWLER_BREAKER_THRESHOLD failures in a row pause the host for
+# CRAWLER_BREAKER_COOLDOWN seconds, doubling while it keeps failing; after
+# CRAWLER_BREAKER_MAX_TRIPS pauses its remaining pages fail as host_unavailable.
+CRAWLER_FETCH_RETRIES = 3
+CRAWLER_RETRY_BACKOFF = 1.0
+CRAWLER_RETRY_BACKOFF_MAX = 60.0
+CRAWLER_RETRY_AFTER_MAX = 300.0
+CRAWLER_BREAKER_THRESHOLD = 5
+CRAWLER_BREAKER_COOLDOWN = 30.0
+CRAWLER_BREAKER_MAX_TRIPS = 4
@@ -1,12 +1,22 @@
 from django.contrib import admin
-from .models import CrawledPage
+from .models import CrawledPage, CrawlJob
 
 @admin.register(CrawledPage)
 class CrawledPageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'url', 'domain', 'status', 'crawled_at', 'updated_at', 'error_message')
-    list_filter = ('status', 'domain', 'crawled_at')
+    list_display = ('id', 'url', 'domain', 'status', 'crawled_at', 'updated_at', 'error_category', 'error_message')
+    list_filter = ('status', 'error_category', 'domain', 'crawled_at')
     search_fields = ('url', 'domain', 'title', 'summary', 'error_message')
     readonly_fields = ('crawled_at', 'updated_at')
+    raw_id_fields = ('body',)
     ordering = ('-crawled_at',)
 
+@admin.register(CrawlJob)
+class CrawlJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'initial_page', 'status', 'pages_crawled', 'pages_unchanged', 'worker', 'heartbeat_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'refresh', 'use_sitemaps', 'created_at')
+    search_fields = ('initial_page__url', 'worker', 'error_message')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'heartbeat_at', 'links_dropped')
+    raw_id_fields = ('initial_page',)
+    ordering = ('-created_at',)
+
 # Register your models here.
@@ -1,6 +1,25 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.backends.signals import connection_created
+
+
+def enable_sqlite_wal(sender, connection, **kwargs):
+    # Write-ahead logging lets readers (the API, MCP tools) proceed while a crawl
+    # commits; the mode is stored in the database file, so this is a no-op once set
+    if connection.vendor == 'sqlite' and getattr(settings, 'CRAWLER_SQLITE_WAL', True):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=WAL')
+        except DatabaseError as e: # e.g. a read-only connection to a database not in WAL mode yet
+            logging.warning(f"Could not enable WAL on SQLite database '{connection.alias}': {e}")
 
 
 class CrawlerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crawler'
+
+    def ready(self):
+        connection_created.connect(enable_sqlite_wal)
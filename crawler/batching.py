@@ -0,0 +1,323 @@
+import logging
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .jobs import LeaseLost, renew_lease
+from .models import CrawledPage, FrontierEntry, PageBody
+from .search import index_pages, unindex_pages
+from .search_cache import bump_generations
+
+# Rows per IN (...) / bulk statement; stays under SQLite's bound-parameter limit
+DB_CHUNK_SIZE = 500
+
+# The only page fields the crawl loop needs between discovering a URL and saving it
+PAGE_STATE_FIELDS = ('id', 'url', 'domain', 'etag', 'last_modified', 'content_hash')
+
+
+def record_links(links, domain, job_id=None, depth=0, priorities=None):
+    """
+    Records a PENDING page for each link with one INSERT, one UPDATE and one
+    SELECT per chunk of links (instead of a get_or_create per link), plus one
+    INSERT adding them to the job's persisted frontier at `depth` (and the
+    link's frontier priority from `priorities`, {url: priority}, default 0)
+    and one UPDATE counting them as pending on the job, inside a single
+    transaction. The links must be new to the job (the crawl loop checks its
+    visited set).
+
+    Pages left over from a previous run are reset to PENDING with their stored
+    content (and validators) kept: a refresh crawl revalidates it, a normal
+    crawl overwrites it once it fetches the page, and a page the crawl never
+    reaches (e.g. max_pages ran out) gets it back. Returns {url: page} for the
+    recorded links, with only PAGE_STATE_FIELDS loaded.
+    """
+    priorities = priorities or {}
+    recorded = {}
+    with transaction.atomic():
+        for start in range(0, len(links), DB_CHUNK_SIZE):
+            chunk = links[start:start + DB_CHUNK_SIZE]
+            CrawledPage.objects.bulk_create(
+                [CrawledPage(url=link, domain=domain, status=CrawledPage.StatusChoices.PENDING) for link in chunk],
+                ignore_conflicts=True, # Existing pages are reset below
+            )
+
+            # If the page existed but wasn't PENDING (e.g., COMPLETED/FAILED from a previous run),
+            # reset it to PENDING for this new crawl.
+            reset = CrawledPage.objects.filter(url__in=chunk).exclude(
+                status=CrawledPage.StatusChoices.PENDING
+            ).update(status=CrawledPage.StatusChoices.PENDING)
+            if reset:
+                bump_generations([domain]) # Reset pages drop out of search results
+
+            pages = list(CrawledPage.objects.filter(url__in=chunk).only(*PAGE_STATE_FIELDS))
+            if job_id is not None:
+                FrontierEntry.objects.bulk_create(
+                    [FrontierEntry(job_id=job_id, page=page, depth=depth, priority=priorities.get(page.url, 0)) for page in pages],
+                    ignore_conflicts=True,
+                )
+                # Also fences the write: raises LeaseLost (rolling back) if the job was taken over
+                renew_lease(job_id, pages_pending=F('pages_pending') + len(pages))
+            for page in pages:
+                recorded[page.url] = page
+    return recorded
+
+
+def prune_bodies(hashes=None):
+    """
+    Deletes the page bodies among `hashes` that no page points to any more
+    (e.g. replaced by changed content, or dropped by a failed re-crawl), or
+    every such body when hashes is None. Returns how many were deleted.
+    """
+    orphans = PageBody.objects.filter(pages__isnull=True).only('hash') # Never loads the HTML
+    if hashes is None:
+        return orphans.delete()[0]
+    hashes = list(hashes)
+    deleted = 0
+    for start in range(0, len(hashes), DB_CHUNK_SIZE):
+        deleted += orphans.filter(hash__in=hashes[start:start + DB_CHUNK_SIZE]).delete()[0]
+    return deleted
+
+
+def restore_uncrawled(pages):
+    """
+    Gives the PENDING pages among `pages` that a crawl dequeued or left queued
+    without fetching them their earlier status back: COMPLETED if they hold
+    content from an earlier crawl, FAILED if that crawl failed. Pages never
+    crawled before stay PENDING. Returns (restored COMPLETED, restored FAILED).
+    """
+    uncrawled = pages.filter(status=CrawledPage.StatusChoices.PENDING)
+    completed = uncrawled.exclude(content_hash='').update(status=CrawledPage.StatusChoices.COMPLETED)
+    failed = uncrawled.exclude(error_category='').update(status=CrawledPage.StatusChoices.FAILED)
+    return completed, failed
+
+
+class PageWriteBuffer:
+    """
+    Collects the page status updates of a crawl and writes them in bulk.
+
+    Pages are queued with the fields to save; flush() then issues one UPDATE
+    for all pages marked PROCESSING, one INSERT of the new page bodies and one
+    bulk_update per distinct set of fields, then deletes the bodies the saved
+    pages no longer point to (unless other pages share them), in a single transaction. A page queued as PROCESSING and then saved
+    in the same batch is only written once, in its final state.
+
+    With a `job_id`, the same transaction first renews this worker's lease on
+    the job, moving its per-status page counters by the batch's net changes,
+    then moves the pages' frontier entries to IN_PROGRESS / DONE, so neither
+    the counters nor the persisted frontier ever disagree with the pages they
+    describe. The search index entries of the saved pages are written in the
+    same transaction too, and the search generations of their domains are
+    bumped, invalidating cached searches over them. If the lease was taken over by another worker, nothing is
+    written and flush() raises LeaseLost.
+
+    Not thread-safe: the crawl loop fills the buffer and hands it off with
+    take() before flushing it on the DB thread.
+    """
+
+    def __init__(self, job_id=None, batch_size=25, flush_interval=1.0):
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._counts = Counter() # CrawlJob counter field -> net change
+        self._processing = {} # page id -> page
+        self._saves = {} # page id -> (page, update fields)
+        self._skipped = {} # page id -> page dequeued without being crawled
+        self._search_text = {} # page id -> text to index, for pages crawled successfully
+        self.links_dropped = Counter() # The job's running totals (CrawlJob.links_dropped)
+        self._links_dropped = None # Totals to save with this batch, if they changed
+        self._started = time.monotonic()
+
+    def __len__(self):
+        return len(self._processing) + len(self._saves) + len(self._skipped)
+
+    def mark_processing(self, page):
+        page.status = CrawledPage.StatusChoices.PROCESSING
+        page.error_message = None # Clear previous errors
+        page.error_category = ''
+        self._processing[page.pk] = page
+        self._counts['pages_pending'] -= 1
+        self._counts['pages_processing'] += 1
+
+    def save(self, page, update_fields, unchanged=False, text=None):
+        """
+        Queues a page that was marked processing and has reached its final
+        (COMPLETED / FAILED) status. `text` (re)indexes a completed page for
+        search; failed pages are removed from the index.
+        """
+        self._processing.pop(page.pk, None)
+        if text is not None or page.status != CrawledPage.StatusChoices.COMPLETED:
+            self._search_text[page.pk] = text
+        self._saves[page.pk] = (page, tuple(update_fields))
+        self._counts['pages_processing'] -= 1
+        if page.status == CrawledPage.StatusChoices.COMPLETED:
+            self._counts['pages_crawled'] += 1
+            self._counts['pages_unchanged'] += unchanged
+        else:
+            self._counts['pages_failed'] += 1
+
+    def count_dropped(self, dropped):
+        """Adds links the parse stage filtered out (reason -> count) to the job's totals."""
+        if dropped:
+            self.links_dropped.update(dropped)
+            self._links_dropped = dict(self.links_dropped)
+
+    def skip(self, page):
+        """
+        Marks the page's frontier entry done without crawling the page (e.g.
+        beyond max_depth). A page holding content from an earlier crawl gets
+        its stored status back (see restore_uncrawled).
+        """
+        self._skipped[page.pk] = page
+        self._counts['pages_pending'] -= 1
+
+    def should_flush(self):
+        """True once batch_size pages were saved or the oldest queued write is flush_interval seconds old."""
+        if not self:
+            return False
+        return len(self._saves) >= self.batch_size or time.monotonic() - self._started >= self.flush_interval
+
+    def take(self):
+        """Returns a buffer holding the queued writes and empties this one."""
+        batch = PageWriteBuffer(self.job_id, self.batch_size, self.flush_interval)
+        batch._counts, self._counts = self._counts, Counter()
+        batch._processing, self._processing = self._processing, {}
+        batch._saves, self._saves = self._saves, {}
+        batch._skipped, self._skipped = self._skipped, {}
+        batch._search_text, self._search_text = self._search_text, {}
+        batch._links_dropped, self._links_dropped = self._links_dropped, None
+        self._started = time.monotonic()
+        return batch
+
+    def flush(self):
+        """Writes the queued updates. Runs on the DB thread."""
+        groups = {}
+        for page, update_fields in self._saves.values():
+            groups.setdefault(update_fields, []).append(page)
+        try:
+            with transaction.atomic():
+                self._renew_lease()
+                self._flush_processing()
+                self._flush_skipped()
+                replaced = self._flush_bodies()
+                for update_fields, pages in groups.items():
+                    CrawledPage.objects.bulk_update(pages, update_fields, batch_size=DB_CHUNK_SIZE)
+                prune_bodies(replaced)
+                self._flush_search_index()
+                self._flush_generations()
+                self._flush_frontier()
+        except LeaseLost:
+            raise
+        except Exception as db_err:
+            # Fall back to one save per page so one bad row doesn't lose the whole batch
+            logging.error(f"DB Error writing batch of {len(self)} page updates, retrying one by one: {db_err}")
+            self._renew_lease()
+            try:
+                self._flush_skipped()
+            except Exception as skip_err:
+                logging.error(f"DB Error restoring {len(self._skipped)} skipped pages: {skip_err}")
+            replaced = set()
+            try:
+                replaced = self._flush_bodies()
+            except Exception as body_err:
+                logging.error(f"DB Error storing page bodies: {body_err}")
+            self._flush_one_by_one()
+            try:
+                prune_bodies(replaced)
+            except Exception as prune_err:
+                logging.error(f"DB Error deleting replaced page bodies: {prune_err}")
+            try:
+                self._flush_frontier()
+            except Exception as frontier_err:
+                logging.error(f"DB Error updating frontier of crawl job {self.job_id}: {frontier_err}")
+            try:
+                self._flush_search_index()
+            except Exception as index_err:
+                logging.error(f"DB Error updating search index for {len(self._search_text)} pages: {index_err}")
+            try:
+                self._flush_generations()
+            except Exception as generation_err:
+                logging.error(f"DB Error invalidating cached searches: {generation_err}")
+
+    def _flush_processing(self):
+        ids = list(self._processing)
+        for start in range(0, len(ids), DB_CHUNK_SIZE):
+            CrawledPage.objects.filter(pk__in=ids[start:start + DB_CHUNK_SIZE]).update(
+                status=CrawledPage.StatusChoices.PROCESSING, error_message=None, error_category='',
+            )
+
+    def _flush_skipped(self):
+        ids = list(self._skipped)
+        restored = failed = 0
+        for start in range(0, len(ids), DB_CHUNK_SIZE):
+            completed_chunk, failed_chunk = restore_uncrawled(CrawledPage.objects.filter(pk__in=ids[start:start + DB_CHUNK_SIZE]))
+            restored += completed_chunk
+            failed += failed_chunk
+        if restored or failed:
+            bump_generations({page.domain for page in self._skipped.values()}) # Restored pages are searchable again
+            if self.job_id is not None:
+                renew_lease(self.job_id, pages_crawled=F('pages_crawled') + restored, pages_failed=F('pages_failed') + failed)
+
+    def _flush_bodies(self):
+        """Stores the saved pages' new bodies. Returns the hashes of the bodies they pointed to until now."""
+        bodies = {}
+        ids = []
+        for page, update_fields in self._saves.values():
+            if 'body' in update_fields:
+                ids.append(page.pk)
+                if page.body_id:
+                    bodies[page.body_id] = page.body
+        replaced = set()
+        for start in range(0, len(ids), DB_CHUNK_SIZE):
+            replaced.update(
+                CrawledPage.objects.filter(pk__in=ids[start:start + DB_CHUNK_SIZE], body__isnull=False)
+                .values_list('body_id', flat=True)
+            )
+        # Bodies already stored (identical HTML on another page) are kept as they are
+        PageBody.objects.bulk_create(bodies.values(), batch_size=DB_CHUNK_SIZE, ignore_conflicts=True)
+        return replaced - bodies.keys()
+
+    def _renew_lease(self):
+        if self.job_id is None:
+            return
+        fields = {field: F(field) + change for field, change in self._counts.items() if change}
+        if self._links_dropped is not None:
+            fields['links_dropped'] = self._links_dropped
+        renew_lease(self.job_id, **fields)
+
+    def _flush_search_index(self):
+        index_pages(
+            (page_id, self._saves[page_id][0].title, self._saves[page_id][0].summary, text)
+            for page_id, text in self._search_text.items() if text is not None
+        )
+        unindex_pages(page_id for page_id, text in self._search_text.items() if text is None)
+
+    def _flush_generations(self):
+        if self._saves or self._processing:
+            bump_generations(
+                {page.domain for page, _ in self._saves.values()} | {page.domain for page in self._processing.values()}
+            )
+
+    def _flush_frontier(self):
+        if self.job_id is None:
+            return
+        entries = FrontierEntry.objects.filter(job_id=self.job_id)
+        for state, ids in (
+            (FrontierEntry.StateChoices.IN_PROGRESS, list(self._processing)),
+            (FrontierEntry.StateChoices.DONE, list(self._saves) + list(self._skipped)),
+        ):
+            for start in range(0, len(ids), DB_CHUNK_SIZE):
+                entries.filter(page_id__in=ids[start:start + DB_CHUNK_SIZE]).update(state=state)
+
+    def _flush_one_by_one(self):
+        for page in self._processing.values():
+            try:
+                page.save(update_fields=['status', 'error_message', 'error_category'])
+            except Exception as db_err:
+                logging.error(f"DB Error updating status for {page.url}: {db_err}")
+        for page, update_fields in self._saves.values():
+            try:
+                page.save(update_fields=update_fields)
+            except Exception as db_err:
+                logging.error(f"DB Error saving {page.url}: {db_err}")
@@ -0,0 +1,157 @@
+import fnmatch
+import hashlib
+import re
+from array import array
+from operator import itemgetter
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from django.conf import settings
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only record where a visitor came from (fnmatch patterns, case-insensitive)
+DEFAULT_STRIP_PARAMS = (
+    'utm_*', 'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+)
+
+_PERCENT_ESCAPE = re.compile(r'%[0-9a-f]{2}', re.IGNORECASE)
+
+
+def _compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+class UrlCanonicalizer:
+    """
+    Rewrites URLs to one form per page, so that variants of a URL are crawled
+    once: lower-case scheme and host, no default port, no fragment, '/' for an
+    empty path, upper-case percent-escapes, tracking parameters removed (or
+    only `keep_params` kept) and parameters sorted by name. Trailing slashes
+    are only removed with `strip_trailing_slash`, as some servers treat
+    '/docs' and '/docs/' as different pages.
+    """
+
+    def __init__(self, strip_params=DEFAULT_STRIP_PARAMS, keep_params=None, sort_params=True, strip_trailing_slash=False):
+        self._strip = _compile_patterns(strip_params)
+        self._keep = _compile_patterns(keep_params) if keep_params is not None else None
+        self.sort_params = sort_params
+        self.strip_trailing_slash = strip_trailing_slash
+
+    def canonicalize(self, url):
+        """The canonical form of an absolute URL. Raises ValueError for a malformed one (e.g. a bad port)."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        path = _PERCENT_ESCAPE.sub(lambda match: match.group(0).upper(), parts.path) or '/'
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+        return urlunsplit((scheme, self._netloc(scheme, parts), path, self._query(parts.query), ''))
+
+    def netloc(self, scheme, netloc):
+        """The canonical form of a host[:port] (such as a crawl's base domain) under `scheme`."""
+        return self._netloc(scheme.lower(), urlsplit(f'//{netloc}'))
+
+    def _netloc(self, scheme, parts):
+        host = parts.hostname or ''
+        if ':' in host:
+            host = f'[{host}]' # IPv6 literal
+        port = parts.port
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            host = f'{host}:{port}'
+        userinfo, at, _ = parts.netloc.rpartition('@')
+        return f'{userinfo}{at}{host}'
+
+    def _query(self, query):
+        if not query:
+            return ''
+        params = []
+        for pair in query.split('&'):
+            if not pair:
+                continue
+            name = unquote_plus(pair.split('=', 1)[0])
+            if self._keep is not None:
+                if not self._keep.match(name):
+                    continue
+            elif self._strip is not None and self._strip.match(name):
+                continue
+            params.append((name, pair)) # Values keep their original encoding
+        if self.sort_params:
+            params.sort(key=itemgetter(0)) # Stable: repeated parameters keep their order
+        return '&'.join(pair for _, pair in params)
+
+
+def get_canonicalizer():
+    """A UrlCanonicalizer configured from the CRAWLER_URL_* settings."""
+    return UrlCanonicalizer(
+        strip_params=getattr(settings, 'CRAWLER_URL_STRIP_PARAMS', DEFAULT_STRIP_PARAMS),
+        keep_params=getattr(settings, 'CRAWLER_URL_KEEP_PARAMS', None),
+        sort_params=getattr(settings, 'CRAWLER_URL_SORT_PARAMS', True),
+        strip_trailing_slash=getattr(settings, 'CRAWLER_URL_STRIP_TRAILING_SLASH', False),
+    )
+
+
+# --- Visited set ---
+
+def url_fingerprint(url):
+    """A non-zero 64-bit fingerprint of a URL."""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+
+class VisitedSet:
+    """
+    A set of URLs stored as 64-bit fingerprints in an open-addressing hash
+    table (an array of unsigned 64-bit ints, 0 marking a free slot), grown by
+    doubling once it is two-thirds full: 8 bytes per slot, so 12-24 MB per
+    million URLs, where a set of URL strings takes well over 100 MB.
+
+    Two URLs share a fingerprint with a probability of about n^2 / 2^65
+    (under 1 in 30 million for a million URLs); the second would then be
+    taken as already visited. The URLs themselves can't be listed.
+    """
+
+    def __init__(self, urls=(), capacity=1024):
+        size = 1 << max(capacity * 3 // 2, 16).bit_length()
+        self._slots = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+        for url in urls:
+            self.add(url)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, url):
+        fingerprint = url_fingerprint(url)
+        return self._slots[self._probe(fingerprint)] == fingerprint
+
+    def add(self, url):
+        fingerprint = url_fingerprint(url)
+        index = self._probe(fingerprint)
+        if self._slots[index] == fingerprint:
+            return
+        self._slots[index] = fingerprint
+        self._count += 1
+        if self._count * 3 > len(self._slots) * 2:
+            self._grow()
+
+    @property
+    def nbytes(self):
+        """Memory used by the table."""
+        return self._slots.itemsize * len(self._slots)
+
+    def _probe(self, fingerprint):
+        """The slot holding `fingerprint`, or the free slot where it would go."""
+        slots, mask = self._slots, self._mask
+        index = fingerprint & mask
+        while slots[index] and slots[index] != fingerprint:
+            index = (index + 1) & mask # Linear probing
+        return index
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array('Q', bytes(16 * len(old)))
+        self._mask = len(self._slots) - 1
+        for fingerprint in old:
+            if fingerprint:
+                self._slots[self._probe(fingerprint)] = fingerprint
@@ -0,0 +1,399 @@
+import re
+
+from bs4.element import NavigableString, Tag
+from django.db.models import F
+from django.db.models.functions import Substr
+
+# Elements whose text is never part of a page's main content
+NON_CONTENT_TAGS = frozenset([
+    'head', 'title', 'script', 'style', 'noscript', 'template', 'svg',
+    'nav', 'footer', 'aside', 'form', 'button', 'select', 'iframe', 'dialog',
+])
+# Page headers (site name, menus) are boilerplate; headers inside MAIN_TAGS are kept
+HEADER_TAG = 'header'
+# When a page marks up its main content, everything outside it is dropped
+MAIN_TAGS = frozenset(['main', 'article'])
+HEADING_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+# Elements that end the current paragraph
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'blockquote', 'body', 'br', 'center', 'dd', 'details', 'div', 'dl', 'dt',
+    'figcaption', 'figure', 'hr', 'li', 'main', 'ol', 'p', 'section', 'summary', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'tr', 'ul',
+]) | HEADING_TAGS
+
+# Consecutive blocks of these kinds from the same list / table are written on
+# consecutive lines instead of as paragraphs
+TIGHT_BLOCKS = ('li', 'tr')
+
+
+def _collapse(text):
+    return ' '.join(text.split())
+
+
+class MarkdownWriter:
+    """
+    Turns a stream of start/end/data events (lxml parser target style) into
+    Markdown of the page's main content: headings, paragraphs, lists, block
+    quotes, code blocks and tables, without navigation, headers, footers,
+    forms, scripts or styling. Links become their text.
+    """
+
+    def __init__(self):
+        self.blocks = [] # (kind, group, markdown, inside main content)
+        self.groups = 0 # Top-level lists and tables so far
+        self.inline = [] # Text of the paragraph being read
+        self.open = [] # (tag, starts main content) per open element; None if it is skipped
+        self.skip_depth = 0
+        self.main_depth = 0
+        self.heading = None # Level of the open heading
+        self.lists = [] # [ordered, items so far] per open list
+        self.item_start = False # The next block starts a list item
+        self.quote_depth = 0
+        self.pre = None # Raw text of the open <pre>
+        self.rows = [] # Rows written so far, per open table
+        self.row = None # Cells of the open table row
+
+    def start(self, tag, attrib):
+        if self.skip_depth or tag in NON_CONTENT_TAGS or (tag == HEADER_TAG and not self.main_depth):
+            self.skip_depth += 1
+            self.open.append(None)
+            return
+        is_main = tag in MAIN_TAGS or attrib.get('role') == 'main'
+        self.open.append((tag, is_main))
+        self.main_depth += is_main
+        if self.pre is not None:
+            return
+        if tag in BLOCK_TAGS and tag not in ('td', 'th'):
+            self._flush()
+        if tag == 'pre':
+            self._flush()
+            self.pre = []
+        elif tag in HEADING_TAGS:
+            self.heading = int(tag[1])
+        elif tag in ('ul', 'ol'):
+            self.groups += not self.lists
+            self.lists.append([tag == 'ol', 0])
+        elif tag == 'li':
+            if self.lists:
+                self.lists[-1][1] += 1
+            self.item_start = True
+        elif tag == 'blockquote':
+            self.quote_depth += 1
+        elif tag == 'table':
+            self.groups += not self.rows
+            self.rows.append(0)
+        elif tag == 'tr':
+            self.row = []
+        elif tag in ('td', 'th') and self.row is not None:
+            self.inline = []
+        elif tag == 'code':
+            self.inline.append('`')
+
+    def end(self, tag):
+        opened = self.open.pop() if self.open else None
+        if opened is None:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        tag, is_main = opened
+        self.main_depth -= is_main
+        if self.pre is not None:
+            if tag == 'pre':
+                code = ''.join(self.pre).strip('\n')
+                self.pre = None
+                if code.strip():
+                    self._add_block('pre', f"```\n{code}\n```")
+            return
+        if tag in ('td', 'th') and self.row is not None:
+            self.row.append(_collapse(''.join(self.inline)).replace('|', '\\|'))
+            self.inline = []
+        elif tag == 'code':
+            self.inline.append('`')
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self.heading = None
+        elif tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+        elif tag == 'li':
+            self.item_start = False
+        elif tag == 'blockquote':
+            self.quote_depth = max(self.quote_depth - 1, 0)
+        elif tag == 'tr':
+            if self.row and any(self.row):
+                self._add_block('tr', f"| {' | '.join(self.row)} |")
+                if self.rows and self.rows[-1] == 0:
+                    self._add_block('tr', f"|{' --- |' * len(self.row)}")
+                if self.rows:
+                    self.rows[-1] += 1
+            self.row = None
+        elif tag == 'table':
+            if self.rows:
+                self.rows.pop()
+
+    def data(self, data):
+        if self.skip_depth:
+            return
+        if self.pre is not None:
+            self.pre.append(data)
+        else:
+            self.inline.append(data)
+
+    def _flush(self):
+        if self.row is not None:
+            self.inline.append(' ') # Blocks inside a table cell only separate its words
+            return
+        text = _collapse(''.join(self.inline))
+        self.inline = []
+        if not text or text == '``':
+            return
+        kind, prefix = 'p', ''
+        if self.heading:
+            kind, prefix = 'h', '#' * self.heading + ' '
+        elif self.lists:
+            kind = 'li'
+            indent = '  ' * (len(self.lists) - 1)
+            if self.item_start:
+                ordered, count = self.lists[-1]
+                prefix = indent + (f"{count}. " if ordered else '- ')
+                self.item_start = False
+            else:
+                prefix = indent + '  '
+        self._add_block(kind, prefix + text)
+
+    def _add_block(self, kind, markdown):
+        if self.quote_depth:
+            markdown = '\n'.join('> ' * self.quote_depth + line for line in markdown.split('\n'))
+        self.blocks.append((kind, self.groups, markdown, self.main_depth > 0))
+
+    def close(self):
+        """Returns the Markdown."""
+        self._flush()
+        blocks = self.blocks
+        if any(in_main for *_, in_main in blocks):
+            blocks = [block for block in blocks if block[-1]]
+        parts = []
+        previous = None
+        for kind, group, markdown, _ in blocks:
+            if parts:
+                parts.append('\n' if kind in TIGHT_BLOCKS and (kind, group) == previous else '\n\n')
+            parts.append(markdown)
+            previous = (kind, group)
+        return ''.join(parts)
+
+
+def soup_to_markdown(soup):
+    """MarkdownWriter output for a BeautifulSoup tree (walked iteratively; documents can nest deeply)."""
+    writer = MarkdownWriter()
+    stack = [iter(soup.children)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        if isinstance(node, Tag):
+            writer.start(node.name, node.attrs)
+            stack.append(_closing(iter(node.children), writer, node.name))
+        elif type(node) is NavigableString: # No comments, doctypes or CDATA
+            writer.data(str(node))
+    return writer.close()
+
+
+def _closing(children, writer, name):
+    """Yields the children, then ends the element in the writer."""
+    yield from children
+    writer.end(name)
+
+
+# --- Sections ---
+
+# Heading lines as MarkdownWriter writes them, and code fences (whose lines are
+# never headings). Matched from the newline before the line: a literal the regex
+# engine can search for quickly, unlike a MULTILINE ^
+_HEADING_OR_FENCE = re.compile(r'\n(?:(#{1,6}) ([^\n]+)|```)')
+
+
+def markdown_outline(markdown):
+    """
+    Splits MarkdownWriter output into sections at its headings. Returns a
+    list of {'level', 'title', 'start', 'end'}, where start and end are the
+    character offsets of the section (heading included) in the Markdown.
+    Text before the first heading is a section of level 0 without a title.
+    The sections cover the whole text, in order.
+    """
+    if not markdown:
+        return []
+    headings = []
+    in_code = False
+    # With a newline in front, a match's start is the offset of its line in `markdown`
+    for match in _HEADING_OR_FENCE.finditer('\n' + markdown):
+        if match.group(1) is None:
+            in_code = not in_code
+        elif not in_code:
+            headings.append((match.start(), len(match.group(1)), match.group(2)))
+    if not headings or headings[0][0] > 0:
+        headings.insert(0, (0, 0, ''))
+    ends = [start for start, _, _ in headings[1:]] + [len(markdown)]
+    return [
+        {'level': level, 'title': title, 'start': start, 'end': end}
+        for (start, level, title), end in zip(headings, ends)
+    ]
+
+
+# --- Serving ---
+
+# Formats get_page_content / get_content_api can return a page in
+CONTENT_FORMATS = ('markdown', 'html')
+# Most pages load_pages_content loads in one call
+MAX_BATCH_PAGES = 100
+
+
+def _approximate_tokens(characters):
+    return (characters + 3) // 4 # About four characters per token in English text
+
+
+def _stored_markdown(page):
+    """The page's Markdown; pages crawled before it was stored are converted on the fly."""
+    if page.content_markdown is not None:
+        return page.content_markdown
+    # Imported here because the extractors build on this module
+    from .tasks import parse_and_extract
+    html_content = page.html_content # Loads the body
+    return parse_and_extract(html_content, page.url)[3] if html_content else ''
+
+
+def load_page_content(pages, url, content_format, section=None, offset=None, length=None):
+    """
+    Returns {'url', 'format', 'content'} for the page with `url` in the
+    `pages` queryset, loading only the stored field for that format. Pages
+    crawled before Markdown was stored are converted on the fly.
+
+    For Markdown, `section` (an index into load_page_outline's sections) or
+    `offset` / `length` (in characters) select part of the content; the
+    database returns only that part. The result then also has 'start', 'end'
+    and 'total_length', and 'section' when one was asked for.
+
+    Raises CrawledPage.DoesNotExist, or ValueError for an unknown format,
+    a section the page doesn't have or a negative offset or length.
+    """
+    if content_format not in CONTENT_FORMATS:
+        raise ValueError(f"Unknown format '{content_format}'; expected one of: {', '.join(CONTENT_FORMATS)}")
+    partial = section is not None or offset is not None or length is not None
+    if content_format == 'html':
+        if partial:
+            raise ValueError("Sections and ranges are only available in the 'markdown' format")
+        page = pages.select_related('body').only('url', 'body__codec', 'body__data').get(url=url)
+        return {'url': page.url, 'format': 'html', 'content': page.html_content or ''}
+
+    if not partial:
+        page = pages.only('url', 'content_markdown', 'body').get(url=url)
+        return {'url': page.url, 'format': 'markdown', 'content': _stored_markdown(page)}
+
+    if offset is not None and offset < 0 or length is not None and length < 0:
+        raise ValueError("'offset' and 'length' can't be negative")
+    page, outline, total_length, markdown = _load_outline(pages, url)
+    result = {'url': page.url, 'format': 'markdown'}
+    start, end = 0, total_length
+    if section is not None:
+        if not 0 <= section < len(outline):
+            raise ValueError(f"Section {section} out of range; the page has {len(outline)} sections")
+        result['section'] = dict(outline[section], index=section)
+        start, end = outline[section]['start'], outline[section]['end']
+    if offset is not None:
+        start = min(start + offset, end) # Relative to the section, if any
+    if length is not None:
+        end = min(start + length, end)
+
+    if markdown is not None:
+        content = markdown[start:end]
+    elif end > start:
+        # SUBSTR counts characters from 1, as the offsets count them from 0
+        content = pages.annotate(part=Substr('content_markdown', start + 1, end - start)).values_list(
+            'part', flat=True
+        ).get(pk=page.pk)
+    else:
+        content = ''
+    result.update(content=content, start=start, end=end, total_length=total_length)
+    return result
+
+
+def _load_outline(pages, url):
+    """
+    Returns (page, outline, Markdown length, Markdown) for the page with `url`,
+    reading only its stored outline (the last section ends at the end of the
+    Markdown). The Markdown is None unless the page was crawled before
+    outlines were stored, in which case it is loaded (or converted) to
+    compute the outline.
+    """
+    page = pages.only('url', 'content_outline', 'body').get(url=url)
+    outline = page.content_outline
+    if outline is not None:
+        return page, outline, outline[-1]['end'] if outline else 0, None
+    markdown = _stored_markdown(page) # Loads the deferred content_markdown
+    return page, markdown_outline(markdown), len(markdown), markdown
+
+
+def load_page_outline(pages, url):
+    """
+    Returns {'url', 'total_length', 'sections'} for the page with `url` in
+    the `pages` queryset: its Markdown sections from markdown_outline, each
+    with its 'index' (for load_page_content) and approximate 'tokens'.
+    Reads only the stored outline, unless the page was crawled before
+    outlines were stored. Raises CrawledPage.DoesNotExist.
+    """
+    page, outline, total_length, _ = _load_outline(pages, url)
+    return {
+        'url': page.url,
+        'total_length': total_length,
+        'sections': [
+            dict(section, index=index, tokens=_approximate_tokens(section['end'] - section['start']))
+            for index, section in enumerate(outline)
+        ],
+    }
+
+
+def load_pages_content(pages, urls, content_format, max_chars=None):
+    """
+    load_page_content for many pages with one query. Returns a result per
+    entry of `urls`, in the same order: {'url', 'format', 'content',
+    'truncated'}, or {'url', 'error'} for a URL that isn't in `pages`.
+    With `max_chars`, each page's content is cut to that many characters
+    (by the database, for Markdown) and 'truncated' says whether it was.
+    Raises ValueError for an unknown format, a negative budget or more than
+    MAX_BATCH_PAGES URLs.
+    """
+    if content_format not in CONTENT_FORMATS:
+        raise ValueError(f"Unknown format '{content_format}'; expected one of: {', '.join(CONTENT_FORMATS)}")
+    if len(urls) > MAX_BATCH_PAGES:
+        raise ValueError(f"At most {MAX_BATCH_PAGES} pages can be loaded at once; got {len(urls)}")
+    if max_chars is not None and max_chars < 0:
+        raise ValueError("'max_chars' can't be negative")
+
+    contents = {}
+    matching = pages.filter(url__in=set(urls))
+    if content_format == 'html':
+        for page in matching.select_related('body').only('url', 'body__codec', 'body__data'):
+            contents[page.url] = page.html_content or ''
+    else:
+        if max_chars is None:
+            matching = matching.annotate(part=F('content_markdown'))
+        else:
+            # One character over the budget tells whether the content was cut
+            matching = matching.annotate(part=Substr('content_markdown', 1, max_chars + 1))
+        for page in matching.only('url', 'body'):
+            contents[page.url] = page.part if page.part is not None else _stored_markdown(page)
+
+    results = []
+    for url in urls:
+        content = contents.get(url)
+        if content is None:
+            results.append({'url': url, 'error': 'Page not found in database'})
+            continue
+        truncated = max_chars is not None and len(content) > max_chars
+        results.append({
+            'url': url,
+            'format': content_format,
+            'content': content[:max_chars] if truncated else content,
+            'truncated': truncated,
+        })
+    return results
@@ -0,0 +1,113 @@
+import codecs
+import re
+
+from requests.compat import chardet
+
+# How much of the document is scanned for <meta charset> / http-equiv declarations
+META_SCAN_BYTES = 4 * 1024
+
+# How much of the document statistical detection looks at (last resort only)
+DETECTION_PREFIX_BYTES = 16 * 1024
+
+# Byte order marks, longest first so UTF-32 isn't mistaken for UTF-16.
+# The BOM-aware codecs strip the mark while decoding.
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Labels browsers treat as aliases (WHATWG Encoding Standard): pages labelled
+# latin-1/ascii are decoded as windows-1252 in practice.
+ENCODING_ALIASES = {
+    'ascii': 'windows-1252',
+    'us-ascii': 'windows-1252',
+    'latin-1': 'windows-1252',
+    'latin1': 'windows-1252',
+    'iso-8859-1': 'windows-1252',
+    'iso8859-1': 'windows-1252',
+    'gb2312': 'gbk',
+    'shift-jis': 'shift_jis',
+    'x-sjis': 'shift_jis',
+}
+
+CONTENT_TYPE_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+META_CHARSET_RE = re.compile(
+    rb'<meta[^>]+?charset\s*=\s*["\']?\s*([\w.:-]+)',
+    re.IGNORECASE,
+)
+
+
+def normalize_encoding(label):
+    """Returns a Python codec name for an encoding label, or None if it isn't one we can use."""
+    if not label:
+        return None
+    label = label.strip().strip('"\'').lower()
+    label = ENCODING_ALIASES.get(label, label)
+    try:
+        name = codecs.lookup(label).name
+    except LookupError:
+        return None
+    # A document can't really declare itself UTF-16 from inside an ASCII-compatible
+    # <meta> tag or header without a BOM; browsers fall back to UTF-8 here.
+    if name.startswith('utf-16') or name.startswith('utf-32'):
+        return 'utf-8'
+    return name
+
+
+def encoding_from_content_type(content_type):
+    """Extracts the charset parameter from a Content-Type header value."""
+    if not content_type:
+        return None
+    match = CONTENT_TYPE_CHARSET_RE.search(content_type)
+    return normalize_encoding(match.group(1)) if match else None
+
+
+def encoding_from_bom(body):
+    for bom, name in BOMS:
+        if body[:len(bom)] == bom:
+            return name
+    return None
+
+
+def encoding_from_meta(body):
+    """Looks for <meta charset> or <meta http-equiv="Content-Type" content="...charset=..."> near the top."""
+    match = META_CHARSET_RE.search(body[:META_SCAN_BYTES])
+    return normalize_encoding(match.group(1).decode('ascii', 'ignore')) if match else None
+
+
+def is_utf8_prefix(prefix):
+    """True if the prefix is valid UTF-8 (ignoring a multi-byte sequence cut off at the end)."""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_encoding(body):
+    """Statistical detection over a bounded prefix of the body."""
+    prefix = bytes(body[:DETECTION_PREFIX_BYTES])
+    # Most of the web is UTF-8; validating it is far cheaper than running the detector
+    if is_utf8_prefix(prefix):
+        return 'utf-8'
+    detected = chardet.detect(prefix).get('encoding')
+    return normalize_encoding(detected) or 'utf-8'
+
+
+def resolve_encoding(body, content_type=None):
+    """
+    Picks the encoding for an HTML body (bytes or bytearray), in order:
+    a byte order mark, the Content-Type charset, a <meta> declaration in the
+    first few KB, and finally statistical detection on a small prefix. The
+    BOM wins over the header, as in browsers: a mislabelled server default
+    is far more common than a BOM that lies.
+    """
+    return (
+        encoding_from_bom(body)
+        or encoding_from_content_type(content_type)
+        or encoding_from_meta(body)
+        or detect_encoding(body)
+    )
@@ -0,0 +1,794 @@
+import asyncio
+import hashlib
+import heapq
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from .batching import PageWriteBuffer, record_links, restore_uncrawled, DB_CHUNK_SIZE, PAGE_STATE_FIELDS
+from .canonical import VisitedSet, get_canonicalizer
+from .content import markdown_outline
+from .jobs import LeaseLost, claim_job, release_job, renew_lease, worker_id
+from .models import CrawledPage, CrawlJob, FrontierEntry, PageBody
+from .parsing import extract_in_pool, get_parse_pool
+from .politeness import HostScheduler, TRANSIENT_ERRORS, backoff_delay, parse_retry_after
+from .priority import get_url_scorer
+from .rules import parse_rules
+from .search_cache import bump_generations
+from .sitemaps import sitemap_entries
+from .tasks import build_session, fetch_page, extract_page, LinkFilter, DEFAULT_MAX_PAGE_BYTES
+
+# What _fetch_and_store() returns for a page it handed back to the frontier for another attempt
+RETRYING = object()
+
+
+class CrawlEngine:
+    """
+    Concurrent crawl engine. Runs one CrawlJob, taking its options from the job.
+
+    A fixed number of worker coroutines share one host-aware frontier
+    (HostScheduler) that enforces per-host rate limits and robots.txt. Blocking
+    work (HTTP fetches and HTML parsing) runs in a thread pool sized to the
+    number of in-flight fetches and shares one pooled keep-alive session, and all
+    database writes go through a dedicated single DB thread so the event loop
+    never blocks on SQLite. Writes are batched: newly discovered links are
+    inserted with a few bulk statements per page, and page status updates are
+    buffered and flushed every settings.CRAWLER_DB_BATCH_SIZE pages (or
+    settings.CRAWLER_DB_FLUSH_INTERVAL seconds). When settings.CRAWLER_PARSE_WORKERS is set, parsing
+    and link normalization move to a shared process pool instead, fed through a
+    bounded hand-off (settings.CRAWLER_PARSE_QUEUE_SIZE pages per crawl).
+
+    In refresh mode every page already stored for the site is revalidated with
+    a conditional request (If-None-Match / If-Modified-Since); a 304, or a body
+    whose hash matches the stored one, keeps the stored content and skips
+    parsing and rewriting. Only changed pages feed new links into the frontier.
+
+    A new job with use_sitemaps also queues the pages listed in the site's
+    sitemaps up front, skipping stored pages whose <lastmod> is no newer than
+    the stored copy. Discovered links go through the job's tasks.LinkFilter (domain, file
+    extension, path restriction and the job's include / exclude URL rules),
+    and the job counts how many were dropped for each reason (links_dropped).
+
+    The frontier hands out the highest-priority URL first (see
+    crawler.priority): shallow pages, sitemap pages with a high <priority>
+    and pages many crawled pages link to go before listing pages such as
+    tags and archives. max_pages is a hard budget: each worker reserves a
+    slot before taking a URL and gives it back unless the page was crawled,
+    so exactly max_pages pages are crawled when the site has that many, and
+    whatever is still queued then is left uncrawled.
+
+    Fetch failures are recorded with their CrawledPage.ErrorChoices category.
+    Transient ones (timeouts, connection errors, 429s and 5xx) are retried
+    up to settings.CRAWLER_FETCH_RETRIES times, with exponential backoff and
+    jitter and no sooner than a Retry-After allows, while the frontier adapts
+    each host's concurrency and pauses hosts that keep failing. A job with
+    retry_errors queues the site's pages that failed with those categories
+    again.
+
+    The frontier is persisted as the job's FrontierEntry rows (written in the
+    same batches as the pages), so a job interrupted by a restart resumes from
+    its remaining queue instead of starting over; see crawler.jobs. The engine
+    holds the job's lease while it runs and stops, without writing anything
+    more, if another worker takes the job over.
+    """
+
+    def __init__(self, job_id, max_page_bytes=None):
+        self.job_id = job_id
+        self.max_page_bytes = max_page_bytes or getattr(settings, 'CRAWLER_MAX_PAGE_BYTES', DEFAULT_MAX_PAGE_BYTES)
+
+        # Job options, loaded by _start_job()
+        self.initial_page_id = None
+        self.max_pages = None
+        self.max_depth = None
+        self.restrict_to_path = False
+        self.base_path = None
+        self.concurrency = None
+        self.rate_limit = None # Per-host requests/sec override for this job
+        self.refresh = False
+        self.link_filter = None # tasks.LinkFilter for the job's domain, path restriction and URL rules
+        self.use_sitemaps = False
+        self._resumed = False # The job had a persisted frontier to resume from
+
+        self.start_url = None
+        self.base_domain = None
+        self.pages_crawled = 0
+        self.pages_unchanged = 0
+        self.visited = VisitedSet() # Canonical URLs queued or crawled by this job, as fingerprints
+        self.canonicalizer = get_canonicalizer()
+        self.frontier = None # Created inside run() so it binds to the running loop
+        self.scorer = get_url_scorer()
+        self._inlinks = {} # Queued URL -> links to it seen so far, once there is more than one
+        self._reserved = 0 # max_pages slots held by workers (see _reserve_budget)
+        self._budget_released = None # Set when a slot is given back, created inside run()
+        self.fetch_retries = getattr(settings, 'CRAWLER_FETCH_RETRIES', 3)
+        self.retry_backoff = getattr(settings, 'CRAWLER_RETRY_BACKOFF', 1.0)
+        self.retry_backoff_max = getattr(settings, 'CRAWLER_RETRY_BACKOFF_MAX', 60.0)
+        self._attempts = {} # URL waiting for a retry -> failed fetches so far
+        self._pages = {} # Queued URL -> its page record (PAGE_STATE_FIELDS only)
+        self._writes = PageWriteBuffer(
+            job_id=job_id,
+            batch_size=getattr(settings, 'CRAWLER_DB_BATCH_SIZE', 25),
+            flush_interval=getattr(settings, 'CRAWLER_DB_FLUSH_INTERVAL', 1.0),
+        )
+
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='crawl-db')
+        # Sized from the job's concurrency, so created once the job is loaded
+        self._fetch_executor = None
+        self.session = None
+        self.parse_pool = get_parse_pool()
+        self._parse_slots = None # Bounded fetch -> parse hand-off, created inside run()
+        self._loop = None
+        self._stop = None # Set by stop() or a lost lease, created inside run()
+        self._lease_lost = False
+        self._stop_requested = False
+
+    def stop(self):
+        """
+        Asks a running crawl to stop soon: the job goes back to the queue with
+        its progress saved, for any worker to resume. Safe to call from any thread.
+        """
+        self._stop_requested = True # In case the crawl loop hasn't started yet
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    # --- Helpers ---
+
+    def _db(self, func, *args, **kwargs):
+        """Runs a synchronous ORM callable on the engine's DB thread."""
+        return sync_to_async(func, thread_sensitive=False, executor=self._db_executor)(*args, **kwargs)
+
+    async def _blocking(self, func, *args):
+        """Runs a blocking (network / CPU) callable on the fetch thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._fetch_executor, func, *args)
+
+    def _visit_key(self, url):
+        # Links come out of the parse stage canonical already; stored URLs (e.g. the start URL) may not be
+        try:
+            return self.canonicalizer.canonicalize(url)
+        except ValueError:
+            return url
+
+    def _limit_reached(self):
+        return self.max_pages is not None and self.pages_crawled >= self.max_pages
+
+    async def _reserve_budget(self):
+        """
+        Takes a max_pages slot for the next URL, waiting while every slot is
+        crawled or held by another worker. Returns False once max_pages pages
+        are crawled (or no worker holds a slot that could still come back).
+        """
+        while self.max_pages is not None and self.pages_crawled + self._reserved >= self.max_pages:
+            if self._reserved == 0:
+                return False
+            self._budget_released.clear()
+            await self._budget_released.wait()
+        self._reserved += 1
+        return True
+
+    def _release_budget(self):
+        """Gives back a slot; pages_crawled already counts it if the page was crawled."""
+        self._reserved -= 1
+        self._budget_released.set()
+
+    async def _flush_writes(self, force=False):
+        """
+        Writes buffered page updates (and the job's progress) once a batch is
+        full, or always with force.
+        """
+        if self._lease_lost:
+            return
+        if force or self._writes.should_flush():
+            try:
+                await self._db(self._writes.take().flush)
+            except LeaseLost as e:
+                self._on_lease_lost(e)
+
+    def _on_lease_lost(self, error):
+        logging.warning(f"{error}; stopping without writing anything more.")
+        self._lease_lost = True
+        self._stop.set()
+
+    async def _heartbeat(self):
+        """Flushes periodically so the job's heartbeat stays fresh even while no page completes."""
+        interval = getattr(settings, 'CRAWLER_JOB_HEARTBEAT_INTERVAL', 30)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._flush_writes(force=True)
+            except Exception as e:
+                logging.error(f"Heartbeat failed for crawl job {self.job_id}: {e}")
+
+    # --- Synchronous DB operations (run on the DB thread) ---
+
+    def _start_job(self):
+        """
+        Claims the job and loads its options. Returns the initial page and the
+        frontier to start from as [(page, depth, priority)], or (None, None) if
+        the job can't run.
+
+        A new job seeds its persisted frontier with the initial page (and, in
+        refresh mode, every known page of the site). A resumed job rebuilds the
+        visited set from its frontier and requeues what was queued or in
+        progress when it stopped.
+        """
+        if not claim_job(self.job_id):
+            logging.info(f"Crawl job {self.job_id} is finished or running elsewhere; not starting it.")
+            return None, None
+
+        job = CrawlJob.objects.select_related('initial_page').get(pk=self.job_id)
+        self.initial_page_id = job.initial_page_id
+        self.max_pages = job.max_pages
+        self.max_depth = job.max_depth
+        self.restrict_to_path = job.restrict_to_path
+        self.base_path = job.base_path
+        self.concurrency = job.concurrency or getattr(settings, 'CRAWLER_CONCURRENCY', 8)
+        self.rate_limit = job.rate_limit
+        self.refresh = job.refresh
+        self.use_sitemaps = job.use_sitemaps
+        self.pages_crawled = job.pages_crawled
+        self.pages_unchanged = job.pages_unchanged
+        self._writes.links_dropped.update(job.links_dropped or {})
+
+        initial_page = job.initial_page
+        if not initial_page.domain:
+            logging.error(f"Initial page ID {self.initial_page_id} has no domain ({initial_page.url}). Cannot crawl.")
+            initial_page.status = CrawledPage.StatusChoices.FAILED
+            initial_page.error_message = "Missing domain information."
+            initial_page.save(update_fields=['status', 'error_message'])
+            self._mark_job_finished(CrawlJob.StatusChoices.FAILED, "Missing domain information.")
+            return None, None
+        self.start_url = initial_page.url
+        self.base_domain = initial_page.domain
+        self.link_filter = LinkFilter(
+            self.base_domain, self.restrict_to_path, self.base_path,
+            include=parse_rules(job.include_rules), exclude=parse_rules(job.exclude_rules),
+        )
+
+        if job.frontier.exists():
+            # The initial page has been through the crawl loop (or is queued in it) already
+            self._resumed = True
+            return initial_page, self._resume_frontier()
+
+        # Update initial page status to PROCESSING
+        initial_page.status = CrawledPage.StatusChoices.PROCESSING
+        initial_page.error_message = None # Clear previous errors
+        initial_page.error_category = ''
+        initial_page.save(update_fields=['status', 'error_message', 'error_category'])
+
+        queue = [(initial_page, 0, self.scorer.score(initial_page.url, 0))]
+        if self.refresh:
+            # Revalidate everything we already have, as if linked from the start page
+            limit = self.max_pages - 1 if self.max_pages is not None else None
+            queue += [(page, 1, self.scorer.score(page.url, 1)) for page in self._known_pages(limit)]
+        elif job.retry_errors:
+            # Fetch the pages that failed this way before again, as if linked from the start page
+            limit = self.max_pages - 1 if self.max_pages is not None else None
+            failed = self._known_pages(limit, status=CrawledPage.StatusChoices.FAILED, error_category__in=job.retry_errors)
+            queue += [(page, 1, self.scorer.score(page.url, 1)) for page in failed]
+            logging.info(f"Retrying {len(failed)} pages of {self.base_domain} that failed with: {', '.join(job.retry_errors)}")
+        FrontierEntry.objects.bulk_create(
+            [FrontierEntry(job_id=self.job_id, page=page, depth=depth, priority=priority) for page, depth, priority in queue],
+            batch_size=DB_CHUNK_SIZE,
+        )
+        CrawlJob.objects.filter(pk=self.job_id).update(pages_pending=len(queue))
+        return initial_page, queue
+
+    def _resume_frontier(self):
+        # claim_job() already put the previous holder's in-progress URLs back in the queue
+        entries = FrontierEntry.objects.filter(job_id=self.job_id).select_related('page').only(
+            'depth', 'priority', 'state', *(f'page__{field}' for field in PAGE_STATE_FIELDS)
+        ).order_by('-priority', 'id')
+
+        queue = []
+        for entry in entries.iterator(chunk_size=2000):
+            self.visited.add(self._visit_key(entry.page.url))
+            if entry.state != FrontierEntry.StateChoices.DONE:
+                queue.append((entry.page, entry.depth, entry.priority))
+        logging.info(
+            f"Resuming crawl job {self.job_id}: {len(queue)} queued of {len(self.visited)} known URLs, "
+            f"{self.pages_crawled} pages already crawled"
+        )
+        return queue
+
+    def _record_links(self, links, depth, priorities):
+        return record_links(links, self.base_domain, self.job_id, depth, priorities)
+
+    def _record_sitemap_links(self, entries, limit=None):
+        """
+        Queues sitemap pages ({url: (lastmod, priority)}) at depth 1, as if
+        linked from the start page, except those whose stored copy is at least
+        as new as their lastmod; with a `limit`, only that many of the highest
+        priority. Returns ({url: page} for the queued ones, the set of skipped URLs).
+        """
+        urls = list(entries)
+        unchanged = set()
+        for start in range(0, len(urls), DB_CHUNK_SIZE):
+            stored = CrawledPage.objects.filter(
+                url__in=urls[start:start + DB_CHUNK_SIZE], status=CrawledPage.StatusChoices.COMPLETED,
+            ).exclude(content_hash='').values_list('url', 'updated_at')
+            for url, updated_at in stored:
+                lastmod = entries[url][0]
+                if lastmod is not None and updated_at is not None and lastmod <= updated_at:
+                    unchanged.add(url)
+
+        new_links = [url for url in urls if url not in unchanged]
+        priorities = {url: entries[url][1] for url in new_links}
+        if limit is not None and len(new_links) > limit:
+            new_links = heapq.nlargest(limit, new_links, key=priorities.__getitem__)
+        recorded = self._record_links(new_links, 1, priorities) if new_links else {}
+        renew_lease(self.job_id, sitemap_pages=len(recorded), sitemap_unchanged=len(unchanged))
+        return recorded, unchanged
+
+    def _known_pages(self, limit=None, **filters):
+        """
+        Returns the pages already stored for this site (within the path restriction)
+        matching `filters`, marking them PENDING so the crawl revisits them.
+        """
+        pages = CrawledPage.objects.filter(domain=self.base_domain, **filters).exclude(pk=self.initial_page_id)
+        if self.restrict_to_path and self.base_path is not None:
+            scheme = urlparse(self.start_url).scheme
+            pages = pages.filter(url__startswith=f"{scheme}://{self.base_domain}{self.base_path}")
+        known = list(pages.order_by('id').only(*PAGE_STATE_FIELDS)[:limit])
+
+        ids = [page.pk for page in known]
+        for start in range(0, len(ids), DB_CHUNK_SIZE):
+            CrawledPage.objects.filter(pk__in=ids[start:start + DB_CHUNK_SIZE]).update(status=CrawledPage.StatusChoices.PENDING)
+        return known
+
+    def _restore_uncrawled(self):
+        """
+        Pages still queued when the crawl ended (max_pages ran out first), or
+        waiting for a retry, were never fetched: those holding content from an
+        earlier crawl go back to COMPLETED, those whose earlier crawl failed
+        back to FAILED, and the rest to PENDING. Their frontier entries are
+        marked DONE. Returns the resulting changes to the job's counters.
+        """
+        entries = FrontierEntry.objects.filter(job_id=self.job_id)
+        queued = entries.filter(state=FrontierEntry.StateChoices.QUEUED)
+        retrying = entries.filter(state=FrontierEntry.StateChoices.IN_PROGRESS)
+        CrawledPage.objects.filter(
+            pk__in=Subquery(retrying.values('page_id')), status=CrawledPage.StatusChoices.PROCESSING,
+        ).update(status=CrawledPage.StatusChoices.PENDING)
+        restored, failed = restore_uncrawled(CrawledPage.objects.filter(
+            pk__in=Subquery(entries.exclude(state=FrontierEntry.StateChoices.DONE).values('page_id')),
+        ))
+        dropped = queued.update(state=FrontierEntry.StateChoices.DONE)
+        abandoned = retrying.update(state=FrontierEntry.StateChoices.DONE)
+        if restored or failed:
+            bump_generations([self.base_domain])
+            logging.info(f"Kept the stored copy of {restored + failed} pages crawl job {self.job_id} queued but didn't reach")
+        return Counter(
+            pages_pending=-dropped, pages_processing=-abandoned, pages_crawled=restored, pages_failed=failed,
+        )
+
+    def _finalize(self):
+        with transaction.atomic():
+            counters = self._restore_uncrawled()
+            # If the loop finished without error and the initial page is still PROCESSING
+            # (e.g., limits were hit before it was processed), mark it as COMPLETED.
+            final_initial_page = CrawledPage.objects.get(pk=self.initial_page_id)
+            if final_initial_page.status == CrawledPage.StatusChoices.PROCESSING:
+                final_initial_page.status = CrawledPage.StatusChoices.COMPLETED
+                final_initial_page.save(update_fields=['status'])
+                # It never went through the crawl loop; its frontier entry was dropped as pending above
+                counters['pages_crawled'] += 1
+                logging.info(f"Marked initial page {self.initial_page_id} as COMPLETED after crawl loop finished.")
+            self._mark_job_finished(
+                CrawlJob.StatusChoices.COMPLETED,
+                **{field: F(field) + change for field, change in counters.items() if change},
+            )
+
+    def _mark_job_finished(self, status, error_message=None, **fields):
+        # Only while we still hold the lease
+        CrawlJob.objects.filter(pk=self.job_id, worker=worker_id()).update(
+            status=status,
+            error_message=error_message,
+            finished_at=timezone.now(),
+            lease_expires_at=None,
+            **fields
+        )
+
+    def _release(self):
+        if release_job(self.job_id):
+            logging.info(f"Stopped crawl job {self.job_id} after {self.pages_crawled} pages; it is queued to resume.")
+
+    def _mark_initial_failed(self, error_message):
+        if self.initial_page_id is not None:
+            page = CrawledPage.objects.get(pk=self.initial_page_id)
+            page.status = CrawledPage.StatusChoices.FAILED
+            page.error_message = error_message
+            page.save(update_fields=['status', 'error_message'])
+        self._mark_job_finished(CrawlJob.StatusChoices.FAILED, error_message)
+
+    # --- Page status updates (queued on the write buffer, written by _flush_writes) ---
+
+    def _mark_failed(self, page, error_message, error_category=CrawledPage.ErrorChoices.OTHER):
+        self._attempts.pop(page.url, None)
+        page.status = CrawledPage.StatusChoices.FAILED
+        page.error_message = error_message
+        page.error_category = error_category
+        page.body = page.content_markdown = page.content_outline = None
+        # Without content there is nothing to revalidate next time
+        page.etag = page.last_modified = page.content_hash = ''
+        self._writes.save(page, [
+            'status', 'error_message', 'error_category', 'body', 'content_markdown', 'content_outline',
+            'etag', 'last_modified', 'content_hash',
+        ])
+
+    def _mark_completed(self, page, title, description, body, content, etag, last_modified, content_hash):
+        page.title = title[:511] # Use model max_length - 1
+        page.summary = description
+        page.body = body # Written to the body store by the write buffer
+        page.content_markdown = content
+        page.content_outline = markdown_outline(content) # A scan for heading lines; cheap next to parsing
+        page.status = CrawledPage.StatusChoices.COMPLETED
+        page.error_message = None # Clear error on success
+        page.error_category = ''
+        page.etag = etag
+        page.last_modified = last_modified
+        page.content_hash = content_hash
+        page.updated_at = timezone.now() # bulk_update skips auto_now
+        self._writes.save(page, [
+            'title', 'summary', 'status', 'error_message', 'error_category', 'body', 'content_markdown',
+            'content_outline', 'etag', 'last_modified', 'content_hash', 'updated_at',
+        ], text=content) # The main content is what search indexes
+
+    def _mark_unchanged(self, page, etag, last_modified):
+        # Content, title and updated_at are left alone: the page hasn't changed
+        page.status = CrawledPage.StatusChoices.COMPLETED
+        page.error_message = None
+        page.error_category = ''
+        page.etag = etag or page.etag
+        page.last_modified = last_modified or page.last_modified
+        self._writes.save(page, ['status', 'error_message', 'error_category', 'etag', 'last_modified'], unchanged=True)
+
+    # --- Crawl loop ---
+
+    async def run(self):
+        """Runs the crawl to completion. Never raises; failures are recorded on the initial page."""
+        try:
+            await self._run()
+        finally:
+            await self._db(connections.close_all) # Closes the DB thread's own connection
+            if self.session is not None:
+                self.session.close()
+            if self._fetch_executor is not None:
+                self._fetch_executor.shutdown(wait=False)
+            self._db_executor.shutdown(wait=False)
+
+    async def _run(self):
+        try:
+            initial_page, queue = await self._db(self._start_job)
+            if initial_page is None:
+                return
+        except CrawlJob.DoesNotExist:
+            logging.error(f"Cannot start crawl: crawl job {self.job_id} not found.")
+            return
+        except Exception as e:
+            logging.exception(f"Error initializing crawl job {self.job_id} (page ID {self.initial_page_id}): {e}")
+            try:
+                await self._db(self._mark_initial_failed, f"Initialization error: {e}")
+            except Exception as db_err:
+                logging.error(f"Additionally failed to update status for page ID {self.initial_page_id} after init error: {db_err}")
+            return
+
+        restriction_msg = f" restricted to path '{self.base_path}'" if self.restrict_to_path else ""
+        rules = self.link_filter.rules
+        if rules:
+            restriction_msg += f" with {len(rules.include)} include / {len(rules.exclude)} exclude URL rules"
+        logging.info(
+            f"Starting crawl job {self.job_id} from initial page ID: {self.initial_page_id} ({self.start_url}) with "
+            f"max_pages={self.max_pages} max_depth={self.max_depth} concurrency={self.concurrency}{restriction_msg}"
+        )
+
+        self._fetch_executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='crawl-fetch')
+        self.session = build_session(pool_size=self.concurrency)
+        self.frontier = HostScheduler(
+            rate=self.rate_limit, executor=self._fetch_executor, session=self.session, concurrency=self.concurrency,
+        )
+        self._parse_slots = asyncio.Semaphore(getattr(settings, 'CRAWLER_PARSE_QUEUE_SIZE', 16))
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+        self._budget_released = asyncio.Event()
+        for page, depth, priority in queue:
+            self.visited.add(self._visit_key(page.url))
+            self._pages[page.url] = page
+            self.frontier.push(page.url, depth, priority)
+        if self.refresh:
+            logging.info(f"Refresh crawl: revalidating {len(queue) - 1} known pages for {self.base_domain}")
+
+        heartbeat = asyncio.create_task(self._heartbeat()) # Also keeps the lease while sitemaps are read
+        if self.use_sitemaps and not self._resumed and (self.max_depth is None or self.max_depth >= 1):
+            try:
+                await self._seed_from_sitemaps(len(queue))
+            except Exception as e:
+                logging.exception(f"Could not seed crawl job {self.job_id} from sitemaps: {e}")
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            # join() returns once every queued URL (including ones discovered along the way) is done
+            finished = asyncio.create_task(self.frontier.join())
+            stopped = asyncio.create_task(self._stop.wait())
+            await asyncio.wait([finished, stopped], return_when=asyncio.FIRST_COMPLETED)
+            completed = finished.done()
+            stopped.cancel()
+            for task in workers + [finished]:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            heartbeat.cancel()
+
+            if self._lease_lost:
+                return # Another worker owns the job now
+            await self._flush_writes(force=True)
+            if self._lease_lost:
+                return
+            if not completed:
+                await self._db(self._release) # Stopped early: back to the queue
+                return
+
+            logging.info(
+                f"Crawl loop finished for initial page ID: {self.initial_page_id} ({self.start_url}). "
+                f"Crawled {self.pages_crawled} pages ({self.pages_unchanged} unchanged)."
+            )
+            if self._writes.links_dropped:
+                drops = ', '.join(f"{reason}: {count}" for reason, count in self._writes.links_dropped.most_common())
+                logging.info(f"Links dropped by crawl job {self.job_id}: {drops}")
+            await self._db(self._finalize)
+        except Exception as e:
+            # --- Global Error Handling for the Crawl ---
+            logging.exception(f"Critical error during crawl job {self.job_id} ({self.start_url}): {e}")
+            for task in workers + [heartbeat]:
+                task.cancel()
+            try:
+                await self._flush_writes(force=True) # Keep the progress made so far
+                await self._db(self._mark_initial_failed, f"Runtime error: {e}")
+            except Exception as db_err:
+                logging.error(f"Additionally failed to update status for page ID {self.initial_page_id} after runtime error: {db_err}")
+        finally:
+            # Also when the crawl itself is cancelled: nothing may keep writing after run() returns
+            for task in workers + [heartbeat]:
+                task.cancel()
+
+    async def _worker(self):
+        while await self._reserve_budget():
+            try:
+                current_url, current_depth = await self.frontier.get()
+                handed_back = False
+                try:
+                    handed_back = await self._process(current_url, current_depth)
+                    await self._flush_writes()
+                except Exception as e:
+                    logging.exception(f"Unexpected error processing {current_url}: {e}")
+                finally:
+                    if not handed_back: # frontier.retry() finished its handout already
+                        self.frontier.task_done(current_url)
+            finally:
+                self._release_budget()
+
+        # max_pages reached and nothing in flight: what is still queued stays uncrawled (and PENDING)
+        dropped = self.frontier.clear()
+        if dropped:
+            logging.info(f"max_pages limit ({self.max_pages}) reached; leaving {dropped} queued URLs uncrawled.")
+
+    async def _process(self, current_url, current_depth):
+        """Crawls one URL handed out by the frontier. Returns True if it went back to the frontier for a retry."""
+        page = self._pages.pop(current_url, None)
+        self._inlinks.pop(current_url, None)
+        if page is None:
+            logging.error(f"DB record inconsistency: {current_url} not found during processing. Skipping.")
+            return
+
+        # --- Check Limits (max_pages is enforced by _reserve_budget) ---
+        if self.max_depth is not None and current_depth > self.max_depth:
+            logging.info(f"Skipping {current_url} - Exceeds max_depth {self.max_depth}")
+            self._writes.skip(page)
+            return
+
+        logging.info(f"Processing: {current_url} (Depth: {current_depth}, Crawled: {self.pages_crawled})")
+
+        # --- Update Status (a page waiting for a retry is PROCESSING already) ---
+        if current_url not in self._attempts:
+            self._writes.mark_processing(page)
+        if not self.frontier.allowed(current_url):
+            logging.info(f"Skipping {current_url} - Disallowed by robots.txt")
+            self._mark_failed(page, "Disallowed by robots.txt", CrawledPage.ErrorChoices.ROBOTS)
+            return
+        if self.frontier.unavailable(current_url):
+            self._mark_failed(page, "Host unavailable: too many failures in a row", CrawledPage.ErrorChoices.HOST_UNAVAILABLE)
+            return
+
+        links = await self._fetch_and_store(page, current_url, current_depth)
+        if links is RETRYING:
+            return True
+        if links is not None:
+            # --- Enqueue Links (already filtered and normalized by the parse stage) ---
+            await self._enqueue(links, current_depth + 1)
+        return False
+
+    def _read_sitemaps(self):
+        """
+        Fetch-thread half of sitemap seeding: returns {canonical URL: (lastmod,
+        frontier priority)} for the crawlable pages the site's sitemaps list
+        that aren't queued yet, and a Counter of the listed URLs dropped by
+        the link filter.
+        """
+        entries = {}
+        dropped = Counter()
+        for loc, lastmod, priority in sitemap_entries(self.start_url, self.session):
+            url, reason = self.link_filter.check(loc)
+            if reason is not None:
+                dropped[reason] += 1
+            elif url not in self.visited:
+                entries[url] = (lastmod, self.scorer.score(url, 1, priority))
+        return entries, dropped
+
+    async def _seed_from_sitemaps(self, queued):
+        """Adds the pages listed in the site's sitemaps to a new job's frontier (see sitemaps.sitemap_entries)."""
+        entries, dropped = await self._blocking(self._read_sitemaps)
+        self._writes.count_dropped(dropped)
+        if not entries or self._stop.is_set():
+            return
+        limit = max(self.max_pages - queued, 0) if self.max_pages is not None else None
+        try:
+            recorded, unchanged = await self._db(self._record_sitemap_links, entries, limit)
+        except LeaseLost as e:
+            self._on_lease_lost(e)
+            return
+        except Exception as db_err:
+            logging.error(f"DB Error recording {len(entries)} sitemap links: {db_err}")
+            return
+        for link in unchanged:
+            self.visited.add(link) # Links to them aren't followed either: that would refetch them
+        for link, page in recorded.items():
+            self.visited.add(link)
+            self._pages[link] = page
+            self.frontier.push(link, 1, entries[link][1])
+        logging.info(
+            f"Seeded crawl job {self.job_id} with {len(recorded)} pages from sitemaps; "
+            f"skipped {len(unchanged)} not modified (by lastmod) since they were stored"
+        )
+
+    def _download(self, url, etag, last_modified):
+        """Fetch-thread half of a page: fetch, decode and hash. Returns (body, encoding, html_content, content_hash, response, error)."""
+        body, encoding, response, error = fetch_page(url, self.session, self.max_page_bytes, etag, last_modified)
+        if body is None:
+            return None, None, None, None, response, error
+        return body, encoding, body.decode(encoding, errors='replace'), hashlib.sha256(body).hexdigest(), response, None
+
+    def _retry_later(self, page, url, depth, error, retry_after):
+        """
+        Queues a page whose fetch failed transiently for another attempt, after
+        an exponential backoff with jitter (and no sooner than the server's
+        Retry-After). Returns False once it is out of attempts.
+        """
+        attempt = self._attempts.get(url, 0)
+        if attempt >= self.fetch_retries or self._stop.is_set():
+            return False
+        delay = backoff_delay(attempt, self.retry_backoff, self.retry_backoff_max)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.frontier.retry_after_max))
+        logging.info(f"Retrying {url} in {delay:.1f}s ({error.label}; attempt {attempt + 2} of {self.fetch_retries + 1})")
+        self._attempts[url] = attempt + 1
+        self._pages[url] = page
+        self.frontier.retry(url, depth, delay)
+        return True
+
+    def _fetch_error_message(self, url, error, response):
+        if error in (CrawledPage.ErrorChoices.NOT_HTML, CrawledPage.ErrorChoices.TOO_LARGE):
+            return f"Skipped: {error.label}"
+        message = f"Fetch failed: HTTP {response.status_code}" if response is not None else f"Fetch failed: {error.label}"
+        attempts = self._attempts.get(url, 0) + 1
+        return f"{message} ({attempts} attempts)" if attempts > 1 else message
+
+    async def _extract(self, body, encoding, html_content, url):
+        """Parse stage: returns (title, description, filtered links, main content as Markdown, dropped link counts)."""
+        async with self._parse_slots:
+            if self.parse_pool is not None:
+                try:
+                    return await extract_in_pool(self.parse_pool, body, encoding, url, self.link_filter)
+                except Exception as e:
+                    # e.g. a broken pool after a worker crash; parse locally rather than lose the page
+                    logging.warning(f"Parse pool failed for {url} ({e}); parsing in-process")
+            return await self._blocking(extract_page, html_content, url, self.link_filter)
+
+    async def _fetch_and_store(self, page, current_url, current_depth):
+        """
+        Fetches, parses and saves one page. Returns its filtered links, RETRYING
+        if the fetch failed and the page went back to the frontier, or None if
+        the fetch failed for good or the page is unchanged since the last crawl.
+        """
+        # --- Fetch HTML (conditionally, when refreshing a stored page) ---
+        conditional = self.refresh and bool(page.content_hash) # Stored content to revalidate
+        body, encoding, html_content, content_hash, response_obj, error = await self._blocking(
+            self._download, current_url,
+            page.etag if conditional else None,
+            page.last_modified if conditional else None,
+        )
+        retry_after = parse_retry_after(response_obj.headers.get('Retry-After')) if error and response_obj is not None else None
+        self.frontier.report(current_url, error, retry_after)
+        if error in TRANSIENT_ERRORS and self._retry_later(page, current_url, current_depth, error, retry_after):
+            return RETRYING
+        if error is not None:
+            self._mark_failed(page, self._fetch_error_message(current_url, error, response_obj), error)
+            return None
+        self._attempts.pop(current_url, None)
+        if response_obj.status_code == 304:
+            self._mark_unchanged(page, response_obj.headers.get('ETag'), response_obj.headers.get('Last-Modified'))
+            logging.info(f"Not modified: {current_url}")
+            self.pages_crawled += 1
+            self.pages_unchanged += 1
+            return None
+
+        etag = response_obj.headers.get('ETag', '')[:512]
+        last_modified = response_obj.headers.get('Last-Modified', '')[:64]
+        if conditional and content_hash == page.content_hash:
+            # Server ignored the validators but the body is identical
+            self._mark_unchanged(page, etag, last_modified)
+            logging.info(f"Unchanged content: {current_url}")
+            self.pages_crawled += 1
+            self.pages_unchanged += 1
+            return None
+
+        # --- Parse and Extract (and compress the HTML for storage meanwhile) ---
+        (title, description, links, content, dropped), page_body = await asyncio.gather(
+            self._extract(body, encoding, html_content, current_url),
+            self._blocking(PageBody.from_html, html_content),
+        )
+
+        # --- Update DB Record (Success) ---
+        self._mark_completed(page, title, description, page_body, content, etag, last_modified, content_hash)
+        self._writes.count_dropped(dropped)
+        logging.info(f"Successfully processed and saved: {current_url}")
+        self.pages_crawled += 1 # Increment only on successful processing
+        return links
+
+    async def _enqueue(self, links, next_depth):
+        if self.max_depth is not None and next_depth > self.max_depth:
+            return # Don't add links that exceed max depth
+        if self._limit_reached():
+            return # Nothing more will be crawled
+
+        new_links = {} # link -> frontier priority
+        for link in sorted(links):
+            if link in self.visited:
+                self._count_inlink(link)
+                continue
+            # Claim the link before awaiting the DB so other workers don't queue it twice
+            self.visited.add(link)
+            new_links[link] = self.scorer.score(link, next_depth)
+
+        if not new_links:
+            return
+
+        try:
+            recorded = await self._db(self._record_links, list(new_links), next_depth, new_links)
+        except LeaseLost as e:
+            self._on_lease_lost(e)
+            return
+        except Exception as db_err:
+            # Handle potential IntegrityError if URL is too long, etc.
+            logging.error(f"DB Error recording {len(new_links)} links: {db_err}")
+            return
+        for link, page in recorded.items():
+            self._pages[link] = page
+            self.frontier.push(link, next_depth, new_links[link])
+            logging.debug(f"Added to queue: {link} (Depth: {next_depth}, Priority: {new_links[link]})")
+
+    def _count_inlink(self, link):
+        """Counts another link to an already known URL, raising its priority each time its in-links double while it is queued."""
+        priority = self.frontier.priority(link)
+        if priority is None:
+            return # Crawled or in flight already
+        inlinks = self._inlinks.get(link, 1) + 1
+        self._inlinks[link] = inlinks
+        if inlinks & (inlinks - 1) == 0: # A power of two: UrlScorer.inlink_points() went up a step
+            self.frontier.reprioritize(link, priority + self.scorer.inlink_weight)
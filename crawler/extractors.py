@@ -0,0 +1,134 @@
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.utils.module_loading import import_string
+from lxml import etree
+
+from .content import MarkdownWriter, soup_to_markdown
+
+
+class BaseExtractor:
+    """
+    Interface for HTML extraction backends.
+
+    `extract()` takes decoded HTML and the page URL and returns
+    (title, description, links, content): the stripped text of the first
+    <title>, the content of the first <meta name="description">, the set of
+    stripped, non-empty <a href> values, and the page's main content as
+    Markdown (see content.MarkdownWriter). Backends may raise; callers fall
+    back to the BeautifulSoup backend.
+    """
+    name = None
+
+    def extract(self, html_content, url):
+        raise NotImplementedError
+
+
+class SoupExtractor(BaseExtractor):
+    """Builds a full BeautifulSoup tree. Slowest, but the most forgiving; used as the fallback."""
+    name = 'soup'
+
+    def extract(self, html_content, url):
+        soup = BeautifulSoup(html_content, 'lxml') # Use lxml for speed if available
+
+        # Extract Title
+        title_tag = soup.find('title')
+        title = title_tag.get_text().strip() if title_tag else ''
+
+        # Extract Meta Description
+        description_tag = soup.find('meta', attrs={'name': 'description'})
+        description = description_tag['content'].strip() if description_tag and 'content' in description_tag.attrs else ''
+
+        # Extract Links
+        links = set()
+        for a_tag in soup.find_all('a', href=True):
+            link = a_tag['href'].strip()
+            if link:
+                links.add(link)
+
+        # Extract Main Content
+        content = soup_to_markdown(soup)
+
+        return title, description, links, content
+
+
+class _ExtractionTarget:
+    """
+    lxml parser target: receives start/end/data events straight from libxml2's
+    HTML parser and keeps only what we need, so no tree is ever built.
+    """
+
+    def __init__(self):
+        self.title_parts = []
+        self.in_title = False
+        self.title_seen = False
+        self.description = None
+        self.links = set()
+        self.content = MarkdownWriter()
+
+    def start(self, tag, attrib):
+        self.content.start(tag, attrib)
+        if tag == 'a':
+            link = (attrib.get('href') or '').strip()
+            if link:
+                self.links.add(link)
+        elif tag == 'meta':
+            if self.description is None and attrib.get('name') == 'description':
+                self.description = (attrib.get('content') or '').strip()
+        elif tag == 'title' and not self.title_seen:
+            self.in_title = True
+
+    def end(self, tag):
+        self.content.end(tag)
+        if tag == 'title' and self.in_title:
+            self.in_title = False
+            self.title_seen = True
+
+    def data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+        self.content.data(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return ''.join(self.title_parts).strip(), self.description or '', self.links, self.content.close()
+
+
+class LxmlExtractor(BaseExtractor):
+    """Streams the document through lxml's HTML parser with a callback target; no tree, no soup."""
+    name = 'lxml'
+
+    def extract(self, html_content, url):
+        target = _ExtractionTarget()
+        parser = etree.HTMLParser(target=target, recover=True, no_network=True)
+        try:
+            parser.feed(html_content)
+        except ValueError:
+            # Unicode input carrying an XML encoding declaration; lxml wants bytes for that
+            target = _ExtractionTarget()
+            parser = etree.HTMLParser(target=target, recover=True, no_network=True, encoding='utf-8')
+            parser.feed(html_content.encode('utf-8'))
+        return parser.close()
+
+
+EXTRACTORS = {
+    LxmlExtractor.name: LxmlExtractor,
+    SoupExtractor.name: SoupExtractor,
+}
+
+_extractor_instances = {}
+
+
+def get_extractor(name=None):
+    """
+    Returns the extractor instance for `name` (default: settings.CRAWLER_EXTRACTOR).
+    Accepts a registered short name ('lxml', 'soup') or the dotted path of a
+    BaseExtractor subclass.
+    """
+    name = name or getattr(settings, 'CRAWLER_EXTRACTOR', LxmlExtractor.name)
+    extractor = _extractor_instances.get(name)
+    if extractor is None:
+        extractor_class = EXTRACTORS.get(name) or import_string(name)
+        extractor = _extractor_instances[name] = extractor_class()
+    return extractor
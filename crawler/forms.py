@@ -2,6 +2,9 @@ from django import forms
 from django.core.validators import URLValidator
 from django.utils.translation import gettext_lazy as _
 
+from .models import CrawledPage
+from .rules import validate_rules
+
 class UrlSubmitForm(forms.Form):
     """
     Form for submitting a starting URL to crawl.
@@ -39,6 +42,30 @@ class UrlSubmitForm(forms.Form):
         help_text=_("Optional limit on the crawl depth for testing.")
     )
 
+    concurrency = forms.IntegerField(
+        label=_("Concurrent Fetches"),
+        required=False,
+        min_value=1,
+        max_value=64,
+        widget=forms.NumberInput(attrs={
+            'placeholder': 'Leave empty for the server default',
+            'class': 'form-control'
+        }),
+        help_text=_("Optional number of pages fetched in parallel.")
+    )
+
+    rate_limit = forms.FloatField(
+        label=_("Requests per Second"),
+        required=False,
+        min_value=0.01,
+        widget=forms.NumberInput(attrs={
+            'placeholder': 'Leave empty for robots.txt / server default',
+            'class': 'form-control',
+            'step': 'any'
+        }),
+        help_text=_("Optional per-host request rate for this crawl. Overrides the robots.txt Crawl-delay.")
+    )
+
     restrict_to_path = forms.BooleanField(
         label=_("Restrict crawl to initial path?"),
         required=False,
@@ -47,6 +74,52 @@ class UrlSubmitForm(forms.Form):
         help_text=_("If checked, only crawl pages under the same path as the starting URL (e.g., /docs/v1/).")
     )
 
+    refresh = forms.BooleanField(
+        label=_("Refresh existing pages only if changed?"),
+        required=False,
+        initial=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        help_text=_("If checked, pages already crawled for this site are revalidated with ETag / Last-Modified and kept as-is when unchanged.")
+    )
+
+    use_sitemaps = forms.BooleanField(
+        label=_("Seed from sitemap.xml?"),
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        help_text=_("If checked, pages listed in the site's sitemaps (robots.txt Sitemap: lines, or /sitemap.xml) are queued up front, and stored pages whose lastmod is older than our copy are not fetched again.")
+    )
+
+    retry_errors = forms.MultipleChoiceField(
+        label=_("Retry pages that failed with"),
+        required=False,
+        choices=CrawledPage.ErrorChoices.choices,
+        widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
+        help_text=_("Optional: pages of this site whose last crawl failed for one of these reasons are fetched again. Refreshing a site revisits every page already.")
+    )
+
+    include_rules = forms.CharField(
+        label=_("Include URLs matching"),
+        required=False,
+        widget=forms.Textarea(attrs={
+            'rows': 3,
+            'placeholder': '/docs/*\nre:^/api/v[23]/',
+            'class': 'form-control'
+        }),
+        help_text=_("Optional rules, one per line, matched against each link's path and query string: globs (* matches anything) or regular expressions prefixed with re:. Only matching links are crawled.")
+    )
+
+    exclude_rules = forms.CharField(
+        label=_("Exclude URLs matching"),
+        required=False,
+        widget=forms.Textarea(attrs={
+            'rows': 3,
+            'placeholder': '*/changelog/*\n/search*\nre:^/(de|fr|ja)/',
+            'class': 'form-control'
+        }),
+        help_text=_("Optional rules in the same form. Matching links are never crawled.")
+    )
+
     def clean_url(self):
         """
         Additional validation for the URL.
@@ -60,3 +133,17 @@ class UrlSubmitForm(forms.Form):
             except forms.ValidationError:
                 raise forms.ValidationError(_("Please enter a valid HTTP or HTTPS URL."), code='invalid_scheme')
         return url
+
+    def _clean_rules(self, field):
+        rules = self.cleaned_data.get(field, '')
+        try:
+            validate_rules(rules)
+        except ValueError as e:
+            raise forms.ValidationError(str(e), code='invalid_rule')
+        return rules
+
+    def clean_include_rules(self):
+        return self._clean_rules('include_rules')
+
+    def clean_exclude_rules(self):
+        return self._clean_rules('exclude_rules')
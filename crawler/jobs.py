@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CrawledPage, CrawlJob, FrontierEntry
+
+
+class LeaseLost(Exception):
+    """Raised when a worker finds that its lease on a crawl job was taken over by another worker."""
+
+
+def worker_id():
+    """Identifies this process in CrawlJob.worker: "<host>:<pid>"."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_timeout():
+    return timedelta(seconds=getattr(settings, 'CRAWLER_JOB_LEASE_TIMEOUT', 120))
+
+
+def create_crawl_job(initial_page, max_pages=None, max_depth=None, restrict_to_path=False, base_path=None,
+                     concurrency=None, rate_limit=None, refresh=False, include_rules='', exclude_rules='',
+                     use_sitemaps=True, retry_errors=()):
+    """
+    Queues a PENDING crawl job for `initial_page` with the given options.
+    `include_rules` / `exclude_rules` are URL rules, one per line (see crawler.rules).
+    With `use_sitemaps` the crawl also queues the pages listed in the site's sitemaps.
+    `retry_errors` (CrawledPage.ErrorChoices values) queues the site's pages
+    that failed with those error categories again.
+    """
+    return CrawlJob.objects.create(
+        initial_page=initial_page,
+        max_pages=max_pages,
+        max_depth=max_depth,
+        restrict_to_path=restrict_to_path,
+        base_path=base_path,
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        refresh=refresh,
+        include_rules=include_rules,
+        exclude_rules=exclude_rules,
+        use_sitemaps=use_sitemaps,
+        retry_errors=list(retry_errors),
+    )
+
+
+def run_crawl_job(job_id):
+    """
+    Runs (or resumes) a crawl job to completion on its own event loop, so it is
+    safe to call from a plain background thread.
+    """
+    # Imported here because the engine imports this module
+    from .engine import CrawlEngine
+
+    asyncio.run(CrawlEngine(job_id).run())
+
+
+# --- Leasing ---
+#
+# A job is run by one worker at a time, which holds a lease on it
+# (CrawlJob.worker / lease_expires_at) and renews it with every batch of
+# writes. The job's frontier URLs are leased along with it: IN_PROGRESS
+# entries belong to the lease holder, and go back to the queue when another
+# worker takes over an expired lease.
+
+def claim_job(job_id):
+    """
+    Takes the lease on a job and marks it RUNNING. Returns False if it already
+    finished or another worker holds an unexpired lease on it.
+    """
+    now = timezone.now()
+    claimable = (
+        Q(status=CrawlJob.StatusChoices.PENDING)
+        | Q(status=CrawlJob.StatusChoices.RUNNING, lease_expires_at__lt=now)
+        | Q(status=CrawlJob.StatusChoices.RUNNING, lease_expires_at__isnull=True)
+    )
+    # A single conditional UPDATE, so two workers can't both claim the job
+    claimed = CrawlJob.objects.filter(claimable, pk=job_id).update(
+        status=CrawlJob.StatusChoices.RUNNING,
+        worker=worker_id(),
+        heartbeat_at=now,
+        lease_expires_at=now + lease_timeout(),
+        started_at=Coalesce('started_at', now),
+        error_message=None,
+    )
+    if claimed:
+        # Whatever the previous holder was working on is queued again
+        requeue_in_progress(job_id)
+    return bool(claimed)
+
+
+def renew_lease(job_id, **fields):
+    """
+    Extends this worker's lease on the job, saving `fields` (e.g. progress
+    counters) with it. Raises LeaseLost if another worker has taken the job.
+    """
+    now = timezone.now()
+    renewed = CrawlJob.objects.filter(pk=job_id, worker=worker_id(), status=CrawlJob.StatusChoices.RUNNING).update(
+        heartbeat_at=now, lease_expires_at=now + lease_timeout(), **fields
+    )
+    if not renewed:
+        raise LeaseLost(f"Crawl job {job_id} is no longer leased to {worker_id()}")
+
+
+def release_job(job_id, **fields):
+    """Gives up this worker's lease, putting the job back in the queue (e.g. on shutdown)."""
+    with transaction.atomic():
+        released = CrawlJob.objects.filter(pk=job_id, worker=worker_id()).update(
+            status=CrawlJob.StatusChoices.PENDING, worker='', lease_expires_at=None, **fields
+        )
+        if released:
+            requeue_in_progress(job_id)
+    return bool(released)
+
+
+def next_job_ids(exclude=(), limit=10):
+    """IDs of jobs a worker could claim now, oldest first: queued ones, then ones with an expired lease."""
+    now = timezone.now()
+    claimable = (
+        Q(status=CrawlJob.StatusChoices.PENDING)
+        | Q(status=CrawlJob.StatusChoices.RUNNING, lease_expires_at__lt=now)
+        | Q(status=CrawlJob.StatusChoices.RUNNING, lease_expires_at__isnull=True)
+    )
+    return list(CrawlJob.objects.filter(claimable).exclude(pk__in=exclude).order_by('created_at').values_list('id', flat=True)[:limit])
+
+
+def requeue_in_progress(job_id):
+    """
+    Puts the URLs a job was working on back in its queue, and resets their
+    pages from PROCESSING to PENDING (and the job's counters with them).
+    """
+    with transaction.atomic():
+        in_progress = FrontierEntry.objects.filter(job_id=job_id, state=FrontierEntry.StateChoices.IN_PROGRESS)
+        CrawledPage.objects.filter(
+            pk__in=in_progress.values('page_id'), status=CrawledPage.StatusChoices.PROCESSING
+        ).update(status=CrawledPage.StatusChoices.PENDING)
+        requeued = in_progress.update(state=FrontierEntry.StateChoices.QUEUED)
+        if requeued:
+            CrawlJob.objects.filter(pk=job_id).update(
+                pages_processing=F('pages_processing') - requeued, pages_pending=F('pages_pending') + requeued,
+            )
+        return requeued
+
+
+def _worker_is_dead(worker):
+    """True if `worker` was a process on this host that no longer exists."""
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass # Exists, owned by someone else
+    return False
+
+
+def reclaim_stale_jobs(reset_orphaned_pages=True):
+    """
+    Puts RUNNING jobs whose worker is gone back to PENDING with their
+    in-progress URLs requeued: jobs whose lease has expired, and jobs leased
+    to a process on this host that no longer exists (so a restarted worker
+    doesn't wait out the lease). With `reset_orphaned_pages`, also resets
+    PROCESSING pages that no active job owns. Returns the reclaimed job IDs.
+    """
+    now = timezone.now()
+    reclaimed = []
+    for job in CrawlJob.objects.filter(status=CrawlJob.StatusChoices.RUNNING).only('id', 'worker', 'lease_expires_at'):
+        lease_expired = job.lease_expires_at is None or job.lease_expires_at < now
+        if not lease_expired and not _worker_is_dead(job.worker):
+            continue
+        # Only if nobody claimed it in the meantime
+        if CrawlJob.objects.filter(pk=job.pk, worker=job.worker, lease_expires_at=job.lease_expires_at).update(
+                status=CrawlJob.StatusChoices.PENDING, worker='', lease_expires_at=None):
+            requeued = requeue_in_progress(job.pk)
+            logging.info(f"Reclaimed crawl job {job.pk} from {job.worker or 'unknown worker'} ({requeued} URLs requeued)")
+            reclaimed.append(job.pk)
+    if not reset_orphaned_pages:
+        return reclaimed
+
+    # Pages stuck in PROCESSING by crawls that predate jobs, or whose job is gone
+    orphaned = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.PROCESSING).exclude(
+        frontier_entries__job__status=CrawlJob.StatusChoices.RUNNING
+    ).exclude(
+        crawl_jobs__status__in=[CrawlJob.StatusChoices.PENDING, CrawlJob.StatusChoices.RUNNING]
+    )
+    reset = CrawledPage.objects.filter(pk__in=orphaned.values('pk')).update(status=CrawledPage.StatusChoices.PENDING)
+    if reset:
+        logging.info(f"Reset {reset} orphaned PROCESSING pages to PENDING")
+    return reclaimed
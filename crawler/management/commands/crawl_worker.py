@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from crawler.engine import CrawlEngine
+from crawler.jobs import next_job_ids, reclaim_stale_jobs, worker_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued crawl jobs. Start as many workers as needed, on one or more "
+        "machines sharing the database; each job is leased to one worker at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jobs', type=int, default=getattr(settings, 'CRAWLER_WORKER_JOBS', 2),
+            help='Crawl jobs this worker runs at the same time (default: settings.CRAWLER_WORKER_JOBS).',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=getattr(settings, 'CRAWLER_WORKER_POLL_INTERVAL', 2.0),
+            help='Seconds between checks for new jobs (default: settings.CRAWLER_WORKER_POLL_INTERVAL).',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no job is running or waiting, instead of polling forever.',
+        )
+
+    def handle(self, *args, **options):
+        self.shutdown = threading.Event()
+        self.running = {} # job id -> (thread, engine)
+        signal.signal(signal.SIGINT, self._request_shutdown)
+        signal.signal(signal.SIGTERM, self._request_shutdown)
+
+        logging.info(f"Crawl worker {worker_id()} started (up to {options['jobs']} jobs at a time)")
+        # Jobs and pages left behind by workers that died, including a previous run of this one
+        reclaim_stale_jobs(reset_orphaned_pages=True)
+
+        while not self.shutdown.is_set():
+            close_old_connections()
+            self._reap()
+            started = 0
+            free_slots = options['jobs'] - len(self.running)
+            if free_slots > 0:
+                reclaim_stale_jobs(reset_orphaned_pages=False)
+                for job_id in next_job_ids(exclude=list(self.running), limit=free_slots):
+                    self._start(job_id)
+                    started += 1
+            if options['once'] and not started and not self.running:
+                break
+            self.shutdown.wait(options['poll_interval'])
+
+        # Running jobs save their progress and go back to the queue for another worker
+        for _, engine in self.running.values():
+            engine.stop()
+        for thread, _ in self.running.values():
+            thread.join()
+        logging.info(f"Crawl worker {worker_id()} stopped")
+
+    def _start(self, job_id):
+        # The engine claims the job's lease itself; if another worker got there
+        # first it returns straight away and the slot is freed on the next poll.
+        engine = CrawlEngine(job_id)
+        thread = threading.Thread(
+            target=asyncio.run, args=(engine.run(),), name=f'crawl-job-{job_id}', daemon=True
+        )
+        self.running[job_id] = (thread, engine)
+        thread.start()
+
+    def _reap(self):
+        for job_id, (thread, _) in list(self.running.items()):
+            if not thread.is_alive():
+                del self.running[job_id]
+
+    def _request_shutdown(self, signum, frame):
+        if self.shutdown.is_set():
+            raise SystemExit(1) # Second signal: don't wait for the jobs
+        logging.info("Shutting down: stopping running crawl jobs (signal again to exit immediately)")
+        self.shutdown.set()
+        for _, engine in list(self.running.values()):
+            engine.stop()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crawler.batching import prune_bodies
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes stored page HTML that no page points to any more, e.g. after pages were deleted. "
+        "The crawler deletes the bodies it replaces itself; run this to clean up what it left behind before."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_bodies()
+        self.stdout.write(f"Deleted {deleted} unused page bodies.")
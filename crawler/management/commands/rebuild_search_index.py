@@ -0,0 +1,61 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crawler.batching import DB_CHUNK_SIZE
+from crawler.content import markdown_outline
+from crawler.models import CrawledPage
+from crawler.search import index_pages, search_backend, unindex_pages
+from crawler.search_cache import bump_generations
+from crawler.tasks import parse_and_extract
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-indexes the main content of every completed page for search, extracting it "
+        "(and its outline) from the stored HTML for pages crawled before it was stored. "
+        "The crawler keeps the index up to date; run this once for pages crawled before it existed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--domain', help='Only re-index pages of this domain.')
+        parser.add_argument(
+            '--batch-size', type=int, default=DB_CHUNK_SIZE,
+            help=f'Pages indexed per transaction (default: {DB_CHUNK_SIZE}).',
+        )
+
+    def handle(self, *args, **options):
+        if search_backend() is None:
+            self.stderr.write("The database has no full-text index; search uses substring matching instead.")
+            return
+
+        pages = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED, body__isnull=False)
+        if options['domain']:
+            pages = pages.filter(domain=options['domain'])
+        ids = list(pages.order_by('id').values_list('id', flat=True))
+
+        indexed = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            entries, extracted = [], []
+            pages = CrawledPage.objects.filter(pk__in=chunk).only(
+                'id', 'url', 'domain', 'title', 'summary', 'content_markdown', 'content_outline', 'body'
+            )
+            for page in pages:
+                if page.content_markdown is None:
+                    page.content_markdown = parse_and_extract(page.html_content or '', page.url)[3]
+                    page.content_outline = None
+                if page.content_outline is None:
+                    page.content_outline = markdown_outline(page.content_markdown)
+                    extracted.append(page)
+                entries.append((page.pk, page.title, page.summary, page.content_markdown))
+            with transaction.atomic():
+                CrawledPage.objects.bulk_update(extracted, ['content_markdown', 'content_outline'])
+                unindex_pages(chunk) # Pages that lost their content since the chunk was listed stay out
+                index_pages(entries)
+                bump_generations({page.domain for page in pages}) # Cached searches may differ now
+            indexed += len(entries)
+            logging.info(f"Indexed {indexed}/{len(ids)} pages")
+        self.stdout.write(f"Indexed {indexed} pages.")
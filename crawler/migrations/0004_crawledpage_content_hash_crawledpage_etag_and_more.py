@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0003_crawledpage_html_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Content Hash (SHA-256)'),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='etag',
+            field=models.CharField(blank=True, max_length=512, verbose_name='ETag'),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Last-Modified'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0004_crawledpage_content_hash_crawledpage_etag_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20, verbose_name='Job Status')),
+                ('max_pages', models.PositiveIntegerField(blank=True, null=True, verbose_name='Max Pages')),
+                ('max_depth', models.PositiveIntegerField(blank=True, null=True, verbose_name='Max Depth')),
+                ('restrict_to_path', models.BooleanField(default=False, verbose_name='Restrict to Path')),
+                ('base_path', models.CharField(blank=True, max_length=2048, null=True, verbose_name='Base Path')),
+                ('concurrency', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Concurrency')),
+                ('rate_limit', models.FloatField(blank=True, null=True, verbose_name='Rate Limit (requests/sec per host)')),
+                ('refresh', models.BooleanField(default=False, verbose_name='Refresh Only')),
+                ('pages_crawled', models.PositiveIntegerField(default=0, verbose_name='Pages Crawled')),
+                ('pages_unchanged', models.PositiveIntegerField(default=0, verbose_name='Pages Unchanged')),
+                ('worker', models.CharField(blank=True, max_length=255, verbose_name='Worker')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Heartbeat')),
+                ('error_message', models.TextField(blank=True, null=True, verbose_name='Error Message')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('initial_page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crawl_jobs', to='crawler.crawledpage', verbose_name='Initial Page')),
+            ],
+            options={
+                'verbose_name': 'Crawl Job',
+                'verbose_name_plural': 'Crawl Jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FrontierEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0, verbose_name='Depth')),
+                ('priority', models.IntegerField(default=0, verbose_name='Priority')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('in_progress', 'In Progress'), ('done', 'Done')], default='queued', max_length=20, verbose_name='State')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frontier', to='crawler.crawljob', verbose_name='Crawl Job')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frontier_entries', to='crawler.crawledpage', verbose_name='Page')),
+            ],
+            options={
+                'verbose_name': 'Frontier Entry',
+                'verbose_name_plural': 'Frontier Entries',
+                'indexes': [models.Index(fields=['job', 'state'], name='frontier_job_state_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='frontierentry',
+            constraint=models.UniqueConstraint(fields=('job', 'page'), name='unique_frontier_page_per_job'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0005_crawljob_frontierentry_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Lease Expires At'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:37
+
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    """Derives the new counters of existing jobs from their frontier."""
+    CrawlJob = apps.get_model('crawler', 'CrawlJob')
+    FrontierEntry = apps.get_model('crawler', 'FrontierEntry')
+    for job in CrawlJob.objects.all():
+        entries = FrontierEntry.objects.filter(job=job)
+        job.pages_pending = entries.filter(state='queued').count()
+        job.pages_processing = entries.filter(state='in_progress').count()
+        job.pages_crawled = entries.filter(state='done', page__status='completed').count()
+        job.pages_failed = entries.filter(state='done', page__status='failed').count()
+        job.save(update_fields=['pages_pending', 'pages_processing', 'pages_crawled', 'pages_failed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0006_crawljob_lease_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='pages_failed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages Failed'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='pages_pending',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages Pending'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='pages_processing',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages Processing'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+import logging
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Kept in sync with crawler.search
+SEARCH_TABLE = 'crawler_page_fts'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(title, summary, body, tokenize='porter unicode61')"
+                )
+            except OperationalError as e:
+                logging.warning(f"SQLite has no FTS5 ({e}); page search falls back to substring matching")
+                return
+            cursor.execute(
+                f"CREATE TRIGGER {SEARCH_TABLE}_page_deleted AFTER DELETE ON crawler_crawledpage "
+                f"BEGIN DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; END"
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE {SEARCH_TABLE} (page_id bigint PRIMARY KEY REFERENCES crawler_crawledpage (id)"
+                f" ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_page_deleted")
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index over page titles, summaries and text (see crawler.search).
+    Pages crawled before this migration are indexed by `manage.py rebuild_search_index`.
+    """
+
+    dependencies = [
+        ('crawler', '0007_crawljob_pages_failed_crawljob_pages_pending_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
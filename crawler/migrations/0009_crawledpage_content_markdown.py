@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0008_page_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='content_markdown',
+            field=models.TextField(blank=True, null=True, verbose_name='Main Content (Markdown)'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from crawler.storage import pack_html, unpack_html
+
+BATCH_SIZE = 500
+
+
+def move_html_to_body_store(apps, schema_editor):
+    """Compresses each page's HTML into PageBody, one row per distinct HTML."""
+    CrawledPage = apps.get_model('crawler', 'CrawledPage')
+    PageBody = apps.get_model('crawler', 'PageBody')
+    last_id = 0
+    while True:
+        pages = list(
+            CrawledPage.objects.filter(pk__gt=last_id, html_content__isnull=False)
+            .order_by('pk').only('pk', 'html_content')[:BATCH_SIZE]
+        )
+        if not pages:
+            break
+        bodies = {}
+        for page in pages:
+            hash, codec, data, size = pack_html(page.html_content)
+            bodies[hash] = PageBody(hash=hash, codec=codec, data=data, size=size)
+            page.body_id = hash
+        PageBody.objects.bulk_create(bodies.values(), ignore_conflicts=True)
+        CrawledPage.objects.bulk_update(pages, ['body'])
+        last_id = pages[-1].pk
+
+
+def move_html_back(apps, schema_editor):
+    CrawledPage = apps.get_model('crawler', 'CrawledPage')
+    pages = CrawledPage.objects.filter(body__isnull=False).select_related('body')
+    for page in pages.iterator(chunk_size=BATCH_SIZE):
+        page.html_content = unpack_html(page.body.data, page.body.codec)
+        page.save(update_fields=['html_content'])
+
+
+class Migration(migrations.Migration):
+    # Each operation commits on its own: PostgreSQL refuses to drop html_content in the
+    # transaction that just updated every page ("pending trigger events")
+    atomic = False
+
+    dependencies = [
+        ('crawler', '0009_crawledpage_content_markdown'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageBody',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='HTML Hash (SHA-256)')),
+                ('codec', models.CharField(choices=[('zlib', 'zlib'), ('zstd', 'Zstandard')], max_length=8, verbose_name='Compression')),
+                ('data', models.BinaryField(verbose_name='Compressed HTML')),
+                ('size', models.PositiveIntegerField(verbose_name='Uncompressed Size (bytes)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Page Body',
+                'verbose_name_plural': 'Page Bodies',
+            },
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pages', to='crawler.pagebody', verbose_name='Raw HTML Content'),
+        ),
+        migrations.RunPython(move_html_to_body_store, move_html_back, atomic=True),
+        migrations.RemoveField(
+            model_name='crawledpage',
+            name='html_content',
+        ),
+    ]
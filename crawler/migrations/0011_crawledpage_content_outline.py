@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0010_pagebody'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='content_outline',
+            field=models.JSONField(blank=True, null=True, verbose_name='Content Outline'),
+        ),
+    ]
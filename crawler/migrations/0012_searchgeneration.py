@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0011_crawledpage_content_outline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGeneration',
+            fields=[
+                ('domain', models.CharField(blank=True, max_length=255, primary_key=True, serialize=False, verbose_name='Domain')),
+                ('generation', models.PositiveBigIntegerField(default=0, verbose_name='Generation')),
+            ],
+            options={
+                'verbose_name': 'Search Generation',
+                'verbose_name_plural': 'Search Generations',
+            },
+        ),
+    ]
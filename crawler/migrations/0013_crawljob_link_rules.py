@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0012_searchgeneration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='exclude_rules',
+            field=models.TextField(blank=True, default='', verbose_name='Exclude Rules'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='include_rules',
+            field=models.TextField(blank=True, default='', verbose_name='Include Rules'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='links_dropped',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Links Dropped'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0013_crawljob_link_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='sitemap_pages',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages Seeded from Sitemaps'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='sitemap_unchanged',
+            field=models.PositiveIntegerField(default=0, verbose_name='Sitemap Pages Unchanged'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='use_sitemaps',
+            field=models.BooleanField(default=True, verbose_name='Seed from Sitemaps'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0014_crawljob_sitemaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='error_category',
+            field=models.CharField(blank=True, choices=[('timeout', 'Timeout'), ('connection', 'Connection Error'), ('rate_limited', 'Rate Limited (429)'), ('server_error', 'Server Error (5xx)'), ('host_unavailable', 'Host Unavailable'), ('http_error', 'HTTP Error (4xx)'), ('not_html', 'Not HTML'), ('too_large', 'Too Large'), ('robots', 'Disallowed by robots.txt'), ('other', 'Other Error')], db_index=True, max_length=20, verbose_name='Error Category'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='retry_errors',
+            field=models.JSONField(blank=True, default=list, verbose_name='Retry Failed Pages'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from urllib.parse import urlparse
 
+from .storage import pack_html, unpack_html
+
 class CrawledPage(models.Model):
     """
     Represents a single page crawled from a target website.
@@ -12,6 +14,20 @@ class CrawledPage(models.Model):
         COMPLETED = 'completed', _('Completed')
         FAILED = 'failed', _('Failed')
 
+    class ErrorChoices(models.TextChoices):
+        # Transient: retried during the crawl, and worth retrying later
+        TIMEOUT = 'timeout', _('Timeout')
+        CONNECTION = 'connection', _('Connection Error')
+        RATE_LIMITED = 'rate_limited', _('Rate Limited (429)')
+        SERVER_ERROR = 'server_error', _('Server Error (5xx)')
+        HOST_UNAVAILABLE = 'host_unavailable', _('Host Unavailable')
+        # Permanent, as far as a crawl can tell
+        HTTP_ERROR = 'http_error', _('HTTP Error (4xx)')
+        NOT_HTML = 'not_html', _('Not HTML')
+        TOO_LARGE = 'too_large', _('Too Large')
+        ROBOTS = 'robots', _('Disallowed by robots.txt')
+        OTHER = 'other', _('Other Error')
+
     url = models.URLField(
         max_length=2048,
         unique=True,
@@ -49,7 +65,31 @@ class CrawledPage(models.Model):
         verbose_name=_("Last Updated At")
     )
     error_message = models.TextField(blank=True, null=True, verbose_name=_("Error Message"))
-    html_content = models.TextField(blank=True, null=True, verbose_name=_("Raw HTML Content"))
+    # Why the last crawl of a FAILED page failed, so failures can be retried by kind
+    error_category = models.CharField(
+        max_length=20,
+        choices=ErrorChoices.choices,
+        blank=True,
+        db_index=True,
+        verbose_name=_("Error Category")
+    )
+    # Raw HTML, compressed in the body store; read through html_content
+    body = models.ForeignKey(
+        'PageBody',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='pages',
+        verbose_name=_("Raw HTML Content")
+    )
+    # Main content without navigation, scripts or styling, extracted once at crawl time
+    content_markdown = models.TextField(blank=True, null=True, verbose_name=_("Main Content (Markdown)"))
+    # Sections of content_markdown by heading, with their character offsets (see content.markdown_outline)
+    content_outline = models.JSONField(blank=True, null=True, verbose_name=_("Content Outline"))
+    # Validators from the last successful fetch, used for conditional re-crawls
+    etag = models.CharField(max_length=512, blank=True, verbose_name=_("ETag"))
+    last_modified = models.CharField(max_length=64, blank=True, verbose_name=_("Last-Modified"))
+    content_hash = models.CharField(max_length=64, blank=True, verbose_name=_("Content Hash (SHA-256)"))
 
     class Meta:
         verbose_name = _("Crawled Page")
@@ -59,9 +99,172 @@ class CrawledPage(models.Model):
     def __str__(self):
         return self.url
 
+    @property
+    def html_content(self):
+        """The raw HTML, loaded from the body store on first access, or None."""
+        return self.body.html if self.body_id else None
+
     def save(self, *args, **kwargs):
         # Automatically extract domain from URL before saving
         if self.url and not self.domain:
             parsed_uri = urlparse(self.url)
             self.domain = parsed_uri.netloc
         super().save(*args, **kwargs)
+
+
+class PageBody(models.Model):
+    """
+    Raw HTML of crawled pages, compressed and keyed by its SHA-256, so pages
+    with identical HTML share one row and page queries never read it unless
+    the content is asked for.
+    """
+    class CodecChoices(models.TextChoices):
+        ZLIB = 'zlib', _('zlib')
+        ZSTD = 'zstd', _('Zstandard')
+
+    hash = models.CharField(max_length=64, primary_key=True, verbose_name=_("HTML Hash (SHA-256)"))
+    codec = models.CharField(max_length=8, choices=CodecChoices.choices, verbose_name=_("Compression"))
+    data = models.BinaryField(verbose_name=_("Compressed HTML"))
+    size = models.PositiveIntegerField(verbose_name=_("Uncompressed Size (bytes)"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created At"))
+
+    class Meta:
+        verbose_name = _("Page Body")
+        verbose_name_plural = _("Page Bodies")
+
+    def __str__(self):
+        return self.hash
+
+    @classmethod
+    def from_html(cls, html_content):
+        """An unsaved body for `html_content`; compressing is CPU-bound, so call it off the event loop."""
+        hash, codec, data, size = pack_html(html_content)
+        return cls(hash=hash, codec=codec, data=data, size=size)
+
+    @property
+    def html(self):
+        return unpack_html(self.data, self.codec)
+
+
+class CrawlJob(models.Model):
+    """
+    One crawl request: its options, progress and (through FrontierEntry) its
+    persisted frontier, so an interrupted crawl can resume where it stopped.
+    """
+    class StatusChoices(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        COMPLETED = 'completed', _('Completed')
+        FAILED = 'failed', _('Failed')
+
+    initial_page = models.ForeignKey(
+        CrawledPage,
+        on_delete=models.CASCADE,
+        related_name='crawl_jobs',
+        verbose_name=_("Initial Page")
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=StatusChoices.choices,
+        default=StatusChoices.PENDING,
+        db_index=True,
+        verbose_name=_("Job Status")
+    )
+    # Crawl options, as submitted
+    max_pages = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Max Pages"))
+    max_depth = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Max Depth"))
+    restrict_to_path = models.BooleanField(default=False, verbose_name=_("Restrict to Path"))
+    base_path = models.CharField(max_length=2048, blank=True, null=True, verbose_name=_("Base Path"))
+    concurrency = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name=_("Concurrency"))
+    rate_limit = models.FloatField(null=True, blank=True, verbose_name=_("Rate Limit (requests/sec per host)"))
+    refresh = models.BooleanField(default=False, verbose_name=_("Refresh Only"))
+    use_sitemaps = models.BooleanField(default=True, verbose_name=_("Seed from Sitemaps"))
+    # CrawledPage.ErrorChoices values: FAILED pages of the site with these error categories are queued again
+    retry_errors = models.JSONField(default=list, blank=True, verbose_name=_("Retry Failed Pages"))
+    # URL rules, one per line (see crawler.rules.LinkRules)
+    include_rules = models.TextField(blank=True, default='', verbose_name=_("Include Rules"))
+    exclude_rules = models.TextField(blank=True, default='', verbose_name=_("Exclude Rules"))
+    # Progress: how many of the job's pages are in each state, moved along
+    # incrementally in the same transactions that move the pages themselves.
+    # Completed pages are counted in pages_crawled.
+    pages_pending = models.PositiveIntegerField(default=0, verbose_name=_("Pages Pending"))
+    pages_processing = models.PositiveIntegerField(default=0, verbose_name=_("Pages Processing"))
+    pages_crawled = models.PositiveIntegerField(default=0, verbose_name=_("Pages Crawled"))
+    pages_failed = models.PositiveIntegerField(default=0, verbose_name=_("Pages Failed"))
+    pages_unchanged = models.PositiveIntegerField(default=0, verbose_name=_("Pages Unchanged")) # Of pages_crawled
+    # Pages listed in the site's sitemaps that were queued, and that were skipped
+    # because their <lastmod> is no newer than the stored copy
+    sitemap_pages = models.PositiveIntegerField(default=0, verbose_name=_("Pages Seeded from Sitemaps"))
+    sitemap_unchanged = models.PositiveIntegerField(default=0, verbose_name=_("Sitemap Pages Unchanged"))
+    # Drop reason (a built-in check or "exclude: <rule>") -> links dropped for it, counted once per page they appear on
+    links_dropped = models.JSONField(default=dict, blank=True, verbose_name=_("Links Dropped"))
+    # "<host>:<pid>" of the worker holding the job's lease, when it last reported
+    # in, and when its lease runs out (another worker may then take the job over)
+    worker = models.CharField(max_length=255, blank=True, verbose_name=_("Worker"))
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Last Heartbeat"))
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Lease Expires At"))
+    error_message = models.TextField(blank=True, null=True, verbose_name=_("Error Message"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created At"))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Started At"))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Finished At"))
+
+    class Meta:
+        verbose_name = _("Crawl Job")
+        verbose_name_plural = _("Crawl Jobs")
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Crawl #{self.pk} of {self.initial_page.url}"
+
+
+class FrontierEntry(models.Model):
+    """
+    A URL a crawl job has discovered, with the depth it was found at and
+    whether it has been crawled yet.
+    """
+    class StateChoices(models.TextChoices):
+        QUEUED = 'queued', _('Queued')
+        IN_PROGRESS = 'in_progress', _('In Progress')
+        DONE = 'done', _('Done')
+
+    job = models.ForeignKey(CrawlJob, on_delete=models.CASCADE, related_name='frontier', verbose_name=_("Crawl Job"))
+    page = models.ForeignKey(CrawledPage, on_delete=models.CASCADE, related_name='frontier_entries', verbose_name=_("Page"))
+    depth = models.PositiveIntegerField(default=0, verbose_name=_("Depth"))
+    priority = models.IntegerField(default=0, verbose_name=_("Priority")) # Higher is crawled first
+    state = models.CharField(
+        max_length=20,
+        choices=StateChoices.choices,
+        default=StateChoices.QUEUED,
+        verbose_name=_("State")
+    )
+
+    class Meta:
+        verbose_name = _("Frontier Entry")
+        verbose_name_plural = _("Frontier Entries")
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'page'], name='unique_frontier_page_per_job'),
+        ]
+        indexes = [
+            models.Index(fields=['job', 'state'], name='frontier_job_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.page.url} (job #{self.job_id}, depth {self.depth}, {self.state})"
+
+
+class SearchGeneration(models.Model):
+    """
+    A counter per domain, bumped whenever the crawler changes that domain's
+    pages, that tells cached search results apart from current ones (see
+    crawler.search_cache). The row with an empty domain is bumped by every
+    change, for searches across all domains.
+    """
+    domain = models.CharField(max_length=255, primary_key=True, blank=True, verbose_name=_("Domain"))
+    generation = models.PositiveBigIntegerField(default=0, verbose_name=_("Generation"))
+
+    class Meta:
+        verbose_name = _("Search Generation")
+        verbose_name_plural = _("Search Generations")
+
+    def __str__(self):
+        return f"{self.domain or '(all domains)'}: {self.generation}"
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from django.conf import settings
+
+# One pool per web/worker process, shared by every crawl running in it
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    """Pool initializer: spawned workers start from a clean interpreter and need Django set up."""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+        django.setup()
+
+
+def get_parse_pool():
+    """
+    Returns the process-wide parse pool, creating it on first use, or None when
+    settings.CRAWLER_PARSE_WORKERS is 0 (parse in the crawl's thread pool instead).
+    """
+    global _pool
+    workers = getattr(settings, 'CRAWLER_PARSE_WORKERS', 0)
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent runs threads (crawls, the ASGI server) that
+            # may hold locks at fork time
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            logging.info(f"Started HTML parse pool with {workers} worker processes")
+        return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# --- Worker-side entry points (run in the pool processes) ---
+
+def _extract_from_bytes(body, encoding, url, link_filter):
+    from .tasks import extract_page
+    return extract_page(body.decode(encoding, errors='replace'), url, link_filter)
+
+
+def _extract_from_shared_memory(name, size, encoding, url, link_filter):
+    from .tasks import extract_page
+    shared = SharedMemory(name=name)
+    try:
+        # Decode straight out of the shared buffer; the raw bytes are never copied
+        view = shared.buf[:size]
+        try:
+            html_content = str(view, encoding, 'replace')
+        finally:
+            view.release()
+    finally:
+        shared.close()
+    return extract_page(html_content, url, link_filter)
+
+
+async def extract_in_pool(pool, body, encoding, url, link_filter):
+    """
+    Runs tasks.extract_page for a raw (undecoded) page body in the parse pool.
+    `link_filter` (a tasks.LinkFilter) travels as its options, and each worker
+    uses its own, memoized filter for them. Bodies of at least settings.CRAWLER_PARSE_SHM_THRESHOLD bytes are handed
+    over through shared memory instead of being pickled through the pool's pipe.
+    """
+    loop = asyncio.get_running_loop()
+    threshold = getattr(settings, 'CRAWLER_PARSE_SHM_THRESHOLD', 256 * 1024)
+    size = len(body)
+    if size < threshold:
+        return await loop.run_in_executor(
+            pool, _extract_from_bytes, bytes(body), encoding, url, link_filter
+        )
+
+    shared = SharedMemory(create=True, size=size)
+    try:
+        shared.buf[:size] = body
+        return await loop.run_in_executor(
+            pool, _extract_from_shared_memory, shared.name, size, encoding, url, link_filter
+        )
+    finally:
+        shared.close()
+        shared.unlink()
@@ -0,0 +1,536 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from django.conf import settings
+
+from .models import CrawledPage
+from .tasks import HEADERS
+
+# Product token matched against robots.txt User-agent lines
+ROBOTS_USER_AGENT = 'Web2MCPCrawler'
+
+Errors = CrawledPage.ErrorChoices
+# Fetch errors worth retrying within the crawl
+TRANSIENT_ERRORS = frozenset({Errors.TIMEOUT, Errors.CONNECTION, Errors.RATE_LIMITED, Errors.SERVER_ERROR})
+# Fetch errors that mean the host is overloaded: they shrink its concurrency window
+CONGESTION_ERRORS = frozenset({Errors.TIMEOUT, Errors.RATE_LIMITED, Errors.SERVER_ERROR})
+# Fetch errors that count towards opening the host's circuit breaker
+HOST_FAILURES = frozenset({Errors.TIMEOUT, Errors.CONNECTION, Errors.SERVER_ERROR})
+
+# Process-wide robots.txt cache: host -> (RobotsRules, fetched_at)
+_robots_cache = {}
+_robots_lock = threading.Lock()
+
+
+class RobotsRules:
+    """Parsed robots.txt rules for a single host."""
+
+    def __init__(self, parser=None, allow_all=False, disallow_all=False):
+        self.parser = parser
+        self.allow_all = allow_all
+        self.disallow_all = disallow_all
+
+    def can_fetch(self, url):
+        if self.disallow_all:
+            return False
+        if self.allow_all or self.parser is None:
+            return True
+        return self.parser.can_fetch(ROBOTS_USER_AGENT, url)
+
+    @property
+    def sitemaps(self):
+        """Sitemap URLs listed in robots.txt."""
+        if self.parser is None:
+            return []
+        return self.parser.site_maps() or []
+
+    @property
+    def crawl_delay(self):
+        """Crawl-delay (or Request-rate) for our user agent in seconds, or None."""
+        if self.parser is None:
+            return None
+        delay = self.parser.crawl_delay(ROBOTS_USER_AGENT)
+        if delay is not None:
+            return float(delay)
+        request_rate = self.parser.request_rate(ROBOTS_USER_AGENT)
+        if request_rate is not None and request_rate.requests:
+            return request_rate.seconds / request_rate.requests
+        return None
+
+
+def fetch_robots_rules(scheme, host, session=None):
+    """Downloads and parses robots.txt for a host. Never raises."""
+    robots_url = f"{scheme}://{host}/robots.txt"
+    try:
+        response = (session or requests).get(robots_url, headers=HEADERS, timeout=10, allow_redirects=True)
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Could not fetch {robots_url}: {e}. Assuming everything is allowed.")
+        return RobotsRules(allow_all=True)
+
+    # Same conventions as urllib.robotparser: auth errors mean "keep out",
+    # any other 4xx means there are no rules.
+    if response.status_code in (401, 403):
+        return RobotsRules(disallow_all=True)
+    if response.status_code >= 400:
+        return RobotsRules(allow_all=True)
+
+    parser = RobotFileParser(robots_url)
+    parser.parse(response.text.splitlines())
+    return RobotsRules(parser=parser)
+
+
+def get_robots_rules(scheme, host, session=None):
+    """Returns cached robots.txt rules for a host, fetching them at most once per TTL."""
+    ttl = getattr(settings, 'CRAWLER_ROBOTS_CACHE_TTL', 3600)
+    with _robots_lock:
+        cached = _robots_cache.get(host)
+        if cached and time.monotonic() - cached[1] < ttl:
+            return cached[0]
+
+    rules = fetch_robots_rules(scheme, host, session=session)
+    with _robots_lock:
+        _robots_cache[host] = (rules, time.monotonic())
+    return rules
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `burst`.
+    A rate of None (or 0) means unlimited.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def try_acquire(self):
+        """Takes a token if one is available. Returns 0 on success, else seconds until the next token."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def parse_retry_after(value):
+    """A Retry-After header (delay-seconds or an HTTP date) as seconds from now, or None."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt_timezone.utc)
+    return max(0.0, (when - datetime.now(dt_timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter: a random delay of up to base * 2**attempt seconds, at most `cap`."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency window for one host: it grows by one request per
+    window's worth of successes (additive increase) and halves on a sign of
+    overload (multiplicative decrease), staying between 1 and `maximum`.
+    Signals from requests sent before the last decrease are ignored, so a
+    burst of failures in flight together halves it once.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.window = float(maximum)
+        self.decreased_at = float('-inf')
+
+    @property
+    def limit(self):
+        return max(1, int(self.window))
+
+    def on_success(self):
+        self.window = min(self.maximum, self.window + 1 / self.window)
+
+    def on_congestion(self, sent_at):
+        if sent_at >= self.decreased_at:
+            self.window = max(1.0, self.window / 2)
+            self.decreased_at = time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one host. `threshold` failures in a row open it: the
+    host gets no requests for `cooldown` seconds, doubling each time it opens
+    again without a success in between. Then a single probe request goes
+    through (half-open); a success closes the breaker, a failure opens it
+    again. After `max_trips` openings in a row the host is given up on. Only
+    requests sent since it last opened count.
+    """
+
+    def __init__(self, threshold, cooldown, max_trips):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = float('-inf')
+        self.open_until = None # When the open breaker lets a probe through; None while closed
+
+    @property
+    def gave_up(self):
+        return bool(self.max_trips) and self.trips >= self.max_trips
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def blocked_for(self, now):
+        """Seconds until the host may get a request again (0 once closed or half-open)."""
+        return max(0.0, self.open_until - now) if self.open_until is not None else 0.0
+
+    def on_success(self, sent_at):
+        if sent_at >= self.opened_at:
+            self.failures = self.trips = 0
+            self.open_until = None
+
+    def on_failure(self, sent_at):
+        """Counts a failure. Returns True if it opened the breaker."""
+        if sent_at < self.opened_at:
+            return False
+        self.failures += 1
+        if self.open_until is None and self.failures < self.threshold:
+            return False
+        # Enough failures in a row, or the half-open probe failed
+        self.trips += 1
+        self.failures = 0
+        self.opened_at = time.monotonic()
+        self.open_until = self.opened_at + self.cooldown * 2 ** (self.trips - 1)
+        return True
+
+
+class HostScheduler:
+    """
+    Host-aware crawl frontier.
+
+    URLs are queued per host and each host gets its own token bucket. `get()`
+    hands out the next URL from whichever host has a token available, rotating
+    between hosts, so time spent waiting on one slow-rate host goes to the
+    others. robots.txt is loaded once per host in the background before any of
+    that host's URLs are served.
+
+    Each host's queue is a heap ordered by priority (higher first, then
+    first queued), so push, get and reprioritize are O(log n). A
+    reprioritized URL is pushed again and its old heap entry is skipped
+    when it surfaces. URLs pushed with a delay (retries) wait in a separate
+    heap until they are due.
+
+    Per-host rate: the job override if given (0 means unlimited), else the
+    robots.txt Crawl-delay, else settings.CRAWLER_HOST_RATE.
+
+    Per-host health, fed by report(): with a `concurrency`, each host has an
+    AdaptiveLimit on its requests in flight, starting at `concurrency`; a
+    Retry-After on a 429 or 5xx pauses the host; and a CircuitBreaker
+    (settings.CRAWLER_BREAKER_THRESHOLD / _COOLDOWN / _MAX_TRIPS) pauses a
+    host that keeps failing. Once a host's breaker gives up, its URLs are
+    handed out right away and unavailable() says so, for the caller to fail
+    them without a request.
+    """
+
+    def __init__(self, rate=None, burst=None, respect_robots=None, executor=None, session=None, concurrency=None):
+        self.rate = rate
+        self.default_rate = getattr(settings, 'CRAWLER_HOST_RATE', 4.0)
+        self.burst = burst or getattr(settings, 'CRAWLER_HOST_BURST', 2)
+        if respect_robots is None:
+            respect_robots = getattr(settings, 'CRAWLER_RESPECT_ROBOTS', True)
+        self.respect_robots = respect_robots
+        self.executor = executor
+        self.session = session
+        self.concurrency = concurrency
+        self.breaker_threshold = getattr(settings, 'CRAWLER_BREAKER_THRESHOLD', 5)
+        self.breaker_cooldown = getattr(settings, 'CRAWLER_BREAKER_COOLDOWN', 30.0)
+        self.breaker_max_trips = getattr(settings, 'CRAWLER_BREAKER_MAX_TRIPS', 4)
+        self.retry_after_max = getattr(settings, 'CRAWLER_RETRY_AFTER_MAX', 300.0)
+
+        self._queues = OrderedDict() # host -> heap of (-priority, sequence, url, depth)
+        self._queued = {} # url -> (priority, depth) of its live heap entry
+        self._sequence = itertools.count() # Ties go to the URL queued first
+        self._delayed = [] # heap of (due time, sequence, url, depth, priority)
+        self._sent = {} # url -> (host, time sent, priority) for URLs handed out and not done yet
+        self._active = Counter() # host -> URLs handed out and not done yet
+        self._limits = {}
+        self._breakers = {}
+        self._paused = {} # host -> time.monotonic() until which it gets no requests
+        self._buckets = {}
+        self._robots = {}
+        self._robots_loading = set()
+        self._size = 0
+        self._unfinished = 0
+        self._wakeup = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def __len__(self):
+        return self._size
+
+    # --- Frontier API ---
+
+    def push(self, url, depth, priority=0, delay=0):
+        """Queues a URL; with a `delay`, it isn't served for that many seconds."""
+        if delay > 0:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), url, depth, priority))
+        else:
+            self._queue(url, depth, priority)
+        self._size += 1
+        self._unfinished += 1
+        self._finished.clear()
+        self._wakeup.set()
+
+    def priority(self, url):
+        """The priority of a queued URL, or None if it isn't queued."""
+        queued = self._queued.get(url)
+        return queued[0] if queued is not None else None
+
+    def reprioritize(self, url, priority):
+        """Moves a queued URL to `priority`. Returns False if it isn't queued (e.g. it was served already)."""
+        queued = self._queued.get(url)
+        if queued is None:
+            return False
+        if queued[0] != priority:
+            self._queued[url] = (priority, queued[1])
+            heapq.heappush(self._queues[urlparse(url).netloc], (-priority, next(self._sequence), url, queued[1]))
+        return True
+
+    def retry(self, url, depth, delay):
+        """
+        Queues a URL handed out by get() (and not done yet) again at the same
+        priority, due in `delay` seconds. This finishes its current handout:
+        don't call task_done() for it, as a second get() may hand it out again
+        before the caller gets there.
+        """
+        host, _, priority = self._sent.pop(url)
+        self._active[host] -= 1
+        self.push(url, depth, priority, delay)
+        self._unfinished -= 1 # push() counted it again
+
+    def clear(self):
+        """Drops every queued URL, as if each had been served and marked done. Returns how many there were."""
+        dropped = self._size
+        for queue in self._queues.values():
+            queue.clear()
+        self._queued.clear()
+        self._delayed.clear()
+        self._size = 0
+        self._unfinished -= dropped
+        if self._unfinished <= 0:
+            self._finished.set()
+        return dropped
+
+    async def get(self):
+        """Waits until some host is allowed another request and returns its best queued (url, depth)."""
+        while True:
+            now = time.monotonic()
+            wait = self._release_delayed(now)
+            for host in list(self._queues):
+                queue = self._queues[host]
+                if not self._discard_stale(queue):
+                    continue
+                if self.respect_robots and host not in self._robots:
+                    self._load_robots(host, urlparse(queue[0][2]).scheme)
+                    continue
+
+                if self._breaker(host).gave_up:
+                    delay = 0.0 # Handed out to be failed, without a request
+                else:
+                    delay = self._blocked_for(host, now)
+                    if delay is None:
+                        continue # At its concurrency limit: task_done() wakes us up
+                    if delay == 0:
+                        delay = self._bucket(host).try_acquire()
+                if delay == 0:
+                    self._queues.move_to_end(host) # Round-robin between hosts
+                    self._size -= 1
+                    negative_priority, _, url, depth = heapq.heappop(queue)
+                    del self._queued[url]
+                    self._sent[url] = (host, now, -negative_priority)
+                    self._active[host] += 1
+                    return url, depth
+                wait = delay if wait is None else min(wait, delay)
+
+            # Nothing is ready: sleep until the earliest token or until new work arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self, url):
+        """Marks a URL handed out by get() as done, freeing its place in its host's concurrency window."""
+        host = self._sent.pop(url)[0]
+        self._active[host] -= 1
+        self._wakeup.set()
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._finished.set()
+
+    def report(self, url, error=None, retry_after=None):
+        """
+        Records how fetching a URL handed out by get() went: `error` is its
+        CrawledPage.ErrorChoices category, or None for a response worth
+        keeping. Overload errors halve the host's concurrency window and
+        successes widen it again, host failures count towards its circuit
+        breaker, and a 429 or 5xx with a Retry-After (seconds) pauses the
+        host for that long (at most settings.CRAWLER_RETRY_AFTER_MAX).
+        """
+        host, sent_at, _ = self._sent[url]
+        limit = self._limit(host)
+        if limit is not None:
+            if error in CONGESTION_ERRORS:
+                limit.on_congestion(sent_at)
+            elif error is None:
+                limit.on_success()
+
+        breaker = self._breaker(host)
+        if error in HOST_FAILURES:
+            if breaker.on_failure(sent_at):
+                if breaker.gave_up:
+                    logging.warning(f"Giving up on {host} after {breaker.trips} failed recoveries; failing its remaining URLs")
+                else:
+                    logging.warning(f"Circuit breaker for {host} open for {breaker.open_until - time.monotonic():.0f}s")
+        elif error != Errors.RATE_LIMITED:
+            breaker.on_success(sent_at)
+
+        if retry_after and error in (Errors.RATE_LIMITED, Errors.SERVER_ERROR):
+            self.pause(host, min(retry_after, self.retry_after_max))
+
+    def pause(self, host, seconds):
+        """Sends `host` no new requests for `seconds`."""
+        until = time.monotonic() + seconds
+        if until > self._paused.get(host, 0):
+            self._paused[host] = until
+            logging.info(f"Pausing requests to {host} for {seconds:.1f}s")
+
+    def unavailable(self, url):
+        """Whether the circuit breaker of `url`'s host has given up on it."""
+        breaker = self._breakers.get(urlparse(url).netloc)
+        return breaker is not None and breaker.gave_up
+
+    def concurrency_limit(self, host):
+        """The current concurrency window of `host`, or None when unlimited."""
+        limit = self._limit(host)
+        return limit.limit if limit is not None else None
+
+    async def join(self):
+        await self._finished.wait()
+
+    def allowed(self, url):
+        """Whether robots.txt allows fetching `url` (always True when robots are ignored)."""
+        if not self.respect_robots:
+            return True
+        rules = self._robots.get(urlparse(url).netloc)
+        return rules is None or rules.can_fetch(url)
+
+    # --- Internals ---
+
+    def _queue(self, url, depth, priority):
+        self._queued[url] = (priority, depth)
+        heapq.heappush(self._queues.setdefault(urlparse(url).netloc, []), (-priority, next(self._sequence), url, depth))
+
+    def _release_delayed(self, now):
+        """Queues the delayed URLs that are due. Returns seconds until the next one is, or None."""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, url, depth, priority = heapq.heappop(self._delayed)
+            self._queue(url, depth, priority)
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def _blocked_for(self, host, now):
+        """Seconds until `host` may get another request (0 if it may now), or None while its concurrency window is full."""
+        breaker = self._breaker(host)
+        delay = max(self._paused.get(host, 0) - now, breaker.blocked_for(now))
+        if delay > 0:
+            return delay
+        limit = self._limit(host)
+        window = 1 if breaker.is_open else limit.limit if limit is not None else None # Half-open: one probe at a time
+        if window is not None and self._active[host] >= window:
+            return None
+        return 0.0
+
+    def _limit(self, host):
+        if not self.concurrency:
+            return None
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = AdaptiveLimit(self.concurrency)
+        return limit
+
+    def _breaker(self, host):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown, self.breaker_max_trips)
+        return breaker
+
+    def _discard_stale(self, queue):
+        """Pops heap entries superseded by reprioritize(). Returns whether a live entry is left."""
+        while queue:
+            negative_priority, _, url, _ = queue[0]
+            queued = self._queued.get(url)
+            if queued is not None and queued[0] == -negative_priority:
+                return True
+            heapq.heappop(queue)
+        return False
+
+    def _rate_for(self, host):
+        if self.rate is not None:
+            return self.rate
+        rules = self._robots.get(host)
+        crawl_delay = rules.crawl_delay if rules else None
+        if crawl_delay:
+            return 1.0 / crawl_delay
+        return self.default_rate
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate = self._rate_for(host)
+            # A Crawl-delay means one request per interval, so no bursting
+            burst = 1 if self.rate is None and host in self._robots and self._robots[host].crawl_delay else self.burst
+            bucket = self._buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+    def _load_robots(self, host, scheme):
+        if host in self._robots_loading:
+            return
+        self._robots_loading.add(host)
+
+        def on_loaded(future):
+            try:
+                self._robots[host] = future.result()
+            except Exception as e:
+                logging.warning(f"Failed to load robots.txt for {host}: {e}")
+                self._robots[host] = RobotsRules(allow_all=True)
+            crawl_delay = self._robots[host].crawl_delay
+            if crawl_delay:
+                logging.info(f"robots.txt for {host} sets Crawl-delay={crawl_delay}s")
+            self._wakeup.set()
+
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(self.executor, get_robots_rules, scheme, host, self.session).add_done_callback(on_loaded)
@@ -0,0 +1,67 @@
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .rules import compile_rules, matching_rule
+
+# Default weights (see the CRAWLER_PRIORITY_* settings)
+DEFAULT_DEPTH_WEIGHT = 10
+DEFAULT_INLINK_WEIGHT = 5
+DEFAULT_SITEMAP_WEIGHT = 20
+# (rule, points) pairs, rules as in crawler.rules: listing pages that rarely hold reference content
+DEFAULT_PATTERNS = (
+    ('*/tag/*', -30),
+    ('*/tags/*', -30),
+    ('*/category/*', -30),
+    ('*/archive/*', -30),
+    ('*/archives/*', -30),
+    ('re:/page/\\d+/?$', -30),
+    ('re:[?&]page=\\d', -30),
+)
+
+
+class UrlScorer:
+    """
+    Scores URLs for the crawl frontier; higher is crawled first. A URL's
+    score is its path-pattern points (the first matching rule's, matched
+    like crawl URL rules against the path and query string), minus
+    `depth_weight` per link hop from the start page, plus up to
+    `sitemap_weight` for a sitemap <priority> above the default 0.5 (minus
+    for one below). inlink_points() adds `inlink_weight` each time the number
+    of links seen to a queued URL doubles, so the bonus grows with the log of
+    its in-links and re-scoring stays rare.
+    """
+
+    def __init__(self, depth_weight=DEFAULT_DEPTH_WEIGHT, inlink_weight=DEFAULT_INLINK_WEIGHT,
+                 sitemap_weight=DEFAULT_SITEMAP_WEIGHT, patterns=DEFAULT_PATTERNS):
+        self.depth_weight = depth_weight
+        self.inlink_weight = inlink_weight
+        self.sitemap_weight = sitemap_weight
+        self.patterns = tuple(patterns)
+        self._patterns = compile_rules([rule for rule, _ in self.patterns])
+
+    def score(self, url, depth, sitemap_priority=None):
+        """Score of a newly discovered URL (one in-link, or none for the start page and sitemap pages)."""
+        score = -self.depth_weight * depth
+        if sitemap_priority is not None:
+            score += round((sitemap_priority - 0.5) * 2 * self.sitemap_weight)
+        if self._patterns is not None:
+            parts = urlsplit(url)
+            rule = matching_rule(self._patterns, f"{parts.path}?{parts.query}" if parts.query else parts.path)
+            if rule is not None:
+                score += self.patterns[rule][1]
+        return score
+
+    def inlink_points(self, inlinks):
+        """Extra points for a URL seen linked `inlinks` times; changes only when `inlinks` reaches a power of two."""
+        return self.inlink_weight * (inlinks.bit_length() - 1) if inlinks > 0 else 0
+
+
+def get_url_scorer():
+    """A UrlScorer configured from the CRAWLER_PRIORITY_* settings."""
+    return UrlScorer(
+        depth_weight=getattr(settings, 'CRAWLER_PRIORITY_DEPTH_WEIGHT', DEFAULT_DEPTH_WEIGHT),
+        inlink_weight=getattr(settings, 'CRAWLER_PRIORITY_INLINK_WEIGHT', DEFAULT_INLINK_WEIGHT),
+        sitemap_weight=getattr(settings, 'CRAWLER_PRIORITY_SITEMAP_WEIGHT', DEFAULT_SITEMAP_WEIGHT),
+        patterns=getattr(settings, 'CRAWLER_PRIORITY_PATTERNS', DEFAULT_PATTERNS),
+    )
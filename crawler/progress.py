@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import CrawledPage, CrawlJob
+
+# Counter fields a progress event is built from
+JOB_PROGRESS_FIELDS = (
+    'status', 'error_message', 'pages_pending', 'pages_processing', 'pages_crawled', 'pages_failed',
+    'pages_unchanged', 'sitemap_pages', 'sitemap_unchanged', 'links_dropped', 'initial_page__id',
+    'initial_page__status',
+)
+
+
+def job_status(job):
+    """The crawl status payload for a job loaded with JOB_PROGRESS_FIELDS (see crawl_status_api)."""
+    status_counts = {
+        CrawledPage.StatusChoices.PENDING: job.pages_pending,
+        CrawledPage.StatusChoices.PROCESSING: job.pages_processing,
+        CrawledPage.StatusChoices.COMPLETED: job.pages_crawled,
+        CrawledPage.StatusChoices.FAILED: job.pages_failed,
+    }
+    return {
+        'job_id': job.id,
+        'initial_page_id': job.initial_page.id,
+        'initial_page_status': job.initial_page.status,
+        'overall_status': job.status,
+        'total_pages_found': sum(status_counts.values()),
+        'status_breakdown': [
+            {'status': status, 'count': count} for status, count in status_counts.items() if count
+        ], # e.g., [{'status': 'completed', 'count': 5}, ...]
+        'pages_unchanged': job.pages_unchanged,
+        'sitemap_pages': job.sitemap_pages,
+        'sitemap_unchanged': job.sitemap_unchanged, # Listed in a sitemap, not modified since stored: not fetched
+        'links_dropped': job.links_dropped, # Drop reason -> links filtered out for it
+        # The job is processing until a worker finishes it (or gives up on it)
+        'is_processing': job.status in (CrawlJob.StatusChoices.PENDING, CrawlJob.StatusChoices.RUNNING),
+        'error_message': job.error_message if job.status == CrawlJob.StatusChoices.FAILED else None,
+    }
+
+
+def load_job_status(job_id):
+    """job_status() of a job, from a single primary-key lookup. Raises CrawlJob.DoesNotExist."""
+    job = CrawlJob.objects.select_related('initial_page').only(*JOB_PROGRESS_FIELDS).get(pk=job_id)
+    return job_status(job)
+
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# --- Broadcasting ---
+#
+# Crawls run in `crawl_worker` processes, which move the job's counters with
+# every batch of page writes. Rather than each watcher polling the database,
+# the web process reads a watched job once per CRAWLER_PROGRESS_INTERVAL and
+# pushes the changes to all its watchers, however many there are.
+
+class _JobFeed:
+    """Watchers of one job, and the task reading the job's progress for them."""
+
+    def __init__(self):
+        self.watchers = set() # asyncio.Queue per watcher
+        self.task = None
+        self.latest = None # Last event sent, replayed to new watchers
+
+
+class ProgressBroadcaster:
+    """
+    Fans out crawl job progress events to any number of watchers on one event
+    loop. Events are ('progress', status) while the job is queued or running
+    and a final ('done', status) once it has finished, after which the job's
+    watchers are dropped. Status is job_status() plus `queue_depth` and
+    `pages_per_sec` (pages finished per second since the previous event).
+    A ('keepalive', None) is yielded whenever nothing changed for
+    `keepalive` seconds, so idle streams aren't cut by proxies.
+    """
+
+    def __init__(self, interval=None, keepalive=15.0):
+        self.interval = interval if interval is not None else getattr(settings, 'CRAWLER_PROGRESS_INTERVAL', 1.0)
+        self.keepalive = keepalive
+        self._feeds = {} # job id -> _JobFeed
+
+    async def watch(self, job_id):
+        """
+        Yields (event, data) tuples for the job until it finishes. Raises
+        CrawlJob.DoesNotExist if there is no such job.
+        """
+        feed = self._feeds.get(job_id)
+        if feed is None:
+            # Fail fast for unknown jobs instead of starting a feed for them
+            await sync_to_async(load_job_status)(job_id)
+            feed = self._feeds.setdefault(job_id, _JobFeed())
+        # Slow watchers only need the latest state, not every intermediate one
+        queue = asyncio.Queue(maxsize=1)
+        feed.watchers.add(queue)
+        if feed.latest is not None:
+            queue.put_nowait(feed.latest)
+        if feed.task is None:
+            feed.task = asyncio.create_task(self._feed(job_id, feed))
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield 'keepalive', None
+                    continue
+                yield event, data
+                if event == 'done':
+                    return
+        finally:
+            feed.watchers.discard(queue)
+
+    async def _feed(self, job_id, feed):
+        last_done, last_at = None, None
+        try:
+            while feed.watchers:
+                try:
+                    data = await sync_to_async(load_job_status)(job_id)
+                except CrawlJob.DoesNotExist:
+                    data = {'job_id': job_id, 'is_processing': False, 'error_message': 'Crawl job was deleted.'}
+                except Exception as e:
+                    logging.error(f"Error reading progress of crawl job {job_id}: {e}")
+                    await asyncio.sleep(self.interval)
+                    continue
+
+                done = sum(item['count'] for item in data.get('status_breakdown', ()) if item['status'] in (
+                    CrawledPage.StatusChoices.COMPLETED, CrawledPage.StatusChoices.FAILED))
+                now = time.monotonic()
+                data['queue_depth'] = data.get('total_pages_found', 0) - done
+                data['pages_per_sec'] = round((done - last_done) / (now - last_at), 1) if last_at else 0.0
+                last_done, last_at = done, now
+
+                event = ('progress', data) if data['is_processing'] else ('done', data)
+                # Only changes are pushed; pages_per_sec alone changing is no news
+                if feed.latest is None or _without_rate(feed.latest[1]) != _without_rate(data) or event[0] == 'done':
+                    feed.latest = event
+                    for queue in list(feed.watchers):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(event)
+                if event[0] == 'done':
+                    return
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._feeds.get(job_id) is feed:
+                del self._feeds[job_id]
+
+
+def _without_rate(data):
+    return {key: value for key, value in data.items() if key != 'pages_per_sec'}
+
+
+# One broadcaster per event loop: all requests share the server's loop under
+# ASGI, but a sync server runs each async view on a loop of its own.
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = ProgressBroadcaster()
+    return broadcaster
@@ -0,0 +1,52 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Set while serving reads that may come from the read database (see replica_reads)
+_replica_reads = contextvars.ContextVar('crawler_replica_reads', default=False)
+
+
+def read_database():
+    """The alias MCP tool reads go to: settings.CRAWLER_READ_DATABASE if it is configured, else the primary."""
+    alias = getattr(settings, 'CRAWLER_READ_DATABASE', None)
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """
+    Sends the reads made inside the block to the read database. Context-local,
+    so it follows the code into sync_to_async threads and stays out of the
+    crawler, which must read its own writes.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReadReplicaRouter:
+    """
+    Routes reads inside replica_reads() to the read database (a replica, or a
+    second connection to the same database) and every write to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Also for instances loaded from the read database
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # Both aliases hold the same data
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db != DEFAULT_DB_ALIAS and db == read_database():
+            return False # A replica gets its schema from the primary
+        return None
@@ -0,0 +1,114 @@
+import fnmatch
+import re
+
+# Prefix marking a rule as a regular expression rather than a glob
+REGEX_PREFIX = 're:'
+
+
+def parse_rules(text):
+    """The rules in a job's include/exclude text: one per line, blank lines and '#' comments ignored."""
+    if not text:
+        return ()
+    return tuple(line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith('#'))
+
+
+# A regex rule that refers to its own groups by number (\1, (?(1)...)) or declares
+# named ones would misbehave inside the combined regex, where its groups are renumbered
+# and the names must be unique: such rules are matched on their own instead
+SELF_REFERENCE = re.compile(r'\\[1-9]|\(\?\(')
+
+
+def _rule_pattern(rule):
+    # Matched from the start of the target, so glob alternatives fail at once on a mismatch
+    if rule.startswith(REGEX_PREFIX):
+        return f'(?s:.*?)(?:{rule[len(REGEX_PREFIX):]})' # Found anywhere in the target, like re.search
+    return fnmatch.translate(rule) # The whole target
+
+
+def _compile_rule(rule):
+    try:
+        if rule.startswith(REGEX_PREFIX):
+            re.compile(rule[len(REGEX_PREFIX):])
+        return re.compile(_rule_pattern(rule))
+    except re.error as e:
+        raise ValueError(f"Invalid rule {rule!r}: {e}") from None
+
+
+def compile_rules(rules):
+    """
+    The rules compiled for matching_rule (None for no rules): one regex for
+    all of them, with a named group per rule telling which one matched, plus
+    a regex of its own for each rule using backreferences or named groups
+    (which can't share one). Raises ValueError naming the first rule that
+    doesn't compile.
+    """
+    if not rules:
+        return None
+    alternatives = []
+    separate = []
+    for index, rule in enumerate(rules):
+        compiled = _compile_rule(rule)
+        if compiled.groupindex or (compiled.groups and SELF_REFERENCE.search(rule)):
+            separate.append((index, compiled))
+        else:
+            alternatives.append(f'(?P<rule{index}>{_rule_pattern(rule)})')
+    try:
+        combined = re.compile('|'.join(alternatives)) if alternatives else None
+    except re.error as e:
+        raise ValueError(f"Rules can't be combined: {e}") from None
+    return combined, tuple(separate)
+
+
+def validate_rules(text):
+    """The parsed rules of `text`. Raises ValueError naming the first rule that doesn't compile."""
+    rules = parse_rules(text)
+    compile_rules(rules)
+    return rules
+
+
+def matching_rule(compiled, target):
+    """The index of the first rule of `compiled` (from compile_rules) matching `target`, or None."""
+    if compiled is None:
+        return None
+    combined, separate = compiled
+    match = combined.match(target) if combined is not None else None
+    first = int(match.lastgroup[len('rule'):]) if match else None
+    for index, regex in separate:
+        if first is not None and index > first:
+            break
+        if regex.match(target):
+            return index
+    return first
+
+
+class LinkRules:
+    """
+    A crawl's include and exclude rules, each list compiled into a single
+    regex, so checking a link costs one match per list however many rules
+    there are (plus one per rule using backreferences or named groups). Rules apply to a URL's path plus its query string (e.g.
+    '/docs/changelog/2019.html' or '/search?q=x'): globs ('/docs/*/changelog/*';
+    '*' also matches '/') must match all of it, and 're:' regexes
+    ('re:^/(de|fr|ja)/') are searched for anywhere in it. As the rules share
+    one regex, flags must be scoped: 're:(?i:\\.bak)$', not 're:(?i)\\.bak$'.
+
+    A link is kept if it matches an include rule (or there are none) and no
+    exclude rule.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._include = compile_rules(self.include)
+        self._exclude = compile_rules(self.exclude)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def drop_reason(self, target):
+        """None if `target` (a path and query) is kept, else why not: 'exclude: <rule>' or 'not included'."""
+        excluded = matching_rule(self._exclude, target)
+        if excluded is not None:
+            return f"exclude: {self.exclude[excluded]}"
+        if self._include is not None and matching_rule(self._include, target) is None:
+            return 'not included'
+        return None
@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+import logging
+import re
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import CrawledPage
+
+# Full-text index over crawled pages, outside the ORM: an FTS5 virtual table
+# on SQLite (rowid = page id), a table of weighted tsvectors on PostgreSQL.
+# Created by migration 0008, written by the crawler as it saves pages, and
+# emptied of deleted pages by the database itself (trigger / cascade).
+SEARCH_TABLE = 'crawler_page_fts'
+
+# Relative weight of a match in the title, the summary and the page text
+SQLITE_BM25 = f"bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0)"
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B')"
+    " || setweight(to_tsvector('english', %s), 'C')"
+)
+
+# Results per page when the caller doesn't say, and the most a caller can ask for
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Backends with a full-text index; anything else falls back to substring matching
+SEARCH_BACKENDS = ('sqlite', 'postgresql')
+
+_index_available = {} # DB alias -> bool
+
+
+def search_backend(using='default'):
+    """The vendor of the full-text index on `using`, or None if it has none."""
+    connection = connections[using]
+    if connection.vendor not in SEARCH_BACKENDS:
+        return None
+    if using not in _index_available:
+        # Missing e.g. on an SQLite build without FTS5, where migration 0008 skips it
+        with connection.cursor() as cursor:
+            _index_available[using] = SEARCH_TABLE in connection.introspection.table_names(cursor)
+    return connection.vendor if _index_available[using] else None
+
+
+# --- Writing ---
+
+def index_pages(entries, using='default'):
+    """
+    Adds or replaces the index entries for pages, given as (page id, title,
+    summary, text) tuples. Called from the crawl's write transaction, so the
+    index changes together with the pages.
+    """
+    entries = list(entries)
+    vendor = search_backend(using)
+    if not entries or vendor is None:
+        return
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            # FTS5 has no upsert; a delete and insert is how it replaces a row
+            unindex_pages([entry[0] for entry in entries], using)
+            cursor.executemany(f"INSERT INTO {SEARCH_TABLE} (rowid, title, summary, body) VALUES (%s, %s, %s, %s)", entries)
+        else:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (page_id, document) VALUES (%s, {POSTGRES_DOCUMENT})"
+                f" ON CONFLICT (page_id) DO UPDATE SET document = EXCLUDED.document",
+                entries,
+            )
+
+
+def unindex_pages(page_ids, using='default'):
+    """Removes pages from the index (e.g. pages that failed or were deleted)."""
+    page_ids = list(page_ids)
+    vendor = search_backend(using)
+    if not page_ids or vendor is None:
+        return
+    key = 'rowid' if vendor == 'sqlite' else 'page_id'
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(page_ids), 500):
+            chunk = page_ids[start:start + 500]
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+# --- Querying ---
+
+def fts5_query(keyword):
+    """
+    Turns free text into an FTS5 query matching pages that contain every
+    word, so FTS5 query syntax (quotes, operators, columns) in user input is
+    treated as plain words. Returns '' if there are no words.
+    """
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', keyword))
+
+
+def full_text_search(queryset, keyword, after=None):
+    """
+    Narrows a CrawledPage queryset to pages matching `keyword` in their title,
+    summary or text, best matches first, annotated with `rank` (lower is
+    better: SQLite's BM25 score, or PostgreSQL's negated ts_rank_cd). Ties
+    are ordered by id, so (rank, id) orders results completely.
+
+    Without a full-text index on the queryset's database, falls back to a
+    case-insensitive substring match on title and summary, newest first
+    (`rank` is then 0, and results are ordered by (updated_at, id) instead).
+
+    `after` is a decoded cursor (see decode_cursor): only results ordered
+    after it are returned, which pages through results with an index seek
+    instead of an OFFSET.
+    """
+    page_id = f"{CrawledPage._meta.db_table}.id"
+    vendor = search_backend(queryset.db)
+    if vendor == 'sqlite':
+        query = fts5_query(keyword)
+        if not query:
+            return queryset.none()
+        where = [f"{SEARCH_TABLE}.rowid = {page_id}", f"{SEARCH_TABLE} MATCH %s"]
+        params = [query]
+        if after is not None:
+            rank, _, last_id = after
+            where.append(f"({SQLITE_BM25} > %s OR ({SQLITE_BM25} = %s AND {page_id} > %s))")
+            params += [rank, rank, last_id]
+        return queryset.extra(
+            select={'rank': SQLITE_BM25}, tables=[SEARCH_TABLE], where=where, params=params,
+        ).order_by('rank', 'id')
+    if vendor == 'postgresql':
+        # ts_rank_cd() is a float4; as a float8 it compares equal to the rank a cursor carries back
+        rank_sql = f"(-ts_rank_cd({SEARCH_TABLE}.document, websearch_to_tsquery('english', %s)))::double precision"
+        where = [f"{SEARCH_TABLE}.page_id = {page_id}", f"{SEARCH_TABLE}.document @@ websearch_to_tsquery('english', %s)"]
+        params = [keyword]
+        if after is not None:
+            rank, _, last_id = after
+            where.append(f"({rank_sql} > %s OR ({rank_sql} = %s AND {page_id} > %s))")
+            params += [keyword, rank, keyword, rank, last_id]
+        return queryset.extra(
+            select={'rank': rank_sql}, select_params=[keyword], tables=[SEARCH_TABLE], where=where, params=params,
+        ).order_by('rank', 'id')
+
+    logging.debug(f"No full-text index on database '{queryset.db}'; searching titles and summaries with LIKE")
+    queryset = queryset.filter(Q(title__icontains=keyword) | Q(summary__icontains=keyword))
+    if after is not None:
+        _, updated_at, last_id = after
+        queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=last_id))
+    return queryset.extra(select={'rank': '0'}).order_by('-updated_at', '-id')
+
+
+# --- Pagination ---
+
+def encode_cursor(rank, updated_at, page_id):
+    """An opaque cursor for the position just after a search result."""
+    raw = json.dumps([rank, updated_at.isoformat(), page_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (rank, updated_at, page id) from encode_cursor. Raises ValueError if the cursor is malformed."""
+    try:
+        rank, updated_at, page_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(rank), datetime.fromisoformat(updated_at), int(page_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def search_results(queryset, keyword, fields, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    One page of full_text_search results: returns (results, next cursor).
+    Each result is a dict of `fields` plus the 'cursor' to resume after it;
+    the next cursor is None on the last page. Raises ValueError for a
+    malformed cursor.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    rows = list(full_text_search(queryset, keyword, after).values(*fields, 'id', 'updated_at', 'rank')[:limit + 1])
+    results = []
+    for row in rows[:limit]:
+        result = {field: row[field] for field in fields}
+        result['cursor'] = encode_cursor(row['rank'], row['updated_at'], row['id'])
+        results.append(result)
+    # The one extra row only tells whether there is another page
+    return results, results[-1]['cursor'] if len(rows) > limit else None
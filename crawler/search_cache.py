@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+
+from .models import SearchGeneration
+
+# Generation row bumped by every change, for searches that aren't limited to a domain
+ALL_DOMAINS = ''
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300.0
+
+
+def normalize_query(keyword):
+    """Query text as cached: words are matched case-insensitively, whatever the spacing."""
+    return ' '.join(keyword.lower().split())
+
+
+def _generation_key(domain):
+    return domain.lower() if domain else ALL_DOMAINS
+
+
+def current_generation(domain=None):
+    """The search generation of `domain`, or of all domains."""
+    generation = SearchGeneration.objects.filter(domain=_generation_key(domain)).values_list(
+        'generation', flat=True
+    ).first()
+    return generation or 0
+
+
+def bump_generations(domains):
+    """
+    Invalidates cached searches over `domains` (and over all domains) in
+    every process. Call it in the transaction that changes the pages, so a
+    search never caches the new pages under the old generation.
+    """
+    keys = {_generation_key(domain) for domain in domains if domain} | {ALL_DOMAINS}
+    SearchGeneration.objects.bulk_create([SearchGeneration(domain=key) for key in keys], ignore_conflicts=True)
+    SearchGeneration.objects.filter(domain__in=keys).update(generation=F('generation') + 1)
+
+
+class SearchCache:
+    """
+    In-process LRU cache of search results with a TTL. Each entry remembers
+    the search generation of its domain (see SearchGeneration) when it was
+    computed, and is only served while that generation is current, so results
+    never outlive a crawl that changed the domain's pages; the TTL bounds how
+    long other changes (e.g. pages edited in the admin) can go unnoticed.
+    Checking the generation is a primary-key lookup, far cheaper than the
+    search itself.
+
+    Thread-safe. Cached values are shared between callers: don't modify them.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries if max_entries is not None else getattr(
+            settings, 'CRAWLER_SEARCH_CACHE_SIZE', DEFAULT_CACHE_SIZE
+        )
+        self.ttl = ttl if ttl is not None else getattr(settings, 'CRAWLER_SEARCH_CACHE_TTL', DEFAULT_CACHE_TTL)
+        self._entries = OrderedDict() # key -> (generation, expires at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0 # Misses on an entry whose domain changed since it was cached
+        self.expirations = 0 # Misses on an entry older than the TTL
+        self.evictions = 0 # Entries dropped to stay within max_entries
+
+    def get_or_compute(self, key, domain, compute):
+        """
+        Returns the cached value for `key` if it is fresh, else compute()'s,
+        which is cached. `domain` is the domain the search is limited to, if
+        any. Runs queries: call it from sync code.
+        """
+        if self.max_entries <= 0:
+            return compute()
+        # Read before computing: a change committed meanwhile leaves the entry already outdated
+        generation = current_generation(domain)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_generation, expires_at, value = entry
+                if cached_generation == generation and expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if cached_generation != generation:
+                    self.invalidations += 1
+                else:
+                    self.expirations += 1
+                del self._entries[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = (generation, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """The process-wide SearchCache."""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                _search_cache = SearchCache()
+                logging.info(f"Search cache: up to {_search_cache.max_entries} results for {_search_cache.ttl}s")
+    return _search_cache
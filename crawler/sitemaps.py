@@ -0,0 +1,140 @@
+import gzip
+import io
+import logging
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta, time as dt_time, timezone as dt_timezone
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .politeness import get_robots_rules
+from .tasks import HEADERS
+
+# Caps on what one crawl reads from a site's sitemaps (see settings.CRAWLER_SITEMAP_MAX_URLS / _MAX_FILES)
+DEFAULT_MAX_URLS = 100000
+DEFAULT_MAX_FILES = 100
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def parse_lastmod(value):
+    """
+    A sitemap <lastmod> (a W3C datetime such as '2024-05-01' or
+    '2024-05-01T12:00:00+02:00') as an aware datetime, or None. A bare date
+    means the end of that day, so a page changed later that day is never
+    taken as older than a copy fetched earlier the same day.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        if 'T' in value:
+            parsed = parse_datetime(value)
+        else:
+            date = parse_date(value)
+            parsed = datetime.combine(date + timedelta(days=1), dt_time.min) if date else None
+    except ValueError:
+        return None
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def parse_priority(value):
+    """A sitemap <priority> (0.0 to 1.0) as a float clamped to that range, or None."""
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_sitemap(stream):
+    """
+    Reads a sitemap or sitemap index from a binary file object incrementally,
+    yielding ('url', loc, lastmod, priority) for each page and ('sitemap',
+    loc, lastmod, None) for each nested sitemap. Parsed elements are discarded as it goes, so
+    memory stays flat however long the file is. Raises ET.ParseError on
+    malformed XML (after yielding the entries before the error).
+    """
+    root = None
+    loc = lastmod = priority = None
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'start':
+            continue
+        tag = element.tag.rpartition('}')[2] # Drop the namespace
+        # The entry's own <loc>, <lastmod> and <priority> come first; extensions (e.g. <image:loc>) follow
+        if tag == 'loc' and loc is None:
+            loc = (element.text or '').strip()
+        elif tag == 'lastmod' and lastmod is None:
+            lastmod = element.text
+        elif tag == 'priority' and priority is None:
+            priority = element.text
+        elif tag in ('url', 'sitemap'):
+            if loc:
+                yield tag, loc, parse_lastmod(lastmod), parse_priority(priority) if tag == 'url' else None
+            loc = lastmod = priority = None
+            root.clear()
+
+
+def _body_stream(response):
+    """The response body as a file object, decompressed whether it is gzip-encoded in transit or a .xml.gz file."""
+    response.raw.decode_content = True # Undo Content-Encoding
+    response.raw.auto_close = False # Reads past the end must return b'', not fail on a closed file
+    stream = io.BufferedReader(response.raw)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def sitemap_entries(start_url, session=None, max_urls=None, max_files=None):
+    """
+    Yields (loc, lastmod, priority) for the pages listed in the sitemaps of
+    `start_url`'s site: those named by robots.txt `Sitemap:` lines, else
+    /sitemap.xml. Sitemap indexes are followed, gzipped sitemaps decompressed,
+    and every file is parsed as it downloads. Stops after `max_urls` pages or
+    `max_files` sitemap files. Never raises; unreadable sitemaps are logged
+    and skipped.
+    """
+    if max_urls is None:
+        max_urls = getattr(settings, 'CRAWLER_SITEMAP_MAX_URLS', DEFAULT_MAX_URLS)
+    if max_files is None:
+        max_files = getattr(settings, 'CRAWLER_SITEMAP_MAX_FILES', DEFAULT_MAX_FILES)
+    client = session or requests
+    parts = urlsplit(start_url)
+
+    queue = deque(get_robots_rules(parts.scheme, parts.netloc, session).sitemaps)
+    if not queue:
+        queue.append(f"{parts.scheme}://{parts.netloc}/sitemap.xml")
+    seen = set()
+    urls = 0
+    while queue and len(seen) < max_files:
+        sitemap_url = queue.popleft()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        try:
+            with client.get(sitemap_url, headers=HEADERS, timeout=10, allow_redirects=True, stream=True) as response:
+                if response.status_code != 200:
+                    logging.info(f"No sitemap at {sitemap_url} (HTTP {response.status_code})")
+                    continue
+                listed = 0
+                for kind, loc, lastmod, priority in parse_sitemap(_body_stream(response)):
+                    if kind == 'sitemap':
+                        queue.append(loc)
+                        continue
+                    yield loc, lastmod, priority
+                    listed += 1
+                    urls += 1
+                    if urls >= max_urls:
+                        logging.info(f"Read {max_urls} URLs from sitemaps of {parts.netloc}; ignoring the rest")
+                        return
+                logging.info(f"Read {listed} URLs from sitemap {sitemap_url}")
+        except (requests.exceptions.RequestException, ET.ParseError, OSError, EOFError) as e:
+            logging.warning(f"Could not read sitemap {sitemap_url}: {e}")
@@ -0,0 +1,55 @@
+import hashlib
+import logging
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError: # Optional: only needed for CRAWLER_BODY_COMPRESSION = 'zstd'
+    zstandard = None
+
+# Codecs of stored page bodies (PageBody.codec)
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def body_codec():
+    """The codec new bodies are compressed with (settings.CRAWLER_BODY_COMPRESSION)."""
+    codec = getattr(settings, 'CRAWLER_BODY_COMPRESSION', ZLIB)
+    if codec == ZSTD and zstandard is None:
+        logging.warning("CRAWLER_BODY_COMPRESSION is 'zstd' but the zstandard package is not installed; using zlib")
+        return ZLIB
+    return codec
+
+
+def compress(data, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This page body is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def pack_html(html_content, codec=None):
+    """
+    Prepares HTML for the body store. Returns (hash, codec, compressed data,
+    size): the SHA-256 of the UTF-8 encoded HTML, which is the body's key, so
+    identical pages share one stored body. CPU-bound; call it off the event loop.
+    """
+    data = html_content.encode('utf-8')
+    codec = codec or body_codec()
+    return hashlib.sha256(data).hexdigest(), codec, compress(data, codec), len(data)
+
+
+def unpack_html(data, codec):
+    return decompress(bytes(data), codec).decode('utf-8')
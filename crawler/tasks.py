@@ -1,10 +1,15 @@
+import functools
+import posixpath
 import requests
 import logging
-import time
-from collections import deque
-from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
+from collections import Counter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib.parse import urlparse, urljoin, urlsplit
+from .canonical import get_canonicalizer
+from .encoding import resolve_encoding
+from .extractors import SoupExtractor, get_extractor
 from .models import CrawledPage
+from .rules import LinkRules
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,290 +28,310 @@ IGNORED_EXTENSIONS = {
     '.css', '.js',
 }
 
-def fetch_html(url):
-    """Fetches HTML content for a given URL."""
+# Body size cap used when a caller doesn't pass one (see settings.CRAWLER_MAX_PAGE_BYTES)
+DEFAULT_MAX_PAGE_BYTES = 5 * 1024 * 1024
+
+# Bytes read from the socket at a time while streaming a page body
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def build_session(pool_size=10):
+    """
+    Creates a pooled keep-alive session for one crawl.
+    Connections are reused across pages and the pool is sized to the crawl's
+    concurrency. Compressed transfer (gzip/deflate, plus brotli when the
+    `brotli` package is installed) is advertised and decoded transparently.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return session
+
+def http_error_category(status_code):
+    """The CrawledPage.ErrorChoices category of an HTTP error status."""
+    if status_code == 429:
+        return CrawledPage.ErrorChoices.RATE_LIMITED
+    if status_code >= 500:
+        return CrawledPage.ErrorChoices.SERVER_ERROR
+    return CrawledPage.ErrorChoices.HTTP_ERROR
+
+def fetch_page(url, session=None, max_bytes=None, etag=None, last_modified=None):
+    """
+    Fetches a page and returns (body, encoding, response, error) without decoding it.
+    The body is streamed: non-HTML responses are abandoned after the headers,
+    and bodies larger than `max_bytes` are cut off without being buffered.
+    Passing a stored `etag` / `last_modified` makes the request conditional; a
+    304 Not Modified comes back with body None and status_code 304.
+    `body` is a bytearray, or None whenever there is no usable HTML; `error`
+    is then the CrawledPage.ErrorChoices category of the failure (None for a
+    304). `response` is None if no response arrived (timeouts, network errors).
+    """
+    if max_bytes is None:
+        max_bytes = DEFAULT_MAX_PAGE_BYTES
+    client = session or requests
+    headers = dict(HEADERS)
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10, allow_redirects=True)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-
-        # Check content type to ensure it's likely HTML
-        content_type = response.headers.get('content-type', '').lower()
-        if 'text/html' not in content_type:
-            logging.warning(f"Skipping non-HTML content at {url} (Content-Type: {content_type})")
-            # Return None for content, and the response object for potential inspection
-            return None, response
-
-        # Decode content carefully
-        response.encoding = response.apparent_encoding # Guess encoding
-        # Return both text content and the original response object
-        return response.text, response
+        with client.get(url, headers=headers, timeout=10, allow_redirects=True, stream=True) as response:
+            if response.status_code >= 400:
+                logging.error(f"Error fetching {url}: HTTP {response.status_code}")
+                return None, None, response, http_error_category(response.status_code)
+
+            if response.status_code == 304:
+                return None, None, response, None # Unchanged since the validators were issued
+
+            # Check content type to ensure it's likely HTML
+            content_type = response.headers.get('content-type', '').lower()
+            if 'text/html' not in content_type:
+                logging.warning(f"Skipping non-HTML content at {url} (Content-Type: {content_type})")
+                # Return None for content, and the response object for potential inspection
+                return None, None, response, CrawledPage.ErrorChoices.NOT_HTML
+
+            # Reject oversized bodies up front when the server declares the length
+            declared_length = response.headers.get('content-length')
+            if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+                logging.warning(f"Skipping {url}: Content-Length {declared_length} exceeds limit of {max_bytes} bytes")
+                return None, None, response, CrawledPage.ErrorChoices.TOO_LARGE
+
+            # Stream the (decompressed) body, stopping as soon as it exceeds the cap
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                body.extend(chunk)
+                if len(body) > max_bytes:
+                    logging.warning(f"Skipping {url}: body exceeds limit of {max_bytes} bytes")
+                    return None, None, response, CrawledPage.ErrorChoices.TOO_LARGE
+
+            # Decode content carefully: header charset, BOM, <meta>, then detection on a prefix
+            encoding = resolve_encoding(body, content_type)
+            return body, encoding, response, None
     except requests.exceptions.Timeout:
         logging.error(f"Timeout fetching {url}")
-        return None, None # Return None for both on timeout
+        return None, None, None, CrawledPage.ErrorChoices.TIMEOUT
+    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+        logging.error(f"Connection error fetching {url}: {e}")
+        return None, None, None, CrawledPage.ErrorChoices.CONNECTION
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching {url}: {e}")
-        return None, None # Return None for both on request error
+        return None, None, None, CrawledPage.ErrorChoices.OTHER
     except Exception as e:
         logging.error(f"Unexpected error fetching {url}: {e}")
-        return None, None # Return None for both on other errors
+        return None, None, None, CrawledPage.ErrorChoices.OTHER
+
+def fetch_html(url, session=None, max_bytes=None, etag=None, last_modified=None):
+    """
+    Fetches HTML content for a given URL. Returns (text, response); see
+    fetch_page for the streaming, size-cap and conditional-request behaviour.
+    """
+    body, encoding, response, _ = fetch_page(url, session, max_bytes, etag, last_modified)
+    if body is None:
+        return None, response
+    return body.decode(encoding, errors='replace'), response
 
 def parse_and_extract(html_content, url):
-    """Parses HTML and extracts title, description, and links."""
+    """
+    Parses HTML and extracts title, description, links and the main content as Markdown.
+    Uses the configured extractor backend (settings.CRAWLER_EXTRACTOR) and
+    falls back to BeautifulSoup if that backend fails on the document.
+    """
+    extractor = get_extractor()
     try:
-        soup = BeautifulSoup(html_content, 'lxml') # Use lxml for speed if available
-
-        # Extract Title
-        title_tag = soup.find('title')
-        title = title_tag.string.strip() if title_tag else ''
-
-        # Extract Meta Description
-        description_tag = soup.find('meta', attrs={'name': 'description'})
-        description = description_tag['content'].strip() if description_tag and 'content' in description_tag.attrs else ''
-
-        # Extract Links
-        links = set()
-        for a_tag in soup.find_all('a', href=True):
-            link = a_tag['href'].strip()
-            if link:
-                links.add(link)
+        return extractor.extract(html_content, url)
+    except Exception as e:
+        if extractor.name == SoupExtractor.name:
+            logging.error(f"Error parsing {url}: {e}")
+            return '', '', set(), ''
+        logging.warning(f"{extractor.name} extractor failed on {url} ({e}); falling back to BeautifulSoup")
 
-        return title, description, links
+    try:
+        return get_extractor(SoupExtractor.name).extract(html_content, url)
     except Exception as e:
         logging.error(f"Error parsing {url}: {e}")
-        return '', '', set()
+        return '', '', set(), ''
+
+# Outcomes LinkFilter remembers per crawl; the memo starts over when it outgrows this
+LINK_MEMO_SIZE = 50000
 
-# Corrected function signature and logic
-def filter_and_normalize_links(links, base_domain, current_url, restrict_to_path=False, base_path=None):
+class LinkFilter:
     """
-    Filters and normalizes extracted links.
+    Filters and normalizes the links found on a crawl's pages.
     - Resolves relative URLs.
     - Ensures links are HTTP/HTTPS.
+    - Canonicalizes them (see crawler.canonical; fragments and tracking parameters go).
     - Ensures links are within the base_domain.
-    - Removes fragments (#).
     - Ignores links pointing to files with specific extensions.
+    - Applies the path restriction and the job's include/exclude rules (see crawler.rules).
+
+    The outcome for each link is memoized, keyed by what it depends on, so
+    root-relative and absolute links (navigation, mostly, repeated on every
+    page) are resolved and checked once per crawl. Pickles as its options: in
+    a parse pool worker it becomes that process's filter for the same options,
+    memo included.
     """
-    valid_links = set()
-    current_parsed = urlparse(current_url)
 
-    for link in links:
+    def __init__(self, base_domain, restrict_to_path=False, base_path=None, include=(), exclude=()):
+        self.options = (base_domain, restrict_to_path, base_path, tuple(include), tuple(exclude))
+        self.base_domain = base_domain
+        self.base_path = base_path if restrict_to_path else None
+        self.rules = LinkRules(include, exclude) # Raises ValueError for an invalid rule
+        self.canonicalizer = get_canonicalizer()
+        self._base_netlocs = {} # Scheme -> canonical base domain
+        self._memo = {} # Link key -> (canonical URL, None) or (None, drop reason)
+
+    def __reduce__(self):
+        return get_link_filter, self.options
+
+    def filter(self, links, current_url):
+        """Returns the set of links to crawl and a Counter of the dropped ones by reason."""
+        valid_links = set()
+        dropped = Counter()
+        page = urlsplit(current_url)
+        origin = f"{page.scheme}://{page.netloc}"
+        directory = origin + page.path[:page.path.rfind('/') + 1]
+
+        for link in links:
+            # What urljoin(current_url, link) depends on
+            if link.startswith(('http://', 'https://')):
+                key = link
+            elif link.startswith('//'):
+                key = (page.scheme, link)
+            elif link.startswith('/'):
+                key = (origin, link)
+            elif not link or link[0] in '?#':
+                key = (current_url, link)
+            else:
+                key = (directory, link)
+
+            url, reason = self._memoized(key, link, current_url)
+            if reason is None:
+                valid_links.add(url)
+            else:
+                dropped[reason] += 1
+
+        return valid_links, dropped
+
+    def check(self, url):
+        """
+        (canonical URL, None) if the absolute `url` is to be crawled, else
+        (None, drop reason). Not memoized: for URLs seen once, such as a sitemap's.
+        """
+        return self._check(url, url)
+
+    def _memoized(self, key, link, current_url):
+        outcome = self._memo.get(key)
+        if outcome is None:
+            outcome = self._check(link, current_url)
+            if len(self._memo) >= LINK_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = outcome
+        return outcome
+
+    def _check(self, link, current_url):
         try:
-            # Remove fragments
-            link = link.split('#')[0]
-
             # Join relative URLs
             full_url = urljoin(current_url, link)
-            parsed_url = urlparse(full_url)
 
             # 1. Check scheme
-            if parsed_url.scheme not in ['http', 'https']:
-                continue
+            scheme = urlparse(full_url).scheme
+            if scheme not in ['http', 'https']:
+                return None, 'not http(s)'
+
+            full_url = self.canonicalizer.canonicalize(full_url)
+            parsed_url = urlparse(full_url)
 
             # 2. Check domain
-            if parsed_url.netloc != base_domain:
-                continue
+            if scheme not in self._base_netlocs:
+                self._base_netlocs[scheme] = self.canonicalizer.netloc(scheme, self.base_domain)
+            if parsed_url.netloc != self._base_netlocs[scheme]:
+                return None, 'other domain'
 
             # 3. Check file extension
             path = parsed_url.path
-            if any(path.lower().endswith(ext) for ext in IGNORED_EXTENSIONS):
-                continue
+            if posixpath.splitext(path)[1].lower() in IGNORED_EXTENSIONS:
+                return None, 'file extension'
 
-            # 4. Check path restriction (NEW) - Moved inside try block
-            if restrict_to_path and base_path is not None:
-                # Ensure the link's path starts with the required base path
-                if not parsed_url.path.startswith(base_path):
-                    continue # Skip this link if path doesn't match
+            # 4. Check path restriction
+            if self.base_path is not None and not path.startswith(self.base_path):
+                return None, 'outside base path'
 
-            # If all checks pass, add to valid links - Moved inside try block
-            valid_links.add(full_url)
+            # 5. Check the job's include / exclude rules
+            if self.rules:
+                reason = self.rules.drop_reason(f"{path}?{parsed_url.query}" if parsed_url.query else path)
+                if reason is not None:
+                    return None, reason
+
+            return full_url, None
 
         except Exception as e:
             logging.warning(f"Could not process link '{link}' from {current_url}: {e}")
-            continue # Skip this link if any processing error occurs
+            return None, 'invalid'
+
+@functools.lru_cache(maxsize=16)
+def get_link_filter(*options):
+    """The process's LinkFilter for these options, so its memo outlives one page."""
+    return LinkFilter(*options)
 
+def filter_and_normalize_links(links, base_domain, current_url, restrict_to_path=False, base_path=None, include=(), exclude=()):
+    """
+    Filters and normalizes extracted links (see LinkFilter) and returns the set
+    of links to crawl.
+    """
+    valid_links, _ = LinkFilter(base_domain, restrict_to_path, base_path, include, exclude).filter(links, current_url)
     return valid_links
 
-def crawl_site(initial_page_id, max_pages=None, max_depth=None, restrict_to_path=False, base_path=None):
+def extract_page(html_content, url, link_filter):
+    """
+    The CPU-bound part of processing a page: parses it and returns
+    (title, description, links, content, dropped) with links already filtered
+    and normalized by `link_filter` (a LinkFilter), and dropped counting the
+    links it filtered out by reason.
+    """
+    title, description, links, content = parse_and_extract(html_content, url)
+    valid_links, dropped = link_filter.filter(links, url)
+    return title, description, valid_links, content, dropped
+
+def crawl_site(initial_page_id, max_pages=None, max_depth=None, restrict_to_path=False, base_path=None, concurrency=None, rate_limit=None, refresh=False, include_rules='', exclude_rules='', use_sitemaps=True):
     """
     Main function to crawl a website starting from a given initial page ID.
     Optionally restricts crawl to a specific path.
     Updates page statuses throughout the process.
+
+    Records a CrawlJob with these options and runs it with the concurrent
+    CrawlEngine on its own event loop, so it is safe to call from a plain
+    background thread. `concurrency` caps the number of in-flight fetches
+    (defaults to settings.CRAWLER_CONCURRENCY) and `rate_limit` overrides the
+    per-host requests/second politeness limit. With `refresh`, pages already
+    stored are revalidated with conditional requests and only changed pages are
+    re-parsed and rewritten. `include_rules` / `exclude_rules` limit the links
+    followed (one rule per line; see crawler.rules). With `use_sitemaps` the
+    pages listed in the site's sitemaps are queued too. Returns the job, or
+    None if the initial page doesn't exist.
     """
+    # Imported here because the engine itself builds on the helpers in this module
+    from .jobs import create_crawl_job, run_crawl_job
+
     try:
-        # 1. Get the initial page object
         initial_page = CrawledPage.objects.get(pk=initial_page_id)
-        start_url = initial_page.url
-        base_domain = initial_page.domain
-
-        if not base_domain:
-            logging.error(f"Initial page ID {initial_page_id} has no domain ({start_url}). Cannot crawl.")
-            initial_page.status = CrawledPage.StatusChoices.FAILED
-            initial_page.error_message = "Missing domain information."
-            initial_page.save(update_fields=['status', 'error_message'])
-            return
-
-        restriction_msg = f" restricted to path '{base_path}'" if restrict_to_path else ""
-        logging.info(f"Starting crawl from initial page ID: {initial_page_id} ({start_url}) with max_pages={max_pages} max_depth={max_depth}{restriction_msg}")
-
-        # Update initial page status to PROCESSING
-        initial_page.status = CrawledPage.StatusChoices.PROCESSING
-        initial_page.error_message = None # Clear previous errors
-        initial_page.save(update_fields=['status', 'error_message'])
-
-        queue = deque([(start_url, 0)])  # Store tuples of (url, depth)
-        visited = {start_url}
-        pages_crawled = 0
-
     except CrawledPage.DoesNotExist:
         logging.error(f"Cannot start crawl: Initial page with ID {initial_page_id} not found.")
         return
-    except Exception as e:
-        logging.exception(f"Error initializing crawl for page ID {initial_page_id}: {e}")
-        try:
-            # Try to mark the initial page as failed if we can fetch it
-            page = CrawledPage.objects.get(pk=initial_page_id)
-            page.status = CrawledPage.StatusChoices.FAILED
-            page.error_message = f"Initialization error: {e}"
-            page.save(update_fields=['status', 'error_message'])
-        except Exception as db_err:
-            logging.error(f"Additionally failed to update status for page ID {initial_page_id} after init error: {db_err}")
-        return
 
-    # --- Main Crawl Loop ---
-    try:
-
-        while queue: # Loop continues as long as there are URLs to process
-            current_url, current_depth = queue.popleft()
-
-            # --- Check Limits ---
-            if max_pages is not None and pages_crawled >= max_pages:
-                logging.info(f"Reached max_pages limit: {max_pages}. Stopping crawl.")
-                break # Exit the while loop
-            if max_depth is not None and current_depth > max_depth:
-                # Don't process this page, but don't stop the whole crawl
-                logging.info(f"Skipping {current_url} - Exceeds max_depth {max_depth}")
-                # Mark page as failed? Or just skip? Let's skip for now.
-                # We might need a 'SKIPPED' status later.
-                continue # Go to next iteration of the while loop
-
-            logging.info(f"Processing: {current_url} (Depth: {current_depth}, Crawled: {pages_crawled})")
-
-            # --- Get DB Record and Update Status ---
-            try:
-                page = CrawledPage.objects.get(url=current_url, domain=base_domain)
-                # Mark as PROCESSING before fetching
-                page.status = CrawledPage.StatusChoices.PROCESSING
-                page.error_message = None # Clear previous errors
-                page.save(update_fields=['status', 'error_message'])
-            except CrawledPage.DoesNotExist:
-                logging.error(f"DB record inconsistency: {current_url} not found during processing. Skipping.")
-                continue # Go to next iteration
-            except Exception as db_err:
-                logging.error(f"DB Error fetching/updating status for {current_url}: {db_err}")
-                continue # Go to next iteration
-
-            # --- Fetch HTML ---
-            html_content, response_obj = fetch_html(current_url)
-            if html_content is None or response_obj is None:
-                page.status = CrawledPage.StatusChoices.FAILED
-                page.error_message = "Fetch failed (Timeout or Network Error)"
-                page.html_content = None
-                page.save(update_fields=['status', 'error_message', 'html_content'])
-                continue # Go to next iteration
-
-            # --- Parse and Extract ---
-            title, description, links = parse_and_extract(html_content, current_url)
-
-            # --- Update DB Record (Success) ---
-            page.title = title[:511] # Use model max_length - 1
-            page.summary = description
-            page.html_content = html_content
-            page.status = CrawledPage.StatusChoices.COMPLETED
-            page.error_message = None # Clear error on success
-            page.save(update_fields=['title', 'summary', 'status', 'error_message', 'html_content', 'updated_at'])
-            logging.info(f"Successfully processed and saved: {current_url}")
-            pages_crawled += 1 # Increment only on successful processing
-
-            # --- Filter and Normalize Links ---
-            valid_new_links = filter_and_normalize_links(
-                links,
-                base_domain,
-                current_url,
-                restrict_to_path=restrict_to_path,
-                base_path=base_path
-            )
-
-            # --- Add New Links to Queue and DB (Revised Logic) ---
-            for link in valid_new_links:
-                # 1. Check if already visited in this crawl session
-                if link in visited:
-                    continue
-
-                # 2. Check depth limit before proceeding
-                next_depth = current_depth + 1
-                if max_depth is not None and next_depth > max_depth:
-                    logging.debug(f"Skipping {link} - Exceeds max_depth {max_depth}")
-                    continue # Don't add links that exceed max depth
-
-                # 3. Check page limit before adding to queue/visited
-                # Estimate total pages if added: current crawled + current queue size + 1
-                if max_pages is not None and (pages_crawled + len(queue) + 1) > max_pages:
-                    logging.info(f"Skipping adding {link} to queue - max_pages limit ({max_pages}) would be reached.")
-                    # Optionally create/update DB record as PENDING but don't queue or visit?
-                    # For now, just skip adding to queue/visited.
-                    continue
-
-                # 4. Get or Create DB record and potentially reset status
-                try:
-                    new_page, created = CrawledPage.objects.get_or_create(
-                        url=link,
-                        defaults={'domain': base_domain, 'status': CrawledPage.StatusChoices.PENDING}
-                    )
-
-                    # If the page existed but wasn't PENDING (e.g., COMPLETED/FAILED from a previous run),
-                    # reset it to PENDING for this new crawl.
-                    if not created and new_page.status != CrawledPage.StatusChoices.PENDING:
-                        logging.debug(f"Resetting existing page {link} to PENDING for re-crawl.")
-                        new_page.status = CrawledPage.StatusChoices.PENDING
-                        new_page.title = ''
-                        new_page.summary = ''
-                        new_page.html_content = None # Clear old content
-                        new_page.error_message = None # Clear old errors
-                        # Note: We don't reset crawled_at, but updated_at will change
-                        new_page.save(update_fields=['status', 'title', 'summary', 'html_content', 'error_message', 'updated_at'])
-
-                    # 5. Add to visited set and queue
-                    visited.add(link) # Mark as visited for this session
-                    queue.append((link, next_depth))
-                    logging.debug(f"Added to queue: {link} (Depth: {next_depth})")
-
-                except Exception as db_err:
-                    # Handle potential IntegrityError if URL is too long, etc.
-                    logging.error(f"DB Error processing record for {link}: {db_err}")
-                    # Do not add to visited or queue if DB interaction failed
-
-            # --- Politeness Delay ---
-            time.sleep(0.5) # Wait half a second between requests
-
-        # --- End of While Loop ---
-        logging.info(f"Crawl loop finished for initial page ID: {initial_page_id} ({start_url}). Crawled {pages_crawled} pages.")
-
-        # Final check: If the initial page is still PROCESSING (e.g., loop finished due to limits before processing it fully), mark as COMPLETED?
-        # This depends on the desired final state. Let's assume if the loop finishes without error, it's completed.
-        # Re-fetch the initial page to check its final status from the loop.
-        final_initial_page = CrawledPage.objects.get(pk=initial_page_id)
-        if final_initial_page.status == CrawledPage.StatusChoices.PROCESSING:
-             final_initial_page.status = CrawledPage.StatusChoices.COMPLETED
-             final_initial_page.save(update_fields=['status'])
-             logging.info(f"Marked initial page {initial_page_id} as COMPLETED after crawl loop finished.")
-
-    except Exception as e:
-        # --- Global Error Handling for the Crawl ---
-        logging.exception(f"Critical error during crawl for initial page ID {initial_page_id} ({start_url}): {e}")
-        try:
-            # Attempt to mark the initial page as FAILED
-            error_page = CrawledPage.objects.get(pk=initial_page_id)
-            error_page.status = CrawledPage.StatusChoices.FAILED
-            error_page.error_message = f"Runtime error: {e}"
-            error_page.save(update_fields=['status', 'error_message'])
-        except Exception as db_err:
-            logging.error(f"Additionally failed to update status for page ID {initial_page_id} after runtime error: {db_err}")
+    job = create_crawl_job(
+        initial_page,
+        max_pages=max_pages,
+        max_depth=max_depth,
+        restrict_to_path=restrict_to_path,
+        base_path=base_path,
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        refresh=refresh,
+        include_rules=include_rules,
+        exclude_rules=exclude_rules,
+        use_sitemaps=use_sitemaps,
+    )
+    run_crawl_job(job.id)
+    return job
@@ -1,3 +1,622 @@
-from django.test import TestCase
+import asyncio
+import codecs
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .batching import PageWriteBuffer, prune_bodies, record_links
+from .canonical import UrlCanonicalizer, VisitedSet
+from .encoding import resolve_encoding
+from .engine import CrawlEngine
+from .extractors import EXTRACTORS, SoupExtractor
+from .jobs import LeaseLost, claim_job, create_crawl_job, reclaim_stale_jobs, renew_lease
+from .models import CrawledPage, CrawlJob, FrontierEntry, PageBody
+from .politeness import HostScheduler
+from .progress import job_status
+from .routers import ReadReplicaRouter, replica_reads
+from .rules import LinkRules
+from .search import index_pages, search_results
+from .sitemaps import sitemap_entries
+from .tasks import LinkFilter, crawl_site
+
+
+class LocalSite:
+    """
+    A small linked site served on 127.0.0.1 for crawl tests: page i links to
+    the next few pages. `failures` is how many times each page answers 503
+    before it answers 200. With `etags`, pages send an ETag and answer a
+    matching If-None-Match with 304. `files` serves other paths ({path:
+    bytes}, e.g. sitemaps). Use as a context manager.
+    """
+
+    def __init__(self, pages=20, failures=0, etags=False, files=None):
+        self.pages = pages
+        self.failures = failures
+        self.etags = etags
+        self.files = files or {}
+        self.not_modified = 0
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = site.respond(self.path)
+                etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+                if site.etags and status == 200 and self.headers.get('If-None-Match') == etag:
+                    site.not_modified += 1
+                    status, body = 304, b''
+                self.send_response(status)
+                if site.etags:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, path):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}{path}'
+
+    @property
+    def start_url(self):
+        return self.url('/page-0.html')
+
+    def respond(self, path):
+        if path in self.files:
+            return 200, 'application/xml', self.files[path]
+        if not path.startswith('/page-'):
+            return 404, 'text/plain', b''
+        with self._lock:
+            self.requests[path] += 1
+            if self.requests[path] <= self.failures:
+                return 503, 'text/plain', b'unavailable'
+        index = int(path.split('-')[1].split('.')[0])
+        links = ''.join(f'<a href="/page-{i}.html">Page {i}</a>' for i in range(index + 1, min(index + 4, self.pages)))
+        body = f'<html><head><title>Page {index}</title></head><body><main><p>Page {index}</p>{links}</main></body></html>'
+        return 200, 'text/html; charset=utf-8', body.encode('utf-8')
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def crawl(site, timeout=30, **options):
+    """Runs a crawl job for `site` (from its stored start page, if any) to the end and returns the reloaded CrawlJob."""
+    initial_page, _ = CrawledPage.objects.get_or_create(url=site.start_url)
+    job = create_crawl_job(initial_page, **{'rate_limit': 0, 'use_sitemaps': False, **options})
+    logging.disable(logging.CRITICAL) # The engine logs every page, and every failed fetch as an error
+    try:
+        asyncio.run(asyncio.wait_for(CrawlEngine(job.id).run(), timeout))
+    finally:
+        logging.disable(logging.NOTSET)
+    return CrawlJob.objects.get(pk=job.id)
+
+
+class HostSchedulerTests(SimpleTestCase):
+
+    def test_retry_finishes_the_handout(self):
+        async def scenario():
+            frontier = HostScheduler(rate=0, respect_robots=False, concurrency=4)
+            frontier.push('http://example.com/a', 1, priority=3)
+            url, depth = await frontier.get()
+            frontier.retry(url, depth, delay=0)
+            # Handed out again before the first worker would have reached task_done()
+            again, _ = await asyncio.wait_for(frontier.get(), 1)
+            self.assertEqual(again, url)
+            self.assertEqual(frontier._active['example.com'], 1)
+            frontier.report(again)
+            frontier.task_done(again)
+            await asyncio.wait_for(frontier.join(), 1)
+            self.assertEqual(frontier._active['example.com'], 0)
+
+        asyncio.run(scenario())
+
+    def test_retry_keeps_priority_and_waits_for_delay(self):
+        async def scenario():
+            frontier = HostScheduler(rate=0, respect_robots=False)
+            frontier.push('http://example.com/a', 1, priority=5)
+            frontier.push('http://example.com/b', 1, priority=1)
+            url, depth = await frontier.get()
+            self.assertEqual(url, 'http://example.com/a')
+            frontier.retry(url, depth, delay=0.05)
+            served = [(await frontier.get())[0] for _ in range(2)]
+            self.assertEqual(served, ['http://example.com/b', 'http://example.com/a'])
+
+        asyncio.run(scenario())
+
+
+@override_settings(
+    CRAWLER_RETRY_BACKOFF=0.001, CRAWLER_DB_FLUSH_INTERVAL=0, CRAWLER_DB_BATCH_SIZE=1,
+    CRAWLER_BREAKER_THRESHOLD=10 ** 9, CRAWLER_FETCH_RETRIES=3,
+)
+class CrawlRetryTests(TransactionTestCase):
+
+    def test_near_zero_backoff_retries_finish_the_crawl(self):
+        with LocalSite(pages=30, failures=2) as site:
+            job = crawl(site, concurrency=8)
+        self.assertEqual(job.status, CrawlJob.StatusChoices.COMPLETED)
+        self.assertEqual(job.pages_crawled, 30)
+        self.assertFalse(CrawledPage.objects.exclude(status=CrawledPage.StatusChoices.COMPLETED).exists())
+        self.assertEqual(set(site.requests.values()), {3}) # Two 503s, then the page
+
+    def test_out_of_retries_fails_with_category(self):
+        with LocalSite(pages=5, failures=10) as site:
+            job = crawl(site, concurrency=2)
+        page = CrawledPage.objects.get(url=site.start_url)
+        self.assertEqual(job.pages_failed, 1)
+        self.assertEqual(page.status, CrawledPage.StatusChoices.FAILED)
+        self.assertEqual(page.error_category, CrawledPage.ErrorChoices.SERVER_ERROR)
+        self.assertEqual(site.requests['/page-0.html'], 4)
+
+
+class BodyStoreTests(TestCase):
+
+    def save_body(self, page, html):
+        buffer = PageWriteBuffer()
+        page.body = PageBody.from_html(html) if html is not None else None
+        page.status = CrawledPage.StatusChoices.COMPLETED if html is not None else CrawledPage.StatusChoices.FAILED
+        buffer.save(page, ['status', 'body'])
+        buffer.flush()
+
+    def test_replaced_and_dropped_bodies_are_deleted(self):
+        page = CrawledPage.objects.create(url='http://example.com/a')
+        self.save_body(page, '<p>first</p>')
+        first = page.body_id
+        self.save_body(page, '<p>second</p>')
+        self.assertFalse(PageBody.objects.filter(hash=first).exists())
+        self.assertEqual(CrawledPage.objects.get(pk=page.pk).html_content, '<p>second</p>')
+        self.save_body(page, None) # Failed re-crawl
+        self.assertFalse(PageBody.objects.exists())
+
+    def test_shared_bodies_are_kept(self):
+        page, twin = (CrawledPage.objects.create(url=f'http://example.com/{name}') for name in ('a', 'b'))
+        self.save_body(page, '<p>same</p>')
+        self.save_body(twin, '<p>same</p>')
+        self.save_body(page, '<p>changed</p>')
+        self.assertEqual(CrawledPage.objects.get(pk=twin.pk).html_content, '<p>same</p>')
+        self.assertEqual(PageBody.objects.count(), 2)
+
+    def test_prune_bodies_deletes_every_unused_body(self):
+        page = CrawledPage.objects.create(url='http://example.com/a')
+        self.save_body(page, '<p>kept</p>')
+        PageBody.from_html('<p>orphan</p>').save()
+        self.assertEqual(prune_bodies(), 1)
+        self.assertEqual(list(PageBody.objects.values_list('hash', flat=True)), [page.body_id])
+
+
+class SearchPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        pages = CrawledPage.objects.bulk_create(
+            CrawledPage(url=f'http://example.com/{i}', domain='example.com', title=f'Guide {i}',
+                        summary='Install guide', status=CrawledPage.StatusChoices.COMPLETED)
+            for i in range(7)
+        )
+        # Identical entries: every result ties on rank, so pages are split by id alone
+        index_pages((page.pk, 'Guide', 'Install guide', 'How to install') for page in pages)
+        cls.urls = [page.url for page in sorted(pages, key=lambda page: page.pk)]
+
+    def test_cursor_pages_through_ties_exactly_once(self):
+        pages = CrawledPage.objects.all()
+        seen, cursor = [], None
+        while True:
+            results, cursor = search_results(pages, 'install', ('url',), limit=2, cursor=cursor)
+            seen += [result['url'] for result in results]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.urls)
+
+    def test_search_api_streams_under_wsgi(self):
+        response = self.client.get(reverse('crawler:api_search_pages'), {'keyword': 'install', 'limit': 5})
+        self.assertFalse(hasattr(response.streaming_content, '__aiter__')) # WSGI servers send a sync iterator as it goes
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNotNone(data['next_cursor'])
+
+    async def test_search_api_streams_under_asgi(self):
+        url = reverse('crawler:api_search_pages')
+        response = await self.async_client.get(url, {'keyword': 'install', 'limit': 5})
+        self.assertTrue(response.is_async) # ASGI would read a sync iterator to the end first
+        data = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        response = await self.async_client.get(url, {'keyword': 'install', 'cursor': data['next_cursor']})
+        rest = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(len(data['results']) + len(rest['results']), 7)
+        self.assertIsNone(rest['next_cursor'])
+
+
+class SearchIndexTests(TestCase):
+
+    def create_page(self, name, title, summary, text):
+        page = CrawledPage.objects.create(
+            url=f'http://example.com/{name}', domain='example.com', title=title, summary=summary,
+            status=CrawledPage.StatusChoices.COMPLETED,
+        )
+        index_pages([(page.pk, title, summary, text)])
+        return page
+
+    def search(self, keyword):
+        # Every page, whatever its status: only the index decides what matches
+        results, _ = search_results(CrawledPage.objects.all(), keyword, ('url',))
+        return [result['url'] for result in results]
+
+    def test_failed_recrawl_removes_the_page_from_the_index(self):
+        page = self.create_page('setup', 'Setup', 'Install guide', 'How to install')
+        self.assertEqual(self.search('install'), [page.url])
+
+        buffer = PageWriteBuffer()
+        buffer.mark_processing(page)
+        page.status = CrawledPage.StatusChoices.FAILED
+        page.error_message = 'Fetch failed: HTTP 404'
+        buffer.save(page, ['status', 'error_message'])
+        buffer.flush()
+        self.assertEqual(self.search('install'), [])
+
+    def test_title_match_ranks_first(self):
+        in_text = self.create_page('text', 'Changelog', 'Release notes', 'Fixed the upgrade script for kubernetes')
+        in_summary = self.create_page('summary', 'Operations', 'Running on kubernetes', 'Deployment notes')
+        in_title = self.create_page('title', 'Kubernetes', 'Deployment', 'Cluster setup notes')
+        self.assertEqual(self.search('kubernetes'), [in_title.url, in_summary.url, in_text.url])
+
+class ReadReplicaRouterTests(SimpleTestCase):
+
+    def test_reads_go_to_default_unless_the_alias_is_configured(self):
+        router = ReadReplicaRouter()
+        for alias in (None, 'replica'): # 'replica' isn't in DATABASES
+            with self.subTest(alias=alias), override_settings(CRAWLER_READ_DATABASE=alias), replica_reads():
+                self.assertEqual(router.db_for_read(CrawledPage), 'default')
+        self.assertIsNone(router.db_for_read(CrawledPage)) # Outside replica_reads(): Django's default routing
+
+
+# Extraction corpus: awkward documents, and pages shaped like real documentation
+EXTRACTION_CORPUS = [
+    '',
+    '<html><head></head><body><a href="/a">A</a></body></html>',
+    '<html><head><title></title></head><body><a href=" /b ">B</a><a href="">empty</a><a>none</a></body></html>',
+    '<html><head><title>One <!-- c --> Two</title></head><body></body></html>',
+    '<html><body><svg><title>Icon</title></svg><title>Late</title><a href="/c">C</a></body></html>',
+    '<HTML><HEAD><TITLE> Upper &amp; Case </TITLE><META NAME="description" CONTENT=" Shouting "></HEAD>'
+    '<BODY><A HREF="/D?x=1&amp;y=2">D</A></BODY></HTML>',
+    '<?xml version="1.0" encoding="utf-8"?><!DOCTYPE html><html xmlns="http://www.w3.org/1999/xhtml">'
+    '<head><title>XHTML</title><meta name="description" content="xml decl"/></head><body><a href="/e">E</a></body></html>',
+    '<html><head><meta name="description"><meta name="description" content="second"></head><body></body></html>',
+    '<html><head><title>Café &mdash; 日本語</title></head><body><a href="/f#frag">F</a><p><a href="/g">G<div></body>',
+    '<title>No html element</title><meta name="Description" content="wrong case"><a href="/h">H</a><a href="/h">dup</a>',
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Install</title>'
+    '<meta name="description" content="Installing the package"><script>var nav = "<a href=/x>";</script>'
+    '<style>main { color: red }</style></head><body>'
+    '<nav><ul><li><a href="/docs/">Docs</a></li><li><a href="/blog/">Blog</a></li></ul></nav>'
+    '<main><h1>Install</h1><p>Run <code>pip install web2mcp</code>, then <em>configure</em> it.</p>'
+    '<h2>Options</h2><ul><li>One <a href="/docs/one.html">option</a></li><li>Two</li></ul>'
+    '<pre><code>python manage.py migrate\npython manage.py crawl_worker</code></pre>'
+    '<table><tr><th>Name</th><th>Default</th></tr><tr><td>rate</td><td>4.0</td></tr></table></main>'
+    '<footer><a href="mailto:docs@example.com">Mail</a></footer></body></html>',
+] + [
+    '<html><head><title>Page {0}</title><meta name="description" content="Page {0}"></head><body>'
+    '<nav>{1}</nav><main><h1>Page {0}</h1>{2}<div class="related"><a href="/docs/page-{0}.html?ref=related#top">'
+    'Related</a></div></main></body></html>'.format(
+        index,
+        ''.join(f'<a href="/docs/page-{i}.html">Page {i}</a>' for i in range(30)),
+        ''.join(f'<p>Paragraph {p} of page {index}, with <strong>bold</strong> text.</p>' for p in range(10)),
+    )
+    for index in range(5)
+]
+
+
+class ResolveEncodingTests(SimpleTestCase):
+
+    def test_precedence(self):
+        meta = '<html><head><meta charset="koi8-r"></head><body>Привет</body></html>'
+        for body, content_type, expected in [
+            # A byte order mark beats everything
+            (codecs.BOM_UTF8 + meta.encode('utf-8'), 'text/html; charset=iso-8859-1', 'utf-8-sig'),
+            (codecs.BOM_UTF16_LE + meta.encode('utf-16-le'), 'text/html; charset=utf-8', 'utf-16'),
+            # Then the HTTP charset, over <meta>
+            (meta.encode('cp1251'), 'text/html; charset=windows-1251', 'cp1251'),
+            (meta.encode('cp1252', 'replace'), 'text/html; charset=latin-1', 'cp1252'), # Decoded as browsers do
+            # Then <meta>
+            (meta.encode('koi8-r'), 'text/html', 'koi8-r'),
+            (meta.encode('koi8-r'), 'text/html; charset=no-such-charset', 'koi8-r'),
+            # Then detection: valid UTF-8 is UTF-8
+            ('<p>Grüße</p>'.encode('utf-8'), None, 'utf-8'),
+        ]:
+            with self.subTest(body=body[:12], content_type=content_type):
+                self.assertEqual(resolve_encoding(body, content_type), expected)
+
+class ExtractorEquivalenceTests(SimpleTestCase):
+
+    def test_every_backend_matches_beautifulsoup(self):
+        reference = SoupExtractor()
+        for name, extractor_class in EXTRACTORS.items():
+            extractor = extractor_class()
+            for index, html in enumerate(EXTRACTION_CORPUS):
+                with self.subTest(extractor=name, document=index):
+                    self.assertEqual(extractor.extract(html, 'http://example.com/'), reference.extract(html, 'http://example.com/'))
+
+    def test_main_content_leaves_out_navigation_and_scripts(self):
+        title, description, links, content = SoupExtractor().extract(EXTRACTION_CORPUS[10], 'http://example.com/')
+        self.assertEqual((title, description), ('Install', 'Installing the package'))
+        self.assertEqual(links, {'/docs/', '/blog/', '/docs/one.html', 'mailto:docs@example.com'})
+        self.assertEqual(content, (
+            '# Install\n\nRun `pip install web2mcp`, then configure it.\n\n## Options\n\n- One option\n- Two\n\n'
+            '```\npython manage.py migrate\npython manage.py crawl_worker\n```\n\n'
+            '| Name | Default |\n| --- | --- |\n| rate | 4.0 |'
+        ))
+
+
+@override_settings(CRAWLER_RETRY_BACKOFF=0.001, CRAWLER_BREAKER_THRESHOLD=10 ** 9)
+class CrawlBudgetTests(TransactionTestCase):
+
+    def test_max_pages_is_exact(self):
+        for failures in (0, 1): # Also when slots are given back by pages waiting for a retry
+            with self.subTest(failures=failures), LocalSite(pages=40, failures=failures) as site:
+                CrawledPage.objects.all().delete()
+                job = crawl(site, concurrency=8, max_pages=10)
+                self.assertEqual(job.pages_crawled, 10)
+                self.assertEqual(CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED).count(), 10)
+                self.assertFalse(CrawledPage.objects.filter(status=CrawledPage.StatusChoices.PROCESSING).exists())
+                self.assertEqual((job.pages_pending, job.pages_processing), (0, 0))
+                self.assertEqual(sum(count > failures for count in site.requests.values()), 10) # No page fetched past the budget
+
+    def test_uncrawled_pages_keep_their_stored_copy(self):
+        with LocalSite(pages=12) as site:
+            crawl(site, concurrency=4)
+            CrawledPage.objects.filter(url=site.start_url).delete() # A new job's start page
+            job = crawl(site, concurrency=4, max_pages=3)
+        self.assertEqual(CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED, body__isnull=False).count(), 12)
+        # The dropped URLs leave the queue, and the restored pages count as completed
+        restored = job.frontier.filter(page__status=CrawledPage.StatusChoices.COMPLETED).count() - 3
+        self.assertGreater(restored, 0)
+        self.assertEqual((job.pages_pending, job.pages_processing, job.pages_crawled, job.pages_failed), (0, 0, 3 + restored, 0))
+        self.assertFalse(job.frontier.exclude(state=FrontierEntry.StateChoices.DONE).exists())
+        self.assertEqual(job_status(job)['status_breakdown'], [{'status': CrawledPage.StatusChoices.COMPLETED, 'count': 3 + restored}])
+
+    def test_pages_beyond_max_depth_keep_their_stored_copy(self):
+        with LocalSite(pages=8) as site:
+            crawl(site, concurrency=4)
+            CrawledPage.objects.filter(url=site.start_url).delete()
+            # The refresh queues the 7 known pages at depth 1: all skipped, and given their content back
+            job = crawl(site, concurrency=4, refresh=True, max_depth=0)
+        self.assertEqual(site.requests['/page-4.html'], 1)
+        self.assertFalse(CrawledPage.objects.exclude(status=CrawledPage.StatusChoices.COMPLETED).exists())
+        self.assertEqual((job.pages_pending, job.pages_processing, job.pages_crawled), (0, 0, 8))
+
+
+class RefreshTests(TransactionTestCase):
+
+    def assert_kept_on_refresh(self, site):
+        crawl(site, concurrency=4)
+        stored = dict(CrawledPage.objects.values_list('url', 'body_id'))
+        markdown = dict(CrawledPage.objects.values_list('url', 'content_markdown'))
+        self.assertTrue(all(markdown.values()))
+        job = crawl(site, concurrency=4, refresh=True)
+        self.assertEqual((job.pages_crawled, job.pages_unchanged), (site.pages, site.pages))
+        self.assertEqual(dict(CrawledPage.objects.values_list('url', 'body_id')), stored)
+        self.assertEqual(dict(CrawledPage.objects.values_list('url', 'content_markdown')), markdown)
+        self.assertFalse(CrawledPage.objects.exclude(status=CrawledPage.StatusChoices.COMPLETED).exists())
+
+    def test_not_modified(self):
+        with LocalSite(pages=6, etags=True) as site:
+            self.assert_kept_on_refresh(site)
+        self.assertEqual(site.not_modified, 6)
+
+    def test_identical_content(self):
+        with LocalSite(pages=6) as site: # No validators: every page answers 200 with the same body
+            self.assert_kept_on_refresh(site)
+        self.assertEqual(site.requests['/page-3.html'], 2)
+
+def sitemap_xml(tag, entries):
+    """A sitemap ('urlset') or sitemap index ('sitemapindex') listing `entries`, (loc, lastmod) pairs."""
+    item = 'url' if tag == 'urlset' else 'sitemap'
+    items = ''.join(
+        f'<{item}><loc>{loc}</loc>' + (f'<lastmod>{lastmod}</lastmod>' if lastmod else '') + f'</{item}>'
+        for loc, lastmod in entries
+    )
+    return f'<?xml version="1.0" encoding="UTF-8"?><{tag} xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{items}</{tag}>'.encode()
+
+
+class SitemapTests(TransactionTestCase):
+
+    def test_nested_sitemap_indexes(self):
+        with LocalSite(pages=4) as site:
+            site.files.update({
+                '/sitemap.xml': sitemap_xml('sitemapindex', [(site.url('/sitemap-a.xml'), None), (site.url('/more.xml'), None)]),
+                '/sitemap-a.xml': sitemap_xml('urlset', [(site.url('/page-1.html'), '2024-05-01')]),
+                '/more.xml': sitemap_xml('sitemapindex', [(site.url('/sitemap-b.xml.gz'), None)]),
+                '/sitemap-b.xml.gz': gzip.compress(sitemap_xml('urlset', [
+                    (site.url('/page-2.html'), '2024-05-01T12:00:00+00:00'), (site.url('/page-3.html'), None),
+                ])),
+            })
+            entries = list(sitemap_entries(site.start_url))
+        self.assertEqual([(loc, lastmod) for loc, lastmod, _ in entries], [
+            (site.url('/page-1.html'), datetime(2024, 5, 2, tzinfo=dt_timezone.utc)), # A bare date means the end of that day
+            (site.url('/page-2.html'), datetime(2024, 5, 1, 12, tzinfo=dt_timezone.utc)),
+            (site.url('/page-3.html'), None),
+        ])
+
+    def test_recrawl_skips_pages_not_modified_since_stored(self):
+        with LocalSite(pages=6) as site:
+            crawl(site, concurrency=4)
+            site.files['/sitemap.xml'] = sitemap_xml('urlset', [
+                (site.url(f'/page-{i}.html'), '2000-01-01' if i <= 3 else '2999-01-01') for i in range(1, 6)
+            ])
+            job = crawl(site, concurrency=4, use_sitemaps=True)
+        self.assertEqual((job.sitemap_unchanged, job.sitemap_pages), (3, 2))
+        self.assertEqual([site.requests[f'/page-{i}.html'] for i in range(1, 6)], [1, 1, 1, 2, 2])
+        self.assertFalse(CrawledPage.objects.exclude(status=CrawledPage.StatusChoices.COMPLETED).exists())
+
+@override_settings(CRAWLER_PROGRESS_INTERVAL=0.01)
+class CrawlEventsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        initial_page = CrawledPage.objects.create(url='http://example.com/', domain='example.com')
+        cls.job = create_crawl_job(initial_page)
+        CrawlJob.objects.filter(pk=cls.job.pk).update(status=CrawlJob.StatusChoices.RUNNING, pages_pending=3, pages_crawled=1)
+
+    def parse(self, chunk):
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_progress_then_done(self):
+        response = await self.async_client.get(reverse('crawler:api_crawl_events', args=[self.job.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        event, data = self.parse(await anext(events))
+        self.assertEqual((event, data['queue_depth'], data['is_processing']), ('progress', 3, True))
+
+        await CrawlJob.objects.filter(pk=self.job.pk).aupdate(
+            status=CrawlJob.StatusChoices.COMPLETED, pages_pending=0, pages_crawled=4,
+        )
+        event, data = self.parse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual((event, data['queue_depth'], data['is_processing']), ('done', 0, False))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events) # The stream ends with the job
+
+    async def test_unknown_job(self):
+        response = await self.async_client.get(reverse('crawler:api_crawl_events', args=[self.job.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+class JobLeaseTests(TransactionTestCase):
+
+    def setUp(self):
+        initial_page = CrawledPage.objects.create(url='http://example.com/', domain='example.com')
+        self.job = create_crawl_job(initial_page)
+
+    def as_worker(self, name):
+        return mock.patch('crawler.jobs.worker_id', return_value=name)
+
+    def test_expired_lease_is_taken_over_and_fences_the_old_worker(self):
+        with self.as_worker('host-a:1'):
+            self.assertTrue(claim_job(self.job.pk))
+            pages = record_links(['http://example.com/a', 'http://example.com/b'], 'example.com', job_id=self.job.pk)
+            buffer = PageWriteBuffer(job_id=self.job.pk)
+            buffer.mark_processing(pages['http://example.com/a'])
+            buffer.flush()
+        with self.as_worker('host-b:2'):
+            self.assertFalse(claim_job(self.job.pk)) # Still leased to host-a
+
+        CrawlJob.objects.filter(pk=self.job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        with self.as_worker('host-b:2'):
+            self.assertTrue(claim_job(self.job.pk))
+        job = CrawlJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.worker, job.pages_pending, job.pages_processing), ('host-b:2', 2, 0))
+        self.assertEqual(CrawledPage.objects.get(url='http://example.com/a').status, CrawledPage.StatusChoices.PENDING)
+        self.assertFalse(FrontierEntry.objects.filter(job=job, state=FrontierEntry.StateChoices.IN_PROGRESS).exists())
+
+        with self.as_worker('host-a:1'):
+            with self.assertRaises(LeaseLost):
+                renew_lease(self.job.pk)
+            page = pages['http://example.com/b']
+            buffer = PageWriteBuffer(job_id=self.job.pk)
+            buffer.mark_processing(page)
+            page.status = CrawledPage.StatusChoices.COMPLETED
+            buffer.save(page, ['status'])
+            with self.assertRaises(LeaseLost):
+                buffer.flush()
+        self.assertEqual(CrawledPage.objects.get(pk=page.pk).status, CrawledPage.StatusChoices.PENDING)
+        self.assertEqual(CrawlJob.objects.get(pk=self.job.pk).pages_pending, 2)
+
+    def test_reclaim_requeues_jobs_with_an_expired_lease(self):
+        with self.as_worker('host-a:1'):
+            claim_job(self.job.pk)
+        self.assertEqual(reclaim_stale_jobs(), []) # Lease still live
+        CrawlJob.objects.filter(pk=self.job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reclaim_stale_jobs(), [self.job.pk])
+        job = CrawlJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.worker), (CrawlJob.StatusChoices.PENDING, ''))
+
+    def test_crawl_site_without_initial_page(self):
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(crawl_site(self.job.initial_page_id + 1))
+        self.assertEqual(CrawlJob.objects.count(), 1)
+
+
+class CanonicalizationTests(SimpleTestCase):
+
+    def test_url_variants_share_one_form(self):
+        canonicalizer = UrlCanonicalizer()
+        variants = [
+            'HTTP://Example.COM:80/docs/a%2fb?b=2&a=1#intro',
+            'http://example.com/docs/a%2Fb?utm_source=feed&a=1&b=2',
+            'http://example.com/docs/a%2Fb?a=1&gclid=x&b=2&',
+        ]
+        self.assertEqual({canonicalizer.canonicalize(url) for url in variants}, {'http://example.com/docs/a%2Fb?a=1&b=2'})
+
+    def test_keeps_what_can_name_another_page(self):
+        canonicalizer = UrlCanonicalizer()
+        self.assertEqual(canonicalizer.canonicalize('https://example.com'), 'https://example.com/')
+        self.assertEqual(canonicalizer.canonicalize('https://example.com:8443/docs/'), 'https://example.com:8443/docs/')
+        self.assertEqual(canonicalizer.canonicalize('https://example.com/?q=a+b&q=c'), 'https://example.com/?q=a+b&q=c')
+        self.assertEqual(canonicalizer.canonicalize('http://[::1]:80/x'), 'http://[::1]/x')
+        with self.assertRaises(ValueError):
+            canonicalizer.canonicalize('http://example.com:bad/')
+
+    def test_options(self):
+        self.assertEqual(
+            UrlCanonicalizer(keep_params=['page'], sort_params=False, strip_trailing_slash=True)
+            .canonicalize('http://example.com/docs/?z=1&page=2&ref=x'),
+            'http://example.com/docs?page=2',
+        )
+        self.assertEqual(UrlCanonicalizer(sort_params=False).canonicalize('http://example.com/?b=1&a=2'), 'http://example.com/?b=1&a=2')
+
+    def test_link_filter_returns_canonical_links(self):
+        links, dropped = LinkFilter('Example.com').filter(
+            ['/docs/page.html#top', 'page.html?utm_medium=x', 'HTTP://EXAMPLE.COM/docs/page.html',
+             'https://other.org/', 'mailto:docs@example.com', '/manual.pdf'],
+            'http://example.com/docs/index.html',
+        )
+        self.assertEqual(links, {'http://example.com/docs/page.html'})
+        self.assertEqual(dropped, Counter({'other domain': 1, 'not http(s)': 1, 'file extension': 1}))
+
+    def test_visited_set(self):
+        visited = VisitedSet(capacity=4)
+        urls = [f'http://example.com/{i}' for i in range(5000)] # Grows several times
+        for url in urls:
+            visited.add(url)
+        visited.add(urls[0])
+        self.assertEqual(len(visited), len(urls))
+        self.assertTrue(all(url in visited for url in urls))
+        self.assertNotIn('http://example.com/5000', visited)
+
+
+class LinkRulesTests(SimpleTestCase):
+
+    def test_rules_with_backreferences_and_named_groups(self):
+        rules = LinkRules(
+            include=[r're:^/(de|fr)/(\w+)/\2\.html$', 're:(?P<rule0>/blog/)', r're:(?P<year>\d{4})/(?P=year)', '/docs/*'],
+            exclude=['re:^/(de|fr)/draft/'],
+        )
+        for target, reason in [
+            ('/de/intro/intro.html', None),
+            ('/de/intro/setup.html', 'not included'),
+            ('/fr/draft/draft.html', 'exclude: re:^/(de|fr)/draft/'),
+            ('/blog/post', None),
+            ('/archive/2024/2024', None),
+            ('/archive/2024/2025', 'not included'),
+            ('/docs/api', None),
+        ]:
+            with self.subTest(target=target):
+                self.assertEqual(rules.drop_reason(target), reason)
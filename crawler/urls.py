@@ -8,7 +8,11 @@ urlpatterns = [
     # API endpoints for MCP server
     path('api/search_pages/', views.search_pages_api, name='api_search_pages'),
     path('api/get_content/', views.get_content_api, name='api_get_content'),
+    path('api/get_outline/', views.get_outline_api, name='api_get_outline'),
+    path('api/search_cache/', views.search_cache_stats_api, name='api_search_cache'),
     # API endpoint for checking crawl status
-    path('api/crawl_status/<int:page_id>/', views.crawl_status_api, name='api_crawl_status'),
+    path('api/crawl_status/<int:job_id>/', views.crawl_status_api, name='api_crawl_status'),
+    # Server-Sent Events stream of a crawl's progress
+    path('api/crawl_status/<int:job_id>/events/', views.crawl_events_api, name='api_crawl_events'),
     # Add other app-specific URLs here later
 ]
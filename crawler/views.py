@@ -2,15 +2,27 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
+from asgiref.sync import sync_to_async
 from urllib.parse import urlparse
-from django.http import JsonResponse, HttpRequest, HttpResponseBadRequest
+from django.http import JsonResponse, HttpRequest, HttpResponseBadRequest, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Q # For complex lookups
 from datetime import datetime # For date filtering
+import json
+import logging
 
 from .forms import UrlSubmitForm
-from .models import CrawledPage
-from .tasks import crawl_site # Import the main crawl function
-import threading # Import threading
+from .models import CrawledPage, CrawlJob
+from .content import CONTENT_FORMATS, load_page_content, load_page_outline
+from .jobs import create_crawl_job
+from .progress import get_broadcaster, load_job_status, sse_event
+from .search import decode_cursor, search_results
+from .search_cache import get_search_cache
+
+# Search results read from the database per query while streaming a response
+SEARCH_STREAM_BATCH = 500
+# Fields of each search result
+SEARCH_RESULT_FIELDS = ('url', 'title', 'summary', 'domain', 'updated_at')
 
 class SubmitUrlView(View):
     """
@@ -31,9 +43,17 @@ class SubmitUrlView(View):
             url_to_crawl = form.cleaned_data['url']
             max_pages = form.cleaned_data.get('max_pages')
             max_depth = form.cleaned_data.get('max_depth')
+            concurrency = form.cleaned_data.get('concurrency')
+            rate_limit = form.cleaned_data.get('rate_limit')
+            refresh = form.cleaned_data.get('refresh', False)
             restrict_to_path = form.cleaned_data.get('restrict_to_path', False) # Get the checkbox value
+            use_sitemaps = form.cleaned_data.get('use_sitemaps', False)
+            retry_errors = form.cleaned_data.get('retry_errors', [])
+            include_rules = form.cleaned_data.get('include_rules', '')
+            exclude_rules = form.cleaned_data.get('exclude_rules', '')
 
             # --- Trigger the crawl ---
+            job = None
             try:
                 # Calculate base_path if restriction is enabled
                 base_path = None
@@ -55,8 +75,13 @@ class SubmitUrlView(View):
                     url=url_to_crawl,
                     defaults={'domain': domain, 'status': CrawledPage.StatusChoices.PENDING}
                 )
-                # If it already existed, ensure it's marked as pending for this new crawl request
-                if not created and page.status != CrawledPage.StatusChoices.PENDING:
+                # If it already existed, ensure it's marked as pending for this new crawl request.
+                # A refresh keeps the stored content and validators for the conditional request.
+                if not created and refresh:
+                    page.status = CrawledPage.StatusChoices.PENDING
+                    page.error_message = None
+                    page.save(update_fields=['status', 'error_message'])
+                elif not created and page.status != CrawledPage.StatusChoices.PENDING:
                     page.status = CrawledPage.StatusChoices.PENDING
                     # Reset other fields if needed? For now, just status.
                     page.title = ''
@@ -64,20 +89,29 @@ class SubmitUrlView(View):
                     page.error_message = None
                     page.save(update_fields=['status', 'title', 'summary', 'error_message', 'updated_at'])
 
-                # 2. Start the crawl function in a background thread
-                # NOTE: Using basic threading is simpler for now but less robust than
-                # a dedicated task queue like Celery for handling failures, retries, etc.
-                crawl_thread = threading.Thread(
-                    target=crawl_site,
-                    args=(page.id, max_pages, max_depth, restrict_to_path, base_path),
-                    # Pass page.id instead of url_to_crawl, assuming crawl_site is updated
-                    daemon=True # Allows the main process to exit even if thread is running
+                # 2. Queue the crawl job; a `manage.py crawl_worker` process picks it up
+                job = create_crawl_job(
+                    page,
+                    max_pages=max_pages,
+                    max_depth=max_depth,
+                    restrict_to_path=restrict_to_path,
+                    base_path=base_path,
+                    concurrency=concurrency,
+                    rate_limit=rate_limit,
+                    refresh=refresh,
+                    include_rules=include_rules,
+                    exclude_rules=exclude_rules,
+                    use_sitemaps=use_sitemaps,
+                    retry_errors=retry_errors,
                 )
-                crawl_thread.start()
 
-                success_message = f"Crawl initiated in background for: {url_to_crawl}"
+                success_message = f"Crawl queued for: {url_to_crawl}"
                 if restrict_to_path:
                     success_message += f" (restricted to path: {base_path})"
+                if refresh:
+                    success_message += " (refreshing changed pages only)"
+                elif retry_errors:
+                    success_message += f" (retrying pages that failed with: {', '.join(retry_errors)})"
                 messages.success(request, _(success_message))
 
             except Exception as e:
@@ -88,11 +122,11 @@ class SubmitUrlView(View):
 
             # --- End Trigger ---
 
-            # Re-render the same page, passing the initial page ID for polling
+            # Re-render the same page, passing the job ID for polling
             # Manually create context as base View doesn't have get_context_data
             context = {
                 'form': form, # Show the form again (contains submitted data)
-                'start_polling_page_id': page.id # Pass ID to template for status polling
+                'start_polling_job_id': job.id if job else None # Pass ID to template for status polling
             }
             return render(request, self.template_name, context)
 
@@ -109,24 +143,43 @@ submit_url_view = SubmitUrlView.as_view()
 
 def search_pages_api(request: HttpRequest):
     """
-    API endpoint to search crawled pages by keyword in title or summary.
-    Expects a 'keyword' GET parameter.
-    Optional GET parameters: 'domain', 'start_date' (YYYY-MM-DD), 'end_date' (YYYY-MM-DD).
+    API endpoint to search crawled pages by keyword in their title, summary or
+    text, best matches first (see crawler.search). Expects a 'keyword' GET parameter.
+    Optional GET parameters: 'domain', 'start_date' (YYYY-MM-DD), 'end_date' (YYYY-MM-DD),
+    'limit' (the most results to return; all of them by default) and 'cursor'.
+
+    Responds with {"results": [...], "next_cursor": ...}, streamed as it is
+    read from the database. Each result has a 'cursor'; pass a result's cursor
+    (or next_cursor, which is null when there are no more results) to continue
+    after it.
     """
     keyword = request.GET.get('keyword')
     domain_filter = request.GET.get('domain')
     start_date_str = request.GET.get('start_date')
     end_date_str = request.GET.get('end_date')
+    limit_str = request.GET.get('limit')
+    cursor = request.GET.get('cursor')
 
     if not keyword:
         return HttpResponseBadRequest(JsonResponse({'error': "Missing 'keyword' query parameter."}, status=400))
 
+    limit = None # All results
+    if limit_str:
+        try:
+            limit = int(limit_str)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return HttpResponseBadRequest(JsonResponse({'error': "'limit' must be a positive integer."}, status=400))
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            return HttpResponseBadRequest(JsonResponse({'error': "Invalid 'cursor'."}, status=400))
+
     try:
-        # Base filters: keyword search and completed status
-        filters = Q(
-            Q(title__icontains=keyword) | Q(summary__icontains=keyword),
-            status=CrawledPage.StatusChoices.COMPLETED
-        )
+        # Base filter: completed status (the keyword is matched against the search index below)
+        filters = Q(status=CrawledPage.StatusChoices.COMPLETED)
 
         # Add optional domain filter
         if domain_filter:
@@ -147,18 +200,12 @@ def search_pages_api(request: HttpRequest):
             except ValueError:
                 return HttpResponseBadRequest(JsonResponse({'error': "Invalid 'end_date' format. Use YYYY-MM-DD."}, status=400))
 
-        # Apply all filters
-        matching_pages = CrawledPage.objects.filter(filters).values(
-            'url', 'title', 'summary', 'domain', 'updated_at' # Include domain and timestamp in results
-        )
-
-        # Convert datetime objects to ISO format strings for JSON serialization
-        results_list = list(matching_pages)
-        for page in results_list:
-            if isinstance(page.get('updated_at'), datetime):
-                page['updated_at'] = page['updated_at'].isoformat()
-
-        return JsonResponse({'results': results_list})
+        # Apply all filters, ranked by relevance
+        pages = CrawledPage.objects.filter(filters)
+        stream = _stream_search_results if isinstance(request, ASGIRequest) else _search_result_chunks
+        response = StreamingHttpResponse(stream(pages, keyword, limit, cursor), content_type='application/json')
+        response['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the stream
+        return response
 
     except Exception as e:
         # Log the error internally if needed
@@ -166,92 +213,162 @@ def search_pages_api(request: HttpRequest):
         return JsonResponse({'error': 'An internal error occurred during search.'}, status=500)
 
 
+def _search_result_chunks(pages, keyword, limit, cursor):
+    """
+    Yields the search_pages_api JSON, one chunk per SEARCH_STREAM_BATCH results
+    read with keyset pagination, so large result sets are never held in memory.
+    """
+    yield '{"results": ['
+    separator = ''
+    remaining = limit
+    try:
+        while True:
+            batch_size = SEARCH_STREAM_BATCH if remaining is None else min(remaining, SEARCH_STREAM_BATCH)
+            results, cursor = search_results(pages, keyword, SEARCH_RESULT_FIELDS, batch_size, cursor)
+            for result in results:
+                result['updated_at'] = result['updated_at'].isoformat()
+            if results:
+                yield separator + ', '.join(json.dumps(result) for result in results)
+                separator = ', '
+            if remaining is not None:
+                remaining -= len(results)
+            if cursor is None or remaining == 0:
+                break
+    except Exception as e:
+        # The status line has been sent; report the error in the body instead
+        logging.error(f"Error while streaming search results for '{keyword}': {e}")
+        yield f'], "error": "An internal error occurred during search."}}'
+        return
+    yield f'], "next_cursor": {json.dumps(cursor)}}}'
+
+
+async def _stream_search_results(pages, keyword, limit, cursor):
+    """
+    _search_result_chunks as an async iterator, each chunk read in a thread:
+    under ASGI, Django reads a sync iterator to the end before sending any of
+    it, while WSGI servers stream a sync one as it is.
+    """
+    chunks = _search_result_chunks(pages, keyword, limit, cursor)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
 def get_content_api(request: HttpRequest):
     """
-    API endpoint to retrieve the HTML content of a specific crawled page.
+    API endpoint to retrieve the content of a specific crawled page.
     Expects a 'url' GET parameter.
+    Optional 'format' GET parameter: 'html' (default; the raw HTML as
+    'html_content') or 'markdown' (the main content extracted at crawl time,
+    as 'content'; usually a fraction of the size).
+    Optional 'section' (an index from get_outline_api), 'offset' and 'length'
+    (in characters) GET parameters return part of the Markdown.
     """
     page_url = request.GET.get('url')
+    content_format = request.GET.get('format', 'html')
     if not page_url:
         return HttpResponseBadRequest(JsonResponse({'error': "Missing 'url' query parameter."}, status=400))
+    if content_format not in CONTENT_FORMATS:
+        return HttpResponseBadRequest(JsonResponse({'error': f"Invalid 'format'. Use one of: {', '.join(CONTENT_FORMATS)}."}, status=400))
+    try:
+        section, offset, length = (
+            int(request.GET[name]) if request.GET.get(name) else None for name in ('section', 'offset', 'length')
+        )
+    except ValueError:
+        return HttpResponseBadRequest(JsonResponse({'error': "'section', 'offset' and 'length' must be integers."}, status=400))
 
     try:
-        # Use get_object_or_404 for cleaner handling of not found pages
-        page = get_object_or_404(CrawledPage, url=page_url, status=CrawledPage.StatusChoices.COMPLETED)
+        completed_pages = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED)
+        page_content = load_page_content(completed_pages, page_url, content_format, section, offset, length)
 
-        return JsonResponse({
-            'url': page.url,
-            'html_content': page.html_content or "" # Return empty string if content is None/null
-        })
+        if content_format == 'html':
+            return JsonResponse({
+                'url': page_content['url'],
+                'html_content': page_content['content'] # Empty string if content is None/null
+            })
+        return JsonResponse(page_content)
 
     except CrawledPage.DoesNotExist:
-         # This case is handled by get_object_or_404, but kept for clarity if we change the query
          return JsonResponse({'error': f"Page with URL '{page_url}' not found or not completed."}, status=404)
+    except ValueError as e: # A section the page doesn't have, or a range with HTML
+        return HttpResponseBadRequest(JsonResponse({'error': str(e)}, status=400))
     except Exception as e:
         # Log the error internally if needed
         # logger.error(f"Error during API content retrieval for URL '{page_url}': {e}")
         return JsonResponse({'error': 'An internal error occurred while retrieving content.'}, status=500)
 
 
-# --- API View for Crawl Status ---
+def get_outline_api(request: HttpRequest):
+    """
+    API endpoint to retrieve the outline of a crawled page: the sections of
+    its Markdown content by heading, with their character offsets and
+    approximate token counts, so a client can fetch only the sections it
+    needs with get_content_api. Expects a 'url' GET parameter.
+    """
+    page_url = request.GET.get('url')
+    if not page_url:
+        return HttpResponseBadRequest(JsonResponse({'error': "Missing 'url' query parameter."}, status=400))
+    try:
+        completed_pages = CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED)
+        return JsonResponse(load_page_outline(completed_pages, page_url))
+    except CrawledPage.DoesNotExist:
+        return JsonResponse({'error': f"Page with URL '{page_url}' not found or not completed."}, status=404)
+    except Exception as e:
+        logging.error(f"Error during API outline retrieval for URL '{page_url}': {e}")
+        return JsonResponse({'error': 'An internal error occurred while retrieving the outline.'}, status=500)
+
+
+def search_cache_stats_api(request: HttpRequest):
+    """
+    API endpoint reporting this process's search result cache: its size and
+    hit, miss, invalidation, expiration and eviction counts since it started.
+    """
+    return JsonResponse(get_search_cache().stats())
 
-from django.db.models import Count
 
-def crawl_status_api(request: HttpRequest, page_id: int):
+# --- API View for Crawl Status ---
+
+def crawl_status_api(request: HttpRequest, job_id: int):
     """
-    API endpoint to get the status of a crawl job, identified by the ID
-    of the initial page submitted. Returns summary statistics.
+    API endpoint to get the status of a crawl job. Returns summary statistics
+    from the job's counters, which the crawler keeps up to date as pages change
+    state, so this is a single primary-key lookup however large the crawl is.
+    Browsers watching a crawl should prefer crawl_events_api.
     """
     try:
-        # Get the initial page that started this conceptual "job"
-        initial_page = get_object_or_404(CrawledPage, pk=page_id)
-        domain = initial_page.domain
-
-        # Query related pages for the same domain initiated around the same time
-        # This assumes pages from the same crawl job share the domain and were created
-        # at or after the initial page. This might need refinement if jobs overlap heavily.
-        pages_in_job = CrawledPage.objects.filter(
-            domain=domain,
-            crawled_at__gte=initial_page.crawled_at # Filter by creation time
-        )
+        data = load_job_status(job_id)
+    except CrawlJob.DoesNotExist:
+        return JsonResponse({'error': f'Crawl job {job_id} not found.'}, status=404)
+    return JsonResponse(data)
 
-        # Calculate counts for each status
-        status_counts = pages_in_job.values('status').annotate(count=Count('id')).order_by('status')
-        total_pages = pages_in_job.count()
-
-        # Determine if any pages are still actively being processed or pending
-        is_processing = pages_in_job.filter(
-            status__in=[CrawledPage.StatusChoices.PENDING, CrawledPage.StatusChoices.PROCESSING]
-        ).exists()
-
-        # Determine an overall status for the UI display
-        # If anything is still processing/pending, the job is 'PROCESSING'
-        # Otherwise, if the initial page failed, the job is 'FAILED'
-        # Otherwise, it's 'COMPLETED' (assuming the initial page completed)
-        overall_status = initial_page.status # Start with the initial page's status
-        if is_processing:
-            overall_status = CrawledPage.StatusChoices.PROCESSING
-        elif initial_page.status == CrawledPage.StatusChoices.FAILED:
-             overall_status = CrawledPage.StatusChoices.FAILED
-        elif not is_processing and initial_page.status == CrawledPage.StatusChoices.COMPLETED:
-             # Only truly completed if nothing else is pending/processing
-             overall_status = CrawledPage.StatusChoices.COMPLETED
-        # Note: This logic might need adjustment based on how the background task signals completion.
-
-        data = {
-            'initial_page_id': initial_page.id,
-            'initial_page_status': initial_page.status,
-            'overall_status': overall_status,
-            'total_pages_found': total_pages,
-            'status_breakdown': list(status_counts), # e.g., [{'status': 'completed', 'count': 5}, ...]
-            'is_processing': is_processing, # Explicit flag for JS to know when to stop polling
-            'error_message': initial_page.error_message if initial_page.status == CrawledPage.StatusChoices.FAILED else None,
-        }
-        return JsonResponse(data)
 
-    except CrawledPage.DoesNotExist:
-        return JsonResponse({'error': f'Crawl job with initial page ID {page_id} not found.'}, status=404)
-    except Exception as e:
-         # Log the error e
-         # logger.exception(f"Error in crawl_status_api for page_id {page_id}: {e}")
-         return JsonResponse({'error': 'An internal error occurred while fetching crawl status.'}, status=500)
+async def crawl_events_api(request: HttpRequest, job_id: int):
+    """
+    Server-Sent Events stream of a crawl job's progress: a `progress` event
+    (the crawl_status_api payload plus queue_depth and pages_per_sec) whenever
+    the job's counters change, then a final `done` event when the job has
+    finished, after which the stream is closed. All watchers of a job share
+    one reader of its counters (see crawler.progress).
+    """
+    broadcaster = get_broadcaster()
+    events = broadcaster.watch(job_id)
+    try:
+        first = await events.__anext__()
+    except CrawlJob.DoesNotExist:
+        return JsonResponse({'error': f'Crawl job {job_id} not found.'}, status=404)
+
+    async def stream():
+        try:
+            event, data = first
+            while True:
+                yield ': keepalive\n\n' if event == 'keepalive' else sse_event(event, data)
+                event, data = await events.__anext__()
+        except StopAsyncIteration:
+            pass
+        finally:
+            await events.aclose()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the stream
+    return response
@@ -1,3 +1,113 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
 
-# Create your tests here.
+from django.test import TransactionTestCase
+
+from crawler.models import CrawledPage, PageBody
+from crawler.search import index_pages
+from crawler.search_cache import get_search_cache
+from crawler.batching import PageWriteBuffer
+from crawler.content import MAX_BATCH_PAGES
+from mcp_server.tools import find_pages, get_page_content, get_pages
+
+
+class GetPageContentTests(TransactionTestCase):
+    # The tools read on pool threads, each with its own connection: the pages must be committed
+
+    def setUp(self):
+        self.url = 'http://example.com/guide'
+        body = PageBody.from_html('<html><body><h1>Guide</h1></body></html>')
+        body.save()
+        CrawledPage.objects.create(
+            url=self.url, domain='example.com', status=CrawledPage.StatusChoices.COMPLETED,
+            body=body, content_markdown='# Guide',
+        )
+
+    def call(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()): # The tools log every call
+            return asyncio.run(get_page_content(self.url, **kwargs))
+
+    def test_raw_html_by_default(self):
+        self.assertEqual(self.call(), {'url': self.url, 'html_content': '<html><body><h1>Guide</h1></body></html>'})
+
+    def test_markdown_on_request(self):
+        result = self.call(format='markdown')
+        self.assertEqual((result['format'], result['content']), ('markdown', '# Guide'))
+
+
+class GetPagesTests(TransactionTestCase):
+
+    def setUp(self):
+        for name in ('a', 'b', 'c'):
+            CrawledPage.objects.create(
+                url=f'http://example.com/{name}', domain='example.com', status=CrawledPage.StatusChoices.COMPLETED,
+                content_markdown=f'# Page {name}\n\n' + 'text ' * 20,
+            )
+        CrawledPage.objects.create(
+            url='http://example.com/failed', domain='example.com', status=CrawledPage.StatusChoices.FAILED,
+            content_markdown='# Stale',
+        )
+
+    def call(self, urls, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return asyncio.run(get_pages(urls, **kwargs))
+
+    def test_results_in_request_order_with_per_url_errors(self):
+        urls = ['http://example.com/c', 'http://example.com/missing', {'url': 'http://example.com/a'}, 'http://example.com/failed']
+        results = self.call(urls)
+        self.assertEqual(
+            [result['url'] for result in results],
+            ['http://example.com/c', 'http://example.com/missing', 'http://example.com/a', 'http://example.com/failed'],
+        )
+        self.assertTrue(results[0]['content'].startswith('# Page c'))
+        self.assertTrue(results[2]['content'].startswith('# Page a'))
+        for result in (results[1], results[3]):
+            self.assertEqual(set(result), {'url', 'error'})
+
+    def test_max_chars_truncates(self):
+        short, whole = self.call(['http://example.com/b', 'http://example.com/a'], max_chars=8), self.call(['http://example.com/a'])
+        self.assertEqual((short[0]['content'], short[0]['truncated']), ('# Page b', True))
+        self.assertEqual(short[1]['content'], '# Page a')
+        self.assertFalse(whole[0]['truncated'])
+
+    def test_at_most_100_urls(self):
+        self.assertEqual(MAX_BATCH_PAGES, 100)
+        urls = ['http://example.com/a'] * MAX_BATCH_PAGES
+        self.assertEqual(len(self.call(urls)), MAX_BATCH_PAGES)
+        self.assertEqual(list(self.call(urls + ['http://example.com/b'])[0]), ['error'])
+
+
+class FindPagesCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        self.page = CrawledPage.objects.create(
+            url='http://example.com/install', domain='example.com', title='Install',
+            summary='Old summary', status=CrawledPage.StatusChoices.COMPLETED,
+        )
+        index_pages([(self.page.pk, 'Install', 'Old summary', 'How to install')])
+        get_search_cache().clear()
+
+    def search(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return asyncio.run(find_pages('install', domain='example.com'))
+
+    def test_crawled_page_invalidates_cached_results(self):
+        cache = get_search_cache()
+        self.assertEqual(self.search()[0]['summary'], 'Old summary')
+        hits, misses = cache.hits, cache.misses
+        self.search()
+        self.assertEqual((cache.hits, cache.misses), (hits + 1, misses))
+
+        # What the crawl loop does with a re-crawled page
+        page = CrawledPage.objects.get(pk=self.page.pk)
+        page.title, page.summary = 'Install guide', 'New summary'
+        buffer = PageWriteBuffer()
+        buffer.mark_processing(page)
+        page.status = CrawledPage.StatusChoices.COMPLETED
+        buffer.save(page, ['status', 'title', 'summary'], text='How to install, step by step')
+        buffer.flush()
+
+        result = self.search()[0]
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertEqual((result['title'], result['summary']), ('Install guide', 'New summary'))
@@ -4,26 +4,60 @@
 from django_mcp import mcp_app as mcp
 from asgiref.sync import sync_to_async
 
+from crawler.content import load_page_content, load_page_outline, load_pages_content
 from crawler.models import CrawledPage
+from crawler.search import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, search_results
+from crawler.routers import replica_reads
+from crawler.search_cache import get_search_cache, normalize_query
+from django.db import connections
 from django.db.models import Q
 from datetime import datetime
 
 # Note: Consider making these async if interactions become complex or involve I/O.
 # django-mcp supports async functions.
 
+def read_only(function):
+    """
+    Wraps a synchronous, read-only ORM function for use from the async tools.
+    sync_to_async runs every call on one shared thread by default (as does
+    Django's async query API, which is built on it), so concurrent tool calls
+    would queue behind each other. Read-only calls can safely run in parallel
+    on the thread pool instead, each thread with its own connection, reading
+    from the read database (see crawler.routers). Pool threads keep their
+    connection between calls (reconnecting costs more than most tool queries),
+    unless it broke.
+    """
+    def run(*args, **kwargs):
+        try:
+            with replica_reads():
+                return function(*args, **kwargs)
+        finally:
+            for connection in connections.all(initialized_only=True):
+                if connection.errors_occurred:
+                    connection.close_if_unusable_or_obsolete()
+    return sync_to_async(run, thread_sensitive=False)
+
+
 @mcp.tool()
-async def find_pages(keyword: str, domain: str = None, start_date: str = None, end_date: str = None) -> list[dict]:
+async def find_pages(keyword: str, domain: str = None, start_date: str = None, end_date: str = None,
+                     limit: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> list[dict]:
     """
-    Search crawled pages by keyword in title or summary.
-    Optionally filters by domain and date range.
+    Search crawled pages by keyword in title, summary or page text, best matches first.
+    Optionally filters by domain and date range. Returns up to `limit` results
+    (at most 500); to get the next page, call again with the same arguments and
+    `cursor` set to the last result's "cursor". Repeated searches are answered from
+    a cache until the crawler changes the pages searched.
     """
-    print(f"Executing find_pages: keyword='{keyword}', domain='{domain}', start='{start_date}', end='{end_date}'") # Basic logging
+    print(f"Executing find_pages: keyword='{keyword}', domain='{domain}', start='{start_date}', end='{end_date}', "
+          f"limit={limit}, cursor='{cursor}'") # Basic logging
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
 
-    filters = Q(title__icontains=keyword) | Q(summary__icontains=keyword)
+    filters = Q(status=CrawledPage.StatusChoices.COMPLETED)
 
     if domain:
         filters &= Q(domain=domain)
 
+    start_dt = end_dt = None
     try:
         if start_date:
             start_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
@@ -37,43 +71,60 @@ async def find_pages(keyword: str, domain: str = None, start_date: str = None, e
         # Or return an error structure? For now, just proceed without date filter.
         pass
 
+    keyword = normalize_query(keyword)
+
+    def search():
+        results, _ = search_results(
+            CrawledPage.objects.filter(filters), keyword, ("url", "title", "summary", "domain", "updated_at"),
+            limit, cursor,
+        )
+        for result in results:
+            result["updated_at"] = result["updated_at"].isoformat() # Use ISO format for consistency
+        return results
+
     # Query the database asynchronously
-    # Use sync_to_async to wrap the synchronous ORM call
-    # list() ensures the QuerySet is evaluated within the sync context
-    matching_pages_qs = CrawledPage.objects.filter(filters).order_by('-updated_at')[:50]
-    matching_pages = await sync_to_async(list)(matching_pages_qs)
-
-    # Format the results
-    results_list = [
-        {
-            "url": page.url,
-            "title": page.title,
-            "summary": page.summary,
-            "domain": page.domain,
-            "updated_at": page.updated_at.isoformat() # Use ISO format for consistency
-        }
-        for page in matching_pages
-    ]
+    # Use read_only to wrap the synchronous ORM calls (full_text_search may
+    # inspect the database); search_results evaluates the QuerySet within the sync context
+    cache_key = ("find_pages", keyword, domain, start_dt, end_dt, limit, cursor)
+    try:
+        results_list = await read_only(get_search_cache().get_or_compute)(cache_key, domain, search)
+    except ValueError as e:
+        print(f"{e}") # Basic logging
+        return [{"error": "Invalid cursor; pass the 'cursor' of a result from a previous find_pages call."}]
+    results_list = [dict(result) for result in results_list] # The cached results stay as they are
 
     print(f"Found {len(results_list)} pages.") # Basic logging
     return results_list
 
 @mcp.tool()
-async def get_page_content(url: str) -> dict:
+async def get_page_content(url: str, format: str = "html", section: int = None,
+                           offset: int = None, length: int = None) -> dict:
     """
-    Get the stored HTML content for a specific crawled URL.
+    Get the stored content for a specific crawled URL.
+    format="html" (default) returns the raw HTML as "html_content"; format="markdown"
+    returns the page's main content as Markdown in "content", without navigation,
+    scripts or styling, usually a fraction of the size.
+    For large pages, call get_page_outline first and pass format="markdown" with
+    `section` (a section's index) to get just that section, and/or `offset` and
+    `length` (in characters, relative to the section if one is given) to get part
+    of the Markdown.
     """
-    print(f"Executing get_page_content for URL: {url}") # Basic logging
+    print(f"Executing get_page_content for URL: {url} (format: {format}, section: {section}, "
+          f"offset: {offset}, length: {length})") # Basic logging
     try:
-        # Use sync_to_async for the synchronous ORM call
-        page = await sync_to_async(CrawledPage.objects.get)(url=url)
+        # Use read_only for the synchronous ORM call
+        page_content = await read_only(load_page_content)(
+            CrawledPage.objects.all(), url, format, section, offset, length
+        )
         print(f"Found page content.") # Basic logging
-        return {
-            "url": page.url,
-            "html_content": page.html_content
-        }
+        if format == 'html':
+            return {
+                "url": page_content["url"],
+                "html_content": page_content["content"]
+            }
+        return page_content
     except CrawledPage.DoesNotExist:
-        # This exception is raised by sync_to_async if the underlying sync function raises it
+        # This exception is raised by read_only if the underlying sync function raises it
         print(f"Page not found.") # Basic logging
         # How should errors be represented in MCP tool results?
         # Returning a specific structure or raising an exception handled by the view?
@@ -82,3 +133,49 @@ async def get_page_content(url: str) -> dict:
     except Exception as e:
         print(f"Error retrieving page content: {e}") # Basic logging
         return {"error": f"An error occurred: {str(e)}", "url": url}
+
+@mcp.tool()
+async def get_page_outline(url: str) -> dict:
+    """
+    Get the outline of a crawled page's Markdown content: its sections by heading
+    (index, level, title, start and end character offsets, approximate tokens).
+    Use it to fetch only the sections you need with get_page_content(section=...).
+    """
+    print(f"Executing get_page_outline for URL: {url}") # Basic logging
+    try:
+        return await read_only(load_page_outline)(CrawledPage.objects.all(), url)
+    except CrawledPage.DoesNotExist:
+        print(f"Page not found.") # Basic logging
+        return {"error": "Page not found in database", "url": url}
+    except Exception as e:
+        print(f"Error retrieving page outline: {e}") # Basic logging
+        return {"error": f"An error occurred: {str(e)}", "url": url}
+
+@mcp.tool()
+async def get_pages(urls: list[str | dict], format: str = "markdown", max_chars: int = None) -> list[dict]:
+    """
+    Get the stored content of several crawled pages at once (up to 100), instead of
+    calling get_page_content for each. `urls` are page URLs, or find_pages results.
+    format="markdown" (default) or "html", as for get_page_content. With max_chars, each page's content is cut to
+    that many characters ("truncated" says whether it was); use get_page_outline and
+    get_page_content to read the rest of a page.
+    Returns one result per URL, in the same order; a URL that can't be loaded (not
+    crawled, or its crawl failed) gets an "error" instead of "content".
+    """
+    # Search hits are dicts with a "url"
+    urls = [entry.get("url", "") if isinstance(entry, dict) else entry for entry in urls]
+    print(f"Executing get_pages for {len(urls)} URLs (format: {format}, max_chars: {max_chars})") # Basic logging
+    try:
+        results = await read_only(load_pages_content)(
+            CrawledPage.objects.filter(status=CrawledPage.StatusChoices.COMPLETED), urls, format, max_chars
+        )
+    except ValueError as e:
+        print(f"{e}") # Basic logging
+        return [{"error": str(e)}]
+    print(f"Found {sum('error' not in result for result in results)} of {len(urls)} pages.") # Basic logging
+    if format == 'html':
+        # Same shape as get_page_content's HTML results
+        for result in results:
+            if "content" in result:
+                result["html_content"] = result.pop("content")
+    return results